@@ -5,132 +5,203 @@ Created on Sun May 11 08:45:30 2025
 @author: scedermas
 """
 
+import os
+import time
+from functools import partial
+
 import streamlit as st
-import google.generativeai as genai # Importar la librería de Gemini
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 import pyperclip
 import speech_recognition as sr
 from audiorecorder import audiorecorder
 
-# ... (otras importaciones que ya tienes como speech_recognition, audiorecorder, etc.)
+from audio_processing import normalize_for_recognition, recording_fingerprint
+from database import ScriptsRepository, get_pool
+from gemini_models import build_gemini_models
+from job_queue import CANCELLED, DONE, FAILED, PENDING, TIMEOUT, JobQueue
+import metrics
+from metrics import (GEMINI_REQUEST_SECONDS, GEMINI_TOKENS, RERUN_SECONDS, REGISTRY, SQLITE_QUERY_SECONDS,
+                     STT_AUDIO_SECONDS, STT_REQUEST_SECONDS, render_prometheus, run_as_agent)
+from recognizers import DEFAULT_ENGINE, create_recognizer, get_engine_timings
+from resilience import CircuitOpenError, get_client, get_clients_stats
+from rewrite_cache import RewriteCache
+from rewriting import REWRITE_STYLES, generate_styled_rewrite_or_fallback
+from script_ranking import RankedScripts
+from script_templates import KNOWN_FIELDS, TemplateError, compile_template, get_compiled_template
+from suggestions import (CLOSING_LINE, SALES_BRIDGE, SOURCE_CACHE, SOURCE_FALLBACK, SOURCE_STRUCTURED, SURVEY_INVITATION,
+                         SuggestionCache, generate_post_resolution, generate_suggestion)
+from transcription_cache import TranscriptionCache, audio_cache_key
+from transcription_pipeline import transcribe_stream
+
+rerun_started_at = time.perf_counter()
+
+def get_config(name, default=None):
+    # Primero los secretos de Streamlit y, si no existen, las variables de entorno
+    try:
+        return st.secrets[name]
+    except (FileNotFoundError, KeyError):
+        return os.environ.get(name, default)
 
-# --- Configuración de la API Key de Gemini y Modelo (como la tienes) ---
-try:
-    GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
-except (FileNotFoundError, KeyError): # Manejar ambos errores si secrets.toml no existe o la key no está.
-    GOOGLE_API_KEY = "TU_GOOGLE_API_KEY_AQUI" # Placeholder
-    if GOOGLE_API_KEY == "TU_GOOGLE_API_KEY_AQUI":
-        st.warning("API Key de Google Gemini no configurada de forma segura. Funcionalidad de IA limitada.")
-
-def get_prompt_for_style(text_to_rewrite, style_key):
-    base_instructions = """
-    Eres un asistente experto en comunicación y redacción en español.
-    Tu tarea es tomar la 'Frase original' y transformarla en una 'Frase reescrita'.
-    Asegúrate de que la 'Frase reescrita' utilice impecablemente los signos de puntuación (comas, puntos, interrogaciones, exclamaciones, etc.),
-    las mayúsculas y minúsculas según las normas del español, y todos los acentos (tildes) necesarios.
-    Entrega únicamente la frase reescrita, sin introducciones, comentarios sobre tu proceso, ni despedidas.
-    """
+# ... (otras importaciones que ya tienes como speech_recognition, audiorecorder, etc.)
 
-    style_specific_instructions = ""
-    if style_key == "concise_clear":
-        style_specific_instructions = """
-        El estilo debe ser **Conciso y Claro**:
-        - Ve directo al punto, eliminando cualquier redundancia o palabra innecesaria.
-        - El mensaje debe ser breve, fácil de entender y profesional.
-        """
-    elif style_key == "sales_persuasive":
-        style_specific_instructions = """
-        El estilo debe ser **Vendedor Persuasivo**:
-        - Utiliza un lenguaje que incite a la acción o genere fuerte interés en un producto/servicio.
-        - Destaca beneficios clave y el valor de lo que se ofrece.
-        - Puede ser un poco más entusiasta y directo en su persuasión.
-        """
-    elif style_key == "creative_resolution":
-        style_specific_instructions = """
-        El estilo debe ser **Creativo y Resolutivo, enfocado en la Satisfacción**:
-        - Adopta un tono empático, cálido y tranquilizador.
-        - Sé creativo en la forma de expresar la solución o el mensaje.
-        - El enfoque principal es la satisfacción del cliente y la resolución efectiva y positiva de su consulta o necesidad.
-        - El lenguaje debe ser fluido y natural, buscando una conexión genuina.
-        """
-    elif style_key == "ideal_versatile":
-        style_specific_instructions = """
-        El estilo debe ser una **Combinación Ideal y Versátil**:
-        - **Claridad Fundamental:** El mensaje siempre debe ser claro y fácil de entender. Usa la concisión cuando sea apropiado, pero no a expensas de la amabilidad o la completitud.
-        - **Toque Persuasivo (Contextual):** Si la frase original lo amerita o sugiere una oportunidad, incorpora sutilmente elementos persuasivos, enfocados en el valor o los beneficios, sin ser agresivo.
-        - **Enfoque en el Cliente y Creatividad:** Prioriza la empatía, la satisfacción y la resolución. Usa un lenguaje creativo y natural para conectar y transmitir confianza. Adapta la calidez y el detalle según el contexto implícito.
-        - El objetivo es una comunicación profesional, efectiva y adaptativa.
-        """
-
-    return f"{base_instructions}\n{style_specific_instructions}\nFrase original: \"{text_to_rewrite}\"\nFrase reescrita:"
-
-
-def rewrite_text_styled_gemini(text_to_rewrite, style_key):
-    if not model_rewrite: # Asegúrate de que 'model_rewrite' sea tu modelo Gemini inicializado
-        return "Error: Modelo Gemini para reescritura no inicializado (revisa la API Key)."
-
-    prompt = get_prompt_for_style(text_to_rewrite, style_key)
-    
-    try:
-        response = model_rewrite.generate_content(prompt)
-        rewritten_text = response.text.strip()
-        
-        # Limpieza opcional si el modelo a veces incluye el prefijo "Frase reescrita:"
-        if rewritten_text.lower().startswith("frase reescrita:"):
-            rewritten_text = rewritten_text[len("frase reescrita:"):].strip()
-            
-        return rewritten_text
-    except Exception as e:
-        st.error(f"Error al reescribir el texto con Gemini (Estilo: {style_key}): {e}")
-        # Para depuración, puedes imprimir o loguear el prompt completo si es necesario
-        # print(f"--- PROMPT DEBUG (Estilo: {style_key}) ---\n{prompt}\n-------------------------------")
-        return f"Error al reescribir. (Detalles en logs)"
-
-# --- Asegúrate de tener tu inicialización del modelo Gemini aquí ---
-# (Este es un ejemplo, usa tu configuración existente para GOOGLE_API_KEY y el modelo)
-try:
-    # Intenta cargar la API key desde los secretos de Streamlit (para despliegue)
-    GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
-except (FileNotFoundError, KeyError):
-    GOOGLE_API_KEY = None # O tu key local para pruebas, pero con advertencia
-    st.warning("API Key de Google Gemini no encontrada en los secretos de Streamlit. Usar solo para desarrollo local si se configura manualmente.")
-
-model_rewrite = None # Definir model_rewrite globalmente o pasarlo a la función
-if GOOGLE_API_KEY:
-    try:
-        genai.configure(api_key=GOOGLE_API_KEY)
-        generation_config_rewrite = genai.GenerationConfig(
-            temperature=0.75 # Ajusta la temperatura general para los estilos
-        )
-        model_rewrite = genai.GenerativeModel(
-            model_name='gemini-1.5-flash', # O 'gemini-1.5-pro' para mejor calidad
-            generation_config=generation_config_rewrite
-        )
-        st.sidebar.success("Modelo Gemini (reescritura) inicializado.")
-    except Exception as e:
-        st.sidebar.error(f"Error inicializando modelo Gemini: {e}")
-else:
-    st.sidebar.error("API Key de Google no configurada. Reescritura deshabilitada.")
-
-
-model_rewrite = None
-if GOOGLE_API_KEY and GOOGLE_API_KEY != "TU_GOOGLE_API_KEY_AQUI":
-    genai.configure(api_key=GOOGLE_API_KEY)
-    # Puedes configurar el modelo aquí con parámetros de generación si lo deseas
-    generation_config_rewrite = genai.GenerationConfig(
-        temperature=0.7  # Un valor entre 0.0 y 1.0. Más alto = más creativo/diverso.
-                         # 0.7 es un buen punto de partida para equilibrio.
-    )
-    model_rewrite = genai.GenerativeModel(
-        model_name='gemini-1.5-flash', # o 'gemini-1.5-pro' para mayor calidad (puede ser más lento/costoso)
-        generation_config=generation_config_rewrite
-    )
-else:
-    st.error("La API Key de Google Gemini no está configurada. La función de reescritura estará deshabilitada.")
+# --- Métricas (ver metrics.py) ---
+# Desactivadas por defecto; con METRICS_PORT se exportan en http://127.0.0.1:<puerto>/metrics
+metrics.set_enabled(str(get_config("METRICS_ENABLED", "")).lower() in ("1", "true", "yes", "si", "sí"))
+METRICS_PORT = get_config("METRICS_PORT")
+
+@st.cache_resource
+def start_metrics_server(port):
+    return metrics.start_http_server(port, host=get_config("METRICS_HOST", "127.0.0.1"))
+
+if metrics.is_enabled() and METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
+
+# Los tokens de Gemini se atribuyen al agente indicado en la URL (?agente=nombre)
+agent_name = metrics.agent_label(st.query_params.get("agente"))
+
+# Un cliente resiliente por servicio remoto, compartido por todo el proceso (ver resilience.py):
+# limitación de tasa, reintentos con backoff, plazos y circuit breaker
+gemini_client = get_client("gemini", rate_per_second=float(get_config("GEMINI_REQUESTS_PER_SECOND", 5)))
+stt_client = get_client("google_stt", rate_per_second=float(get_config("STT_REQUESTS_PER_SECOND", 10)), burst=20)
+
+# --- Configuración de la API Key de Gemini y Modelos ---
+# Los modelos se construyen una sola vez por proceso y se comparten entre sesiones
+@st.cache_resource
+def get_gemini_models():
+    return build_gemini_models(get_config("GOOGLE_API_KEY"), client=gemini_client)
+
+gemini_models = get_gemini_models()
+model_rewrite = gemini_models.rewrite
+model_suggestion = gemini_models.suggestion
+if gemini_models.error:
+    st.sidebar.error(f"{gemini_models.error} Reescritura y sugerencias deshabilitadas.")
+
+# --- Cola de trabajos en segundo plano ---
+# STT, reescrituras y sugerencias se ejecutan fuera del re-run: la sesión guarda el id
+# del trabajo de cada hueco de la interfaz y un fragmento consulta su estado.
+JOB_POLL_SECONDS = 0.5
+STT_TIMEOUT_SECONDS = 180
+REWRITE_TIMEOUT_SECONDS = 60
+SUGGESTION_TIMEOUT_SECONDS = 45
+
+@st.cache_resource
+def get_job_queue():
+    # Compartida por todas las sesiones del proceso
+    return JobQueue(max_workers=16)
+
+job_queue = get_job_queue()
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = {} # hueco de la interfaz -> id del trabajo en curso
+if 'job_messages' not in st.session_state:
+    st.session_state.job_messages = {} # hueco -> (nivel, mensaje); se mantiene hasta que se reenvía el hueco
+
+def set_text(name, widget_key, value):
+    # Un text_area con key ignora `value` una vez creado: se borra su estado para que muestre el nuevo texto
+    st.session_state[name] = value
+    st.session_state.pop(widget_key, None)
+
+def submit_job(slot, key, fn, kind, timeout_seconds):
+    fn = partial(run_as_agent, agent_name, fn) # El trabajo corre en otro hilo: se le pasa el agente de la sesión
+    st.session_state.jobs[slot] = job_queue.submit(key, fn, kind=kind, timeout_seconds=timeout_seconds)
+    st.session_state.job_messages.pop(slot, None)
+
+def show_job_message(slot):
+    message = st.session_state.job_messages.get(slot)
+    if message:
+        level, text = message
+        getattr(st, level)(text)
+
+def job_failure_message(job, what):
+    if job is None:
+        return f"{what}: el resultado ya no está disponible, inténtalo de nuevo."
+    if job.status == TIMEOUT:
+        return f"{what}: la operación tardó demasiado y se canceló."
+    if job.status == CANCELLED:
+        return f"{what}: operación cancelada."
+    return f"{what}: {job.error}"
+
+def is_fragment_run():
+    # En una re-ejecución solo de fragmentos (run_every) Streamlit indica qué fragmentos toca ejecutar
+    ctx = get_script_run_ctx()
+    return bool(ctx and ctx.fragment_ids_this_run)
+
+def rerun():
+    # st.rerun() corta el script con una excepción antes de la medición del final: se registra aquí.
+    # Una ejecución solo del fragmento no pasa por rerun_started_at, así que no se mide.
+    if not is_fragment_run():
+        RERUN_SECONDS.observe(time.perf_counter() - rerun_started_at)
+    st.rerun()
+
+def poll_job(slot, on_done, label, show_partial=None):
+    """Muestra el progreso del trabajo del hueco `slot` en un fragmento que se
+    re-ejecuta cada JOB_POLL_SECONDS. Al terminar llama a on_done(job).
+
+    Solo el fragmento re-ejecuta la app para que el resultado llegue a los
+    widgets; en una ejecución completa el resultado se aplica sin st.rerun(),
+    para no descartar los clics y formularios que se procesan más abajo.
+    Por eso se llama antes de los widgets que muestran el resultado."""
+    job_id = st.session_state.jobs.get(slot)
+    if job_id is None:
+        return
+    job = job_queue.get(job_id)
+    if job is None or job.done:
+        st.session_state.jobs.pop(slot, None)
+        on_done(job)
+        return
+
+    @st.fragment(run_every=JOB_POLL_SECONDS)
+    def job_progress():
+        job = job_queue.get(job_id)
+        if job is None or job.done:
+            if not is_fragment_run():
+                return # Terminó durante esta ejecución completa: lo aplica la siguiente pasada del fragmento
+            st.session_state.jobs.pop(slot, None)
+            on_done(job)
+            rerun()
+        if job.status == PENDING:
+            st.info(f"⏳ En cola ({job.wait_seconds():.1f} s)...")
+        else:
+            st.info(f"{label} ({job.elapsed_seconds():.1f} s)")
+            if show_partial and job.partial:
+                show_partial(job.partial)
+        if st.button("Cancelar", key=f"cancel_job_{slot}"):
+            job_queue.cancel(job_id)
+            st.session_state.jobs.pop(slot, None)
+            st.session_state.job_messages[slot] = ("warning", "Operación cancelada.")
+            rerun()
+
+    job_progress()
+
+def job_timings(job):
+    # Latencia percibida por el agente: desde que se envió el trabajo (incluye la espera en cola)
+    timings = {'total_seconds': job.elapsed_seconds()}
+    if job.first_partial_at is not None:
+        timings['first_token_seconds'] = job.first_partial_at - job.submitted_at
+    return timings
+
+def format_latency(timings):
+    total = f"total {timings['total_seconds']:.2f} s"
+    if 'first_token_seconds' in timings:
+        return f"⏱️ Primer token {timings['first_token_seconds']:.2f} s · {total}"
+    return f"⏱️ {total}"
+
+@st.cache_resource
+def get_rewrite_cache():
+    # Compartida por todas las sesiones; el nivel SQLite sobrevive a reinicios
+    return RewriteCache(max_entries=256, db_path='app_data.db')
+
+def run_styled_rewrite(job, text_to_rewrite, style_key, rewrite_cache, regenerate=False, stream=False):
+    # Se ejecuta en la cola de trabajos (sin llamadas a st.*); los errores quedan en job.error.
+    # Devuelve (texto, aviso): si Gemini no está disponible, la reescritura en caché o el texto original.
+    return generate_styled_rewrite_or_fallback(model_rewrite, text_to_rewrite, style_key, rewrite_cache,
+                                               regenerate=regenerate, on_partial=job.report_partial if stream else None)
 
 def rewrite_text_cordial_gemini(text_to_rewrite):
     if not model_rewrite:
-        return "Error: Modelo Gemini para reescritura no inicializado (revisa la API Key)."
+        st.error("Modelo Gemini para reescritura no inicializado (revisa la API Key).")
+        return text_to_rewrite
     
     # Nuevo prompt más detallado
     prompt = f"""
@@ -161,76 +232,58 @@ def rewrite_text_cordial_gemini(text_to_rewrite):
             
         return rewritten_text
     except Exception as e:
+        # El error se muestra aparte: el texto devuelto nunca debe contener el mensaje de error ni el prompt
         st.error(f"Error al reescribir el texto con Gemini: {e}")
-        return f"Error al reescribir el texto con Gemini: {e} (Prompt utilizado: {prompt[:200]}...)" # Mostrar parte del prompt puede ayudar a depurar
+        return text_to_rewrite
 
 
-def suggest_sales_bridge_gemini(context=""):
+@st.cache_resource
+def get_suggestion_cache():
+    # Sugerencias por tipo y resolution_context, compartidas por todas las sesiones
+    return SuggestionCache(max_entries=256, db_path='app_data.db')
+
+def suggest_sales_bridge_gemini(context="", on_partial=None, regenerate=False):
     if not model_suggestion:
-        return "Error: Modelo Gemini para sugerencias no inicializado (revisa la API Key)."
+        raise RuntimeError("Modelo Gemini para sugerencias no inicializado (revisa la API Key).")
     try:
-        prompt = f"""
-        El caso de un cliente ha sido resuelto.
-        Contexto adicional (opcional): {context}
-        Sugiere un script corto y amigable para hacer un puente hacia una venta, ofreciendo un producto o servicio relevante de forma natural.
-        No añadas introducciones ni despedidas, solo entrega el script sugerido.
-        Script sugerido:
-        """
-        response = model_suggestion.generate_content(prompt)
-        return response.text.strip()
+        return generate_suggestion(model_suggestion, SALES_BRIDGE, context, get_suggestion_cache(), on_partial=on_partial,
+                                   regenerate=regenerate)
     except Exception as e:
-        st.error(f"Error al generar sugerencia de venta con Gemini: {e}")
-        return f"Error al generar sugerencia de venta con Gemini: {e}"
+        # Se ejecuta en la cola de trabajos: el error se muestra en la interfaz al terminar el trabajo
+        raise RuntimeError(f"Error al generar sugerencia de venta con Gemini: {e}") from e
 
-def suggest_survey_invitation_gemini(context=""):
+def suggest_survey_invitation_gemini(context="", on_partial=None, regenerate=False):
     if not model_suggestion:
-        return "Error: Modelo Gemini para sugerencias no inicializado (revisa la API Key)."
+        raise RuntimeError("Modelo Gemini para sugerencias no inicializado (revisa la API Key).")
     try:
-        prompt = f"""
-        El caso de un cliente ha sido resuelto.
-        Contexto adicional (opcional): {context}
-        Sugiere un script corto, agradable y efectivo para invitar al cliente a completar una encuesta de satisfacción.
-        No añadas introducciones ni despedidas, solo entrega el script sugerido.
-        Script sugerido:
-        """
-        response = model_suggestion.generate_content(prompt)
-        return response.text.strip()
+        return generate_suggestion(model_suggestion, SURVEY_INVITATION, context, get_suggestion_cache(), on_partial=on_partial,
+                                   regenerate=regenerate)
     except Exception as e:
-        st.error(f"Error al generar invitación a encuesta con Gemini: {e}")
-        return f"Error al generar invitación a encuesta con Gemini: {e}"
+        # Se ejecuta en la cola de trabajos: el error se muestra en la interfaz al terminar el trabajo
+        raise RuntimeError(f"Error al generar invitación a encuesta con Gemini: {e}") from e
+
+def run_suggestion(job, suggest, context, stream=False, regenerate=False):
+    # Se ejecuta en la cola de trabajos
+    return suggest(context, on_partial=job.report_partial if stream else None, regenerate=regenerate)
+
+def run_post_resolution(job, context, suggestion_cache, regenerate=False):
+    # Se ejecuta en la cola de trabajos: una llamada JSON con todos los scripts (o las individuales como respaldo)
+    return generate_post_resolution(model_suggestion, context, suggestion_cache, regenerate=regenerate)
 
 # --- Resto de la Lógica de la Aplicación Streamlit (como se definió antes) ---
 
-# Conexión a la base de datos SQLite
-def get_db_connection():
-    conn = sqlite3.connect('app_data.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# Crear tablas si no existen
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS frequent_scripts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            template TEXT NOT NULL,
-            usage_count INTEGER DEFAULT 0
-        )
-    ''')
-    # Ejemplo de inserción (descomentar y modificar si es necesario para la primera ejecución)
-    # scripts_iniciales = [
-    #     ("Saludo Inicial Cliente Nuevo", "¡Hola [Nombre Cliente]! Gracias por contactarnos en [Nombre Empresa]. ¿En qué puedo ayudarte hoy con tu línea [Numero Linea]?"),
-    #     ("Confirmación de Resolución", "Me alegra confirmar que hemos resuelto tu consulta sobre [Tema Consulta], [Nombre Cliente]."),
-    #     ("Despedida Cordial", "Ha sido un placer ayudarte hoy, [Nombre Cliente]. ¡Que tengas un excelente día!")
-    # ]
-    # for name, template in scripts_iniciales:
-    #     cursor.execute("INSERT OR IGNORE INTO frequent_scripts (name, template) VALUES (?, ?)", (name, template))
-    conn.commit()
-    conn.close()
-
-init_db()
+# Capa de datos SQLite: pool de conexiones compartido, modo WAL y esquema
+# migrado una sola vez por proceso (ver database.py)
+@st.cache_resource
+def get_scripts_repository():
+    return ScriptsRepository(get_pool('app_data.db'))
+
+# Ranking en memoria compartido por todas las sesiones; los usos se vuelcan a SQLite por lotes
+@st.cache_resource
+def get_ranked_scripts():
+    return RankedScripts(get_scripts_repository(), top_n=15)
+
+ranked_scripts = get_ranked_scripts()
 
 #st.title("🤖 Asistente de Interacción con Clientes (con Gemini)")
 
@@ -239,59 +292,122 @@ st.header("🎤 Transcripción de Voz")
 if 'transcribed_text' not in st.session_state:
     st.session_state.transcribed_text = ""
 
-# El componente audiorecorder
-# Asegúrate de que la key sea única si tienes varios audiorecorders
-audio_from_recorder = audiorecorder("Haz clic para grabar", "Grabando...", key="audio_recorder_main")
+STT_LANGUAGE = "es-ES"
+STT_MAX_WORKERS = 4
+STT_ENGINE = get_config("STT_ENGINE", DEFAULT_ENGINE) # "google", "vosk" o "stub"
 
-if len(audio_from_recorder) > 0:
-    st.audio(audio_from_recorder.export().read()) # Muestra el audio, confirmando que se grabó
+@st.cache_resource
+def get_transcription_cache():
+    # Compartida por todas las sesiones del proceso; el nivel SQLite sobrevive a reinicios
+    return TranscriptionCache(max_entries=128, db_path='app_data.db')
 
-    # --- Procesamiento para SpeechRecognition ---
+@st.cache_resource
+def get_stt_executor():
+    # Pool de hilos compartido para transcribir los fragmentos de las grabaciones largas
+    return ThreadPoolExecutor(max_workers=STT_MAX_WORKERS, thread_name_prefix="stt")
+
+@st.cache_resource
+def get_speech_recognizer(engine):
+    # Se crea (y se carga su modelo, si es local) una sola vez por proceso. Devuelve (motor, error):
+    # un STT_ENGINE desconocido, vosk sin VOSK_MODEL_PATH o sin instalar se muestran como los errores de Gemini
     try:
-        # audio_from_recorder es un objeto pydub.AudioSegment
-        # Convertir a un formato estándar para SpeechRecognition:
-        # 1. Mono (un solo canal)
-        # 2. Tasa de muestreo de 16000 Hz (común para STT)
-        # 3. Profundidad de bits de 16 bits (sample_width = 2 bytes)
-        
-        st.info("Procesando audio para transcripción...")
+        return create_recognizer(engine, language=STT_LANGUAGE, model_path=get_config("VOSK_MODEL_PATH"),
+                                 client=stt_client), None
+    except Exception as e:
+        return None, f"Error inicializando el reconocimiento de voz ('{engine}'): {e}"
 
-        audio_segment = audio_from_recorder # Es un AudioSegment de Pydub
-        
-        # Convertir a mono
-        audio_segment = audio_segment.set_channels(1)
-        
-        # Establecer tasa de muestreo (e.g., 16kHz)
-        audio_segment = audio_segment.set_frame_rate(16000)
-        
-        # Establecer profundidad de bits a 16-bit PCM (sample_width = 2 bytes)
-        audio_segment = audio_segment.set_sample_width(2)
+speech_recognizer, speech_recognizer_error = get_speech_recognizer(STT_ENGINE)
+if speech_recognizer_error:
+    st.error(f"{speech_recognizer_error} Transcripción deshabilitada (revisa STT_ENGINE y VOSK_MODEL_PATH).")
 
-        # Obtener los datos crudos (bytes), la tasa de muestreo y el ancho de muestra
-        raw_audio_data = audio_segment.raw_data
-        sample_rate = audio_segment.frame_rate
-        sample_width_bytes = audio_segment.sample_width
+# El componente audiorecorder
+# Asegúrate de que la key sea única si tienes varios audiorecorders
+audio_from_recorder = audiorecorder("Haz clic para grabar", "Grabando...", key="audio_recorder_main")
 
-        # Crear un objeto AudioData para SpeechRecognition
-        audio_data_for_sr = sr.AudioData(raw_audio_data, sample_rate, sample_width_bytes)
+def transcribe_recording(job, audio_segment, recognize, transcription_cache, executor, engine):
+    # Se ejecuta en la cola de trabajos (sin llamadas a st.*)
+    # audio_segment es un objeto pydub.AudioSegment
+    raw_audio_data, sample_rate, sample_width_bytes = normalize_for_recognition(audio_segment)
+
+    cache_key = audio_cache_key(raw_audio_data, sample_rate, sample_width_bytes, STT_LANGUAGE, engine)
+    text = transcription_cache.get(cache_key)
+    if text is not None:
+        return text
+    # Se divide el audio en fragmentos por silencios y se transcriben en paralelo,
+    # publicando el texto parcial a medida que llegan los resultados.
+    text = ""
+    stt_start = time.perf_counter()
+    for partial_transcript in transcribe_stream(raw_audio_data, sample_rate, sample_width_bytes, recognize, executor=executor):
+        text = partial_transcript.text
+        job.report_partial(text)
+    if not text:
+        raise sr.UnknownValueError()
+    transcription_cache.put(cache_key, text, cost_seconds=time.perf_counter() - stt_start)
+    return text
+
+def playback_audio(audio_segment, recording_key):
+    # Se codifica (ffmpeg) una sola vez por grabación; en los re-runs se reutilizan los bytes
+    cached = st.session_state.get('playback_audio')
+    if cached is None or cached[0] != recording_key:
+        cached = (recording_key, audio_segment.export().read())
+        st.session_state.playback_audio = cached
+    return cached[1]
+
+def apply_transcription(recording_key, job):
+    if job is not None and job.status == DONE:
+        set_text('transcribed_text', 'transcribed_display_main', job.result)
+        # Solo una transcripción correcta da la grabación por procesada
+        st.session_state.last_recording_key = recording_key
+        return
+    error = job.error if job is not None else None
+    if job is None or job.status != FAILED:
+        message = job_failure_message(job, "Transcripción")
+    elif isinstance(error, sr.UnknownValueError):
+        message = "Google Speech Recognition no pudo entender el audio."
+    elif isinstance(error, CircuitOpenError):
+        message = f"El reconocimiento de voz no está disponible temporalmente; inténtalo en unos segundos. {error}"
+    elif isinstance(error, sr.RequestError):
+        message = f"No se pudieron obtener resultados del servicio Google Speech Recognition; {error}"
+    else:
+        # Mostrar el error específico para ayudar a depurar más si es necesario
+        message = f"Ocurrió un error detallado al procesar el audio: {type(error).__name__} - {error}"
+    st.session_state.job_messages['transcription'] = ("error", message)
 
-        r = sr.Recognizer()
-        with st.spinner("Transcribiendo audio..."):
-            text = r.recognize_google(audio_data_for_sr, language="es-ES")
-        
-        st.session_state.transcribed_text = text
-        #st.success(f"Texto transcrito: {text}")
+if len(audio_from_recorder) > 0 and speech_recognizer is not None:
+    # Streamlit re-ejecuta el script en cada interacción: solo una grabación nueva
+    # debe codificarse para reproducirla, normalizarse y enviarse al reconocimiento de voz.
+    recording_key = recording_fingerprint(audio_from_recorder)
+    st.audio(playback_audio(audio_from_recorder, recording_key)) # Muestra el audio, confirmando que se grabó
 
-    except sr.UnknownValueError:
-        st.error("Google Speech Recognition no pudo entender el audio.")
-    except sr.RequestError as e:
-        st.error(f"No se pudieron obtener resultados del servicio Google Speech Recognition; {e}")
-    except Exception as e:
-        # Mostrar el error específico para ayudar a depurar más si es necesario
-        st.error(f"Ocurrió un error detallado al procesar el audio: {type(e).__name__} - {e}")
-        # También puedes loggear el error completo si quieres más detalles en los logs de Streamlit Cloud
-        # import traceback
-        # st.error(traceback.format_exc())
+    # --- Procesamiento para SpeechRecognition ---
+    def submit_transcription():
+        st.session_state.submitted_recording_key = recording_key
+        submit_job('transcription', ('stt', recording_key, STT_ENGINE),
+                   partial(transcribe_recording, audio_segment=audio_from_recorder,
+                           recognize=speech_recognizer, transcription_cache=get_transcription_cache(),
+                           executor=get_stt_executor(), engine=STT_ENGINE),
+                   kind='stt', timeout_seconds=STT_TIMEOUT_SECONDS)
+
+    # Una grabación nueva se envía sola una vez; si falla, se cancela o vence su plazo,
+    # se puede reintentar con la misma grabación sin volver a grabar.
+    if st.session_state.get('submitted_recording_key') != recording_key:
+        submit_transcription()
+
+    poll_job('transcription', partial(apply_transcription, recording_key), "Transcribiendo audio...",
+             show_partial=lambda text: st.text_area("Texto Transcrito (parcial):", value=text, height=150, disabled=True))
+    show_job_message('transcription')
+    if ('transcription' not in st.session_state.jobs
+            and st.session_state.get('last_recording_key') != recording_key):
+        if st.button("Reintentar transcripción 🔁", key="retry_transcription"):
+            submit_transcription()
+            rerun()
+
+    cache_stats = get_transcription_cache().stats()
+    st.caption(f"Caché de transcripción: {cache_stats['hits']} aciertos / {cache_stats['misses']} fallos")
+    engine_timings = get_engine_timings().get(STT_ENGINE)
+    if engine_timings:
+        st.caption(f"Motor '{STT_ENGINE}': {engine_timings['calls']} fragmentos, "
+                   f"RTF {engine_timings['real_time_factor']:.2f}")
 transcribed_text_area = st.text_area("Texto Transcrito:", value=st.session_state.transcribed_text, height=150, key="transcribed_display_main")
 if transcribed_text_area != st.session_state.transcribed_text:
     st.session_state.transcribed_text = transcribed_text_area
@@ -300,12 +416,7 @@ if transcribed_text_area != st.session_state.transcribed_text:
 st.header("✍️ Refinar Texto (con Gemini)")
 
 # Diccionario de estilos disponibles
-rewrite_styles = {
-    "Conciso y Claro": "concise_clear",
-    "Vendedor Persuasivo": "sales_persuasive",
-    "Creativo y Resolutivo (Satisfacción)": "creative_resolution",
-    "Combinación Ideal (Versátil)": "ideal_versatile"
-}
+rewrite_styles = REWRITE_STYLES
 # Guardar la selección en el estado de la sesión para que persista
 if 'selected_style_label' not in st.session_state:
     st.session_state.selected_style_label = "Conciso y Claro" # Estilo por defecto
@@ -324,23 +435,93 @@ selected_style_key = rewrite_styles[selected_style_label]
 if 'rewritten_text' not in st.session_state:
     st.session_state.rewritten_text = ""
 
-if st.button(f"Reescribir Texto (Estilo: {selected_style_label})"):
+# Con streaming, el texto se muestra a medida que el modelo lo genera
+stream_gemini_output = st.sidebar.checkbox("Mostrar respuestas de Gemini mientras se generan", value=True, key="stream_gemini_output")
+
+rewrite_col, regenerate_col = st.columns([3, 1])
+rewrite_clicked = rewrite_col.button(f"Reescribir Texto (Estilo: {selected_style_label})")
+# "Regenerar" ignora la caché para obtener una variante nueva
+regenerate_clicked = regenerate_col.button("Regenerar 🔄", key="regenerate_rewrite_button")
+
+def apply_rewrite(style_label, job):
+    if job is not None and job.status == DONE:
+        rewritten_text, fallback_notice = job.result
+        set_text('rewritten_text', 'rewritten_display_main', rewritten_text)
+        st.session_state.rewrite_latency = format_latency(job_timings(job))
+        if fallback_notice:
+            st.session_state.job_messages['rewrite'] = ("warning", fallback_notice)
+    else:
+        st.session_state.job_messages['rewrite'] = (
+            "error", job_failure_message(job, f"Error al reescribir el texto con Gemini (Estilo: {style_label})"))
+
+if rewrite_clicked or regenerate_clicked:
     if st.session_state.transcribed_text:
         if model_rewrite: # Verificar que el modelo Gemini esté inicializado
-            with st.spinner(f"Reescribiendo con Gemini en estilo '{selected_style_label}'..."):
-                # Llamaremos a una nueva función que maneje los estilos
-                st.session_state.rewritten_text = rewrite_text_styled_gemini(
-                    st.session_state.transcribed_text,
-                    selected_style_key # Pasamos la clave del estilo seleccionado
-                )
+            submit_job('rewrite', ('rewrite', selected_style_key, st.session_state.transcribed_text, regenerate_clicked),
+                       partial(run_styled_rewrite, text_to_rewrite=st.session_state.transcribed_text,
+                               style_key=selected_style_key, rewrite_cache=get_rewrite_cache(),
+                               regenerate=regenerate_clicked, stream=stream_gemini_output),
+                       kind='rewrite', timeout_seconds=REWRITE_TIMEOUT_SECONDS)
         else:
             st.error("La función de reescritura no está disponible. Verifica la configuración de la API Key de Gemini.")
     else:
         st.warning("No hay texto transcrito para reescribir.")
 
+poll_job('rewrite', partial(apply_rewrite, selected_style_label), f"Reescribiendo con Gemini en estilo '{selected_style_label}'...",
+         show_partial=(lambda text: st.markdown(text + " ▌")) if stream_gemini_output else None)
+show_job_message('rewrite')
+
+rewrite_cache_stats = get_rewrite_cache().stats()
+st.sidebar.caption(f"Caché de reescritura: {rewrite_cache_stats['hit_rate']:.0%} aciertos "
+                   f"({rewrite_cache_stats['hits']}/{rewrite_cache_stats['hits'] + rewrite_cache_stats['misses']}), "
+                   f"{rewrite_cache_stats['saved_seconds']:.1f} s de latencia ahorrados")
+
+if st.session_state.get('rewrite_latency'):
+    st.caption(st.session_state.rewrite_latency)
+
 rewritten_text_display = st.text_area("Texto Reescrito:", value=st.session_state.rewritten_text, height=150, key="rewritten_display_main")
 if rewritten_text_display != st.session_state.rewritten_text:
     st.session_state.rewritten_text = rewritten_text_display
+
+# --- Comparar todos los estilos a la vez ---
+if 'rewritten_all_styles' not in st.session_state:
+    st.session_state.rewritten_all_styles = {}
+
+def apply_style_rewrite(style_key, style_label, job):
+    if job is not None and job.status == DONE:
+        st.session_state.rewritten_all_styles[style_key], fallback_notice = job.result
+        if fallback_notice:
+            st.session_state.job_messages[f"rewrite_all_{style_key}"] = ("warning", fallback_notice)
+    else:
+        st.session_state.job_messages[f"rewrite_all_{style_key}"] = (
+            "error", job_failure_message(job, f"Error al reescribir (Estilo: {style_label})"))
+
+all_style_slots = {style_key: f"rewrite_all_{style_key}" for style_key in rewrite_styles.values()}
+if st.button("Reescribir en Todos los Estilos ⚡", key="rewrite_all_styles_button"):
+    if not st.session_state.transcribed_text:
+        st.warning("No hay texto transcrito para reescribir.")
+    elif not model_rewrite:
+        st.error("La función de reescritura no está disponible. Verifica la configuración de la API Key de Gemini.")
+    else:
+        # Un trabajo por estilo: se ejecutan en paralelo y cada columna se rellena en cuanto termina el suyo
+        st.session_state.rewritten_all_styles = {}
+        for style_key, slot in all_style_slots.items():
+            submit_job(slot, ('rewrite', style_key, st.session_state.transcribed_text, False),
+                       partial(run_styled_rewrite, text_to_rewrite=st.session_state.transcribed_text,
+                               style_key=style_key, rewrite_cache=get_rewrite_cache()),
+                       kind='rewrite', timeout_seconds=REWRITE_TIMEOUT_SECONDS)
+
+if st.session_state.rewritten_all_styles or any(slot in st.session_state.jobs for slot in all_style_slots.values()):
+    for column, (label, style_key) in zip(st.columns(len(rewrite_styles)), rewrite_styles.items()):
+        with column:
+            st.markdown(f"**{label}**")
+            poll_job(all_style_slots[style_key], partial(apply_style_rewrite, style_key, label), "Reescribiendo...")
+            show_job_message(all_style_slots[style_key])
+            if style_key in st.session_state.rewritten_all_styles:
+                st.success(st.session_state.rewritten_all_styles[style_key])
+                if st.button("Usar este", key=f"use_style_{style_key}"):
+                    set_text('rewritten_text', 'rewritten_display_main', st.session_state.rewritten_all_styles[style_key])
+                    rerun()
     
 
 
@@ -350,10 +531,7 @@ if rewritten_text_display != st.session_state.rewritten_text:
 st.sidebar.header("📚 Scripts Frecuentes")
 
 def get_frequent_scripts():
-    conn = get_db_connection()
-    scripts_db = conn.execute("SELECT id, name, template FROM frequent_scripts ORDER BY usage_count DESC, name LIMIT 15").fetchall()
-    conn.close()
-    return scripts_db
+    return ranked_scripts.top()
 
 frequent_scripts = get_frequent_scripts()
 
@@ -361,88 +539,263 @@ st.sidebar.subheader("Personalizar Script")
 nombre_cliente_script = st.sidebar.text_input("Nombre del Cliente:", key="script_nombre_cliente_sidebar")
 numero_linea_script = st.sidebar.text_input("Número de Línea/ID:", key="script_numero_linea_sidebar")
 info_adicional_script = st.sidebar.text_input("Info Adicional (ej: producto, motivo consulta):", key="script_info_adicional_sidebar")
+with st.sidebar.expander("Más campos (CRM)"):
+    plan_script = st.text_input("Plan:", key="script_plan_sidebar")
+    fecha_script = st.text_input("Fecha:", key="script_fecha_sidebar")
+    ticket_script = st.text_input("Ticket:", key="script_ticket_sidebar")
+# Valores por campo de plantilla; los vacíos usan el valor por defecto del campo
+script_field_values = {
+    "Nombre Cliente": nombre_cliente_script,
+    "Numero Linea": numero_linea_script,
+    "Info Adicional": info_adicional_script,
+    "Plan": plan_script,
+    "Fecha": fecha_script,
+    "Ticket": ticket_script,
+}
 
 
-if frequent_scripts:
-    script_options = {script['name']: script['template'] for script in frequent_scripts}
+# Búsqueda de texto completo (FTS5) sobre toda la biblioteca, no solo sobre los 15 más usados
+script_search_query = st.sidebar.text_input("🔎 Buscar script:", key="script_search_sidebar", placeholder="ej: despedida, línea, encuesta")
+if script_search_query.strip():
+    sidebar_scripts = get_scripts_repository().search(script_search_query, limit=15)
+    if not sidebar_scripts:
+        st.sidebar.caption(f"Sin resultados para '{script_search_query}'.")
+else:
+    sidebar_scripts = frequent_scripts
+
+if sidebar_scripts:
+    script_options = {script['name']: script for script in sidebar_scripts}
     selected_script_name = st.sidebar.selectbox("Selecciona un script:", options=list(script_options.keys()), key="selected_frequent_script_sidebar")
 
     if selected_script_name:
-        selected_template = script_options[selected_script_name]
-        personalized_script = selected_template.replace("[Nombre Cliente]", nombre_cliente_script if nombre_cliente_script else "cliente")
-        personalized_script = personalized_script.replace("[Numero Linea]", numero_linea_script if numero_linea_script else "su servicio")
-        personalized_script = personalized_script.replace("[Info Adicional]", info_adicional_script if info_adicional_script else "") # Placeholder genérico
+        selected_script = script_options[selected_script_name]
+        # Plantilla compilada al guardarla (o al leerla, si es anterior) y cacheada en memoria
+        compiled_template = get_compiled_template(selected_script['template'], selected_script['compiled_template'])
+        personalized_script = compiled_template.render(script_field_values)
 
         st.sidebar.text_area("Script Personalizado:", value=personalized_script, height=200, key="personalized_script_display_sidebar")
         if st.sidebar.button("Copiar Script Personalizado 📋", key="copy_frequent_script_sidebar"):
+            ranked_scripts.record_use(selected_script['id'])
             try:
                 pyperclip.copy(personalized_script)
                 st.sidebar.success("Script personalizado copiado.")
             except pyperclip.PyperclipException as e:
                 st.sidebar.error(f"No se pudo copiar: {e}")
         if st.sidebar.button("Usar Script en Área Principal", key="use_frequent_script_sidebar"):
-            st.session_state.transcribed_text = personalized_script
-            st.rerun()
-else:
+            ranked_scripts.record_use(selected_script['id'])
+            set_text('transcribed_text', 'transcribed_display_main', personalized_script)
+            rerun()
+elif not script_search_query.strip():
     st.sidebar.info("No hay scripts frecuentes cargados.")
 
 # --- Finalización del Caso con Gemini (Sidebar o Main) ---
 st.sidebar.header("🏁 Finalización del Caso")
 resolution_context_sidebar = st.sidebar.text_input("Breve resumen de la resolución (opcional):", key="resolution_context_input_sidebar")
 
-if st.sidebar.button("Obtener Sugerencias Post-Resolución (Gemini)", key="get_suggestions_sidebar"):
+# Modo de una sola llamada: el modelo devuelve en JSON todos los scripts (y una frase de cierre).
+# Sin él, las dos sugerencias se piden a la vez como trabajos separados, con streaming.
+single_call_suggestions = st.sidebar.checkbox("Generar todas las sugerencias en una sola llamada", value=True, key="single_call_suggestions")
+SUGGESTION_KINDS = {
+    SALES_BRIDGE: ("Puente a la Venta", suggest_sales_bridge_gemini, "Script de Venta Sugerido:", "sales_script_display_sidebar",
+                   "Copiar Script de Venta 📋", "copy_sales_script_sidebar", "Script de venta copiado."),
+    SURVEY_INVITATION: ("Invitación a Encuesta", suggest_survey_invitation_gemini, "Script de Encuesta Sugerido:", "survey_script_display_sidebar",
+                        "Copiar Script de Encuesta 📋", "copy_survey_script_sidebar", "Script de encuesta copiado."),
+    CLOSING_LINE: ("Frase de Cierre", None, "Frase de Cierre Sugerida:", "closing_line_display_sidebar",
+                   "Copiar Frase de Cierre 📋", "copy_closing_line_sidebar", "Frase de cierre copiada."),
+}
+SUGGESTION_SOURCES = {
+    SOURCE_CACHE: "desde caché",
+    SOURCE_STRUCTURED: "1 llamada (JSON)",
+    SOURCE_FALLBACK: "respaldo: llamadas individuales en paralelo",
+}
+if 'suggestions' not in st.session_state:
+    st.session_state.suggestions = {} # tipo -> (texto, latencia)
+
+def apply_suggestion(kind, job):
+    if job is not None and job.status == DONE:
+        st.session_state.suggestions[kind] = (job.result, format_latency(job_timings(job)))
+        st.session_state.pop(SUGGESTION_KINDS[kind][3], None)
+    else:
+        st.session_state.job_messages[kind] = ("error", job_failure_message(job, SUGGESTION_KINDS[kind][0]))
+
+def apply_post_resolution(job):
+    if job is None or job.status != DONE:
+        st.session_state.job_messages['post_resolution'] = ("error", job_failure_message(job, "Sugerencias Post-Resolución"))
+        return
+    latency = f"{format_latency(job_timings(job))} · {SUGGESTION_SOURCES[job.result.source]}"
+    for kind, (title, *_) in SUGGESTION_KINDS.items():
+        value = getattr(job.result, kind)
+        if value:
+            st.session_state.suggestions[kind] = (value, latency)
+            st.session_state.pop(SUGGESTION_KINDS[kind][3], None)
+        elif kind in job.result.errors:
+            st.session_state.job_messages[kind] = ("error", f"{title}: {job.result.errors[kind]}")
+
+suggestion_slots = ['post_resolution', *SUGGESTION_KINDS]
+get_suggestions_clicked = st.sidebar.button("Obtener Sugerencias Post-Resolución (Gemini)", key="get_suggestions_sidebar")
+# Como en la reescritura: "Regenerar" ignora la caché y pide sugerencias nuevas al modelo
+regenerate_suggestions = st.sidebar.button("Regenerar Sugerencias 🔄", key="regenerate_suggestions_sidebar")
+if get_suggestions_clicked or regenerate_suggestions:
     if model_suggestion: # Verificar que el modelo esté inicializado
-        st.sidebar.subheader("Sugerencias Post-Resolución:")
-        with st.sidebar.spinner("Generando sugerencias con Gemini..."):
-            # Puente a la Venta
-            st.sidebar.markdown("**Puente a la Venta:**")
-            sales_suggestion = suggest_sales_bridge_gemini(resolution_context_sidebar)
-            st.sidebar.text_area("Script de Venta Sugerido:", value=sales_suggestion, height=100, key="sales_script_display_sidebar")
-            if st.sidebar.button("Copiar Script de Venta 📋", key="copy_sales_script_sidebar"):
-                try:
-                    pyperclip.copy(sales_suggestion)
-                    st.sidebar.success("Script de venta copiado.")
-                except pyperclip.PyperclipException as e:
-                    st.sidebar.error(f"No se pudo copiar: {e}")
-
-            # Invitación a Encuesta
-            st.sidebar.markdown("**Invitación a Encuesta:**")
-            survey_suggestion = suggest_survey_invitation_gemini(resolution_context_sidebar)
-            st.sidebar.text_area("Script de Encuesta Sugerido:", value=survey_suggestion, height=100, key="survey_script_display_sidebar")
-            if st.sidebar.button("Copiar Script de Encuesta 📋", key="copy_survey_script_sidebar"):
-                try:
-                    pyperclip.copy(survey_suggestion)
-                    st.sidebar.success("Script de encuesta copiado.")
-                except pyperclip.PyperclipException as e:
-                    st.sidebar.error(f"No se pudo copiar: {e}")
+        st.session_state.suggestions = {}
+        for slot in suggestion_slots:
+            st.session_state.job_messages.pop(slot, None)
+        if single_call_suggestions:
+            submit_job('post_resolution', ('post_resolution', resolution_context_sidebar, regenerate_suggestions),
+                       partial(run_post_resolution, context=resolution_context_sidebar, suggestion_cache=get_suggestion_cache(),
+                               regenerate=regenerate_suggestions),
+                       kind='suggestion', timeout_seconds=SUGGESTION_TIMEOUT_SECONDS)
+        else:
+            for kind, (_, suggest, *_) in SUGGESTION_KINDS.items():
+                if suggest is not None:
+                    submit_job(kind, (kind, resolution_context_sidebar, regenerate_suggestions),
+                               partial(run_suggestion, suggest=suggest, context=resolution_context_sidebar,
+                                       stream=stream_gemini_output, regenerate=regenerate_suggestions),
+                               kind='suggestion', timeout_seconds=SUGGESTION_TIMEOUT_SECONDS)
     else:
         st.sidebar.error("La función de sugerencias no está disponible. Verifica la configuración de la API Key de Gemini.")
 
+if st.session_state.suggestions or any(slot in st.session_state.jobs or slot in st.session_state.job_messages for slot in suggestion_slots):
+    with st.sidebar:
+        st.subheader("Sugerencias Post-Resolución:")
+        poll_job('post_resolution', apply_post_resolution, "Generando sugerencias con Gemini...")
+        show_job_message('post_resolution')
+        for kind, (title, _, area_label, area_key, copy_label, copy_key, copied_message) in SUGGESTION_KINDS.items():
+            if kind not in st.session_state.suggestions and kind not in st.session_state.jobs and kind not in st.session_state.job_messages:
+                continue
+            st.markdown(f"**{title}:**")
+            poll_job(kind, partial(apply_suggestion, kind), "Generando sugerencia con Gemini...",
+                     show_partial=(lambda text: st.markdown(text + " ▌")) if stream_gemini_output else None)
+            show_job_message(kind)
+            if kind in st.session_state.suggestions:
+                suggestion, latency = st.session_state.suggestions[kind]
+                st.text_area(area_label, value=suggestion, height=100, key=area_key)
+                st.caption(latency)
+                if st.button(copy_label, key=copy_key):
+                    try:
+                        pyperclip.copy(suggestion)
+                        st.success(copied_message)
+                    except pyperclip.PyperclipException as e:
+                        st.error(f"No se pudo copiar: {e}")
+
+queue_stats = job_queue.stats()
+st.sidebar.caption(f"Cola de trabajos: {queue_stats['queued']} en espera, {queue_stats['running']} en curso · "
+                   f"espera p95 {queue_stats['wait_p95_seconds']:.2f} s · {queue_stats['coalesced']} peticiones agrupadas")
+
+# Estado de los servicios externos para operaciones (circuit breaker, reintentos y limitación de tasa)
+CIRCUIT_STATES = {"closed": "🟢 operativo", "half_open": "🟡 comprobando recuperación", "open": "🔴 caído (fallo rápido)"}
+with st.sidebar.expander("🩺 Estado de servicios externos"):
+    for service_name, client_stats in get_clients_stats().items():
+        st.markdown(f"**{service_name}**: {CIRCUIT_STATES[client_stats['state']]}")
+        st.caption(f"{client_stats['calls']} llamadas · {client_stats['successes']} correctas · {client_stats['failures']} fallos · "
+                   f"{client_stats['retries']} reintentos · {client_stats['rejected']} rechazadas · "
+                   f"{client_stats['throttled_seconds']:.1f} s de espera por límite de tasa")
+        if client_stats['last_error']:
+            st.caption(f"Último error: {client_stats['last_error']}"
+                       + (f" · reintento en {client_stats['seconds_until_retry']:.0f} s" if client_stats['state'] == "open" else ""))
+
+# --- Métricas: estado que ya existe se publica al exportar, sin coste en cada re-run ---
+@st.cache_resource
+def register_metrics_collectors():
+    caches = {"transcripcion": get_transcription_cache(), "reescritura": get_rewrite_cache(),
+              "sugerencias": get_suggestion_cache()}
+
+    def collect_caches():
+        stats = {name: cache.stats() for name, cache in caches.items()}
+        return [
+            ("cache_hits_total", "counter", "Aciertos de caché.", [({"cache": n}, s['hits']) for n, s in stats.items()]),
+            ("cache_misses_total", "counter", "Fallos de caché.", [({"cache": n}, s['misses']) for n, s in stats.items()]),
+            ("cache_saved_seconds_total", "counter", "Segundos de llamadas remotas ahorrados por la caché.",
+             [({"cache": n}, s['saved_seconds']) for n, s in stats.items()]),
+        ]
+
+    def collect_job_queue():
+        stats = job_queue.stats()
+        return [
+            ("job_queue_depth", "gauge", "Trabajos en espera.", [({}, stats['queued'])]),
+            ("job_queue_running", "gauge", "Trabajos en ejecución.", [({}, stats['running'])]),
+            ("job_queue_jobs_total", "counter", "Trabajos por estado final.",
+             [({"status": status}, stats[status]) for status in (DONE, FAILED, CANCELLED, TIMEOUT)]),
+            ("job_queue_coalesced_total", "counter", "Peticiones agrupadas en un trabajo ya en vuelo.",
+             [({}, stats['coalesced'])]),
+        ]
+
+    def collect_clients():
+        clients = get_clients_stats()
+        families = [("remote_circuit_open", "gauge", "1 si el circuit breaker del servicio está abierto.",
+                     [({"service": name}, int(stats['state'] == "open")) for name, stats in clients.items()])]
+        for counter in ("calls", "failures", "retries", "rejected"):
+            families.append((f"remote_{counter}_total", "counter", f"Contador '{counter}' del cliente resiliente.",
+                             [({"service": name}, stats[counter]) for name, stats in clients.items()]))
+        return families
+
+    def collect_engines():
+        timings = get_engine_timings()
+        return [("stt_real_time_factor", "gauge", "Segundos de proceso por segundo de audio (acumulado).",
+                 [({"engine": name}, t['real_time_factor']) for name, t in timings.items()])]
+
+    for name, collect in (("caches", collect_caches), ("job_queue", collect_job_queue),
+                          ("clients", collect_clients), ("engines", collect_engines)):
+        REGISTRY.register_collector(name, collect)
+
+if metrics.is_enabled():
+    register_metrics_collectors()
+    with st.sidebar.expander("📈 Métricas"):
+        for labels in STT_REQUEST_SECONDS.label_sets():
+            engine = labels['engine']
+            audio_seconds = STT_AUDIO_SECONDS.value(engine=engine)
+            if audio_seconds:
+                st.caption(f"STT '{engine}': {STT_REQUEST_SECONDS.sum(engine=engine) / audio_seconds:.2f} s por s de audio · "
+                           f"p95 {STT_REQUEST_SECONDS.quantile(0.95, engine=engine):.2f} s por fragmento")
+        style_labels = {style_key: label for label, style_key in REWRITE_STYLES.items()}
+        for labels in GEMINI_REQUEST_SECONDS.label_sets():
+            if labels['operation'] == "rewrite":
+                st.caption(f"Reescritura '{style_labels.get(labels['style'], labels['style'] or 'cordial')}': "
+                           f"p95 {GEMINI_REQUEST_SECONDS.quantile(0.95, **labels):.2f} s "
+                           f"({GEMINI_REQUEST_SECONDS.count(**labels)} llamadas)")
+        tokens_by_agent = {}
+        for (_, _, agent), tokens in GEMINI_TOKENS.values().items():
+            tokens_by_agent[agent] = tokens_by_agent.get(agent, 0) + tokens
+        for agent, tokens in sorted(tokens_by_agent.items()):
+            st.caption(f"Tokens de Gemini de '{agent}': {tokens}")
+        if RERUN_SECONDS.count():
+            st.caption(f"Re-run: p95 {RERUN_SECONDS.quantile(0.95) * 1000:.0f} ms ({RERUN_SECONDS.count()} re-runs)")
+        for labels in SQLITE_QUERY_SECONDS.label_sets():
+            st.caption(f"SQLite {labels['operation']}: p95 {SQLITE_QUERY_SECONDS.quantile(0.95, **labels) * 1000:.1f} ms")
+        if METRICS_PORT:
+            st.caption(f"Exportadas en http://127.0.0.1:{METRICS_PORT}/metrics")
+        st.download_button("Descargar métricas (Prometheus)", render_prometheus(), file_name="metrics.prom",
+                           mime="text/plain", key="download_metrics")
+
 # --- Sección para Administrar Scripts (opcional, podría ir en otra página) ---
 with st.expander("Administrar Scripts Frecuentes"):
     st.subheader("Añadir Nuevo Script Frecuente")
     with st.form("new_script_form", clear_on_submit=True):
         new_script_name = st.text_input("Nombre del nuevo script:")
-        new_script_template = st.text_area("Plantilla del nuevo script (usa [Nombre Cliente], [Numero Linea], [Info Adicional]):")
+        new_script_template = st.text_area(
+            f"Plantilla del nuevo script (usa {', '.join(f'[{field}]' for field in KNOWN_FIELDS)}; "
+            "o un campo propio con valor por defecto, ej: [Producto|nuestro servicio]):"
+        )
         submitted_new_script = st.form_submit_button("Guardar Nuevo Script")
 
         if submitted_new_script:
             if new_script_name and new_script_template:
                 try:
-                    conn = get_db_connection()
-                    conn.execute("INSERT INTO frequent_scripts (name, template) VALUES (?, ?)", (new_script_name, new_script_template))
-                    conn.commit()
-                    conn.close()
+                    # Se valida y compila una sola vez, al guardar
+                    compiled_new_template = compile_template(new_script_template, strict=True)
+                    ranked_scripts.add(new_script_name, new_script_template, compiled_new_template)
                     st.success(f"Script '{new_script_name}' guardado.")
                     # No es necesario st.rerun() aquí si clear_on_submit=True y no necesitas recargar inmediatamente la lista de selección.
                     # Si la lista de selección debe actualizarse al instante, puedes usar st.rerun() o manejar el estado.
+                except TemplateError as e:
+                    st.error(f"Plantilla no válida: {e}")
                 except sqlite3.Error as e:
                     st.error(f"Error al guardar en la base de datos: {e}")
             else:
                 st.warning("El nombre y la plantilla del script no pueden estar vacíos.")
 
     st.subheader("Eliminar Script Frecuente")
-    scripts_for_deletion = get_frequent_scripts()
+    scripts_for_deletion = frequent_scripts # Ya consultados para la barra lateral en este rerun
     if scripts_for_deletion:
         script_names_for_deletion = {script['name']: script['id'] for script in scripts_for_deletion}
         script_to_delete_name = st.selectbox("Selecciona script a eliminar:", options=list(script_names_for_deletion.keys()), key="delete_script_select", index=None) # index=None para que no haya nada seleccionado por defecto
@@ -451,13 +804,12 @@ with st.expander("Administrar Scripts Frecuentes"):
             if st.button(f"Eliminar Script '{script_to_delete_name}'", key="delete_script_button"):
                 script_id_to_delete = script_names_for_deletion[script_to_delete_name]
                 try:
-                    conn = get_db_connection()
-                    conn.execute("DELETE FROM frequent_scripts WHERE id = ?", (script_id_to_delete,))
-                    conn.commit()
-                    conn.close()
+                    ranked_scripts.delete(script_id_to_delete)
                     st.success(f"Script '{script_to_delete_name}' eliminado.")
-                    st.rerun() # Para actualizar la lista de scripts inmediatamente
+                    rerun() # Para actualizar la lista de scripts inmediatamente
                 except sqlite3.Error as e:
                     st.error(f"Error al eliminar de la base de datos: {e}")
     else:
         st.info("No hay scripts para eliminar.")
+
+RERUN_SECONDS.observe(time.perf_counter() - rerun_started_at)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Normalización de audio para el reconocimiento de voz.
+
+La conversión a mono/16 kHz/16 bits se hace en una sola pasada con NumPy sobre
+el buffer PCM original (np.frombuffer no copia), por bloques de salida de ~1 s:
+cada bloque se mezcla a mono, se remuestrea por interpolación lineal (con
+índices y pesos calculados una vez por tasa de muestreo) y se escala a 16 bits
+directamente en el array final. Así no se materializa una copia completa del
+audio por cada paso, como hacían set_channels, set_frame_rate y
+set_sample_width de pydub encadenados.
+"""
+
+import functools
+import hashlib
+import math
+
+import numpy as np
+
+from metrics import AUDIO_NORMALIZE_SECONDS, timed
+
+# Formato estándar para SpeechRecognition:
+# 1. Mono (un solo canal)
+# 2. Tasa de muestreo de 16000 Hz (común para STT)
+# 3. Profundidad de bits de 16 bits (sample_width = 2 bytes)
+TARGET_CHANNELS = 1
+TARGET_FRAME_RATE = 16000
+TARGET_SAMPLE_WIDTH = 2
+
+# Muestras de salida por bloque (~1 s): acota la memoria temporal sea cual sea la duración
+NORMALIZE_BLOCK_FRAMES = TARGET_FRAME_RATE
+
+# PCM con signo, como lo guarda pydub (también el de 8 bits); 24 bits no tiene dtype
+_SAMPLE_DTYPES = {1: np.int8, 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+
+@functools.lru_cache(maxsize=16)
+def _resample_plan(frame_rate):
+    """Índices y pesos de la interpolación lineal de un bloque de salida.
+
+    El bloque es múltiplo del periodo exacto entre ambas tasas, así que todos
+    los bloques usan las mismas posiciones desplazadas block_input_frames.
+    Devuelve (block_frames, block_input_frames, left, right, fraction).
+    """
+    period = TARGET_FRAME_RATE // math.gcd(frame_rate, TARGET_FRAME_RATE)
+    block_frames = period * max(1, NORMALIZE_BLOCK_FRAMES // period)
+    # Aritmética entera: sin errores de redondeo en las posiciones exactas
+    numerators = np.arange(block_frames, dtype=np.int64) * frame_rate
+    left = (numerators // TARGET_FRAME_RATE).astype(np.intp)
+    fraction = ((numerators % TARGET_FRAME_RATE) / TARGET_FRAME_RATE).astype(np.float32)
+    return block_frames, block_frames * frame_rate // TARGET_FRAME_RATE, left, left + 1, fraction
+
+
+def _mix_to_mono(frames, sample_width):
+    """Suma los canales de un bloque de frames en float32 (una muestra por frame)."""
+    if sample_width == 3:
+        # frames: (n, canales, 3) bytes little-endian; el byte alto lleva el signo
+        frames = (frames[..., 0].astype(np.int32) | (frames[..., 1].astype(np.int32) << 8)
+                  | (frames[..., 2].view(np.int8).astype(np.int32) << 16))
+    mono = frames[:, 0].astype(np.float32)
+    for channel in range(1, frames.shape[1]):
+        mono += frames[:, channel]
+    return mono
+
+
+def normalize_pcm(raw_data, frame_rate, channels, sample_width):
+    """Convierte PCM entrelazado con signo (como AudioSegment.raw_data) a mono 16 kHz 16 bits.
+
+    `raw_data` puede ser cualquier objeto con protocolo buffer (bytes,
+    bytearray, memoryview); no se copia. Devuelve (raw_audio_data,
+    sample_rate, sample_width_bytes).
+    """
+    if (channels, frame_rate, sample_width) == (TARGET_CHANNELS, TARGET_FRAME_RATE, TARGET_SAMPLE_WIDTH):
+        return bytes(raw_data), frame_rate, sample_width  # Ya está en el formato de destino
+    view = memoryview(raw_data).cast("B")
+    input_frames = len(view) // (channels * sample_width)
+    if sample_width == 3:
+        frames = np.frombuffer(view, dtype=np.uint8, count=input_frames * channels * 3).reshape(input_frames, channels, 3)
+    else:
+        frames = np.frombuffer(view, dtype=_SAMPLE_DTYPES[sample_width], count=input_frames * channels)
+        frames = frames.reshape(input_frames, channels)
+
+    output_frames = input_frames * TARGET_FRAME_RATE // frame_rate
+    output = np.empty(output_frames, dtype=np.int16)
+    block_frames, block_input_frames, left, right, fraction = _resample_plan(frame_rate)
+    # Media de los canales y cambio de profundidad en una sola multiplicación. No hace
+    # falta recortar: la interpolación no sale del rango de las muestras de entrada.
+    scale = 2.0 ** (8 * (TARGET_SAMPLE_WIDTH - sample_width)) / channels
+    for block, start in enumerate(range(0, output_frames, block_frames)):
+        count = min(block_frames, output_frames - start)
+        first = block * block_input_frames
+        mono = _mix_to_mono(frames[first:first + block_input_frames + 1], sample_width)
+        block_left, block_right = left[:count], right[:count]
+        if block_right[-1] >= len(mono):  # Último bloque: la última muestra no tiene vecina
+            block_right = np.minimum(block_right, len(mono) - 1)
+        samples = mono[block_left]
+        samples += (mono[block_right] - samples) * fraction[:count]
+        samples *= scale
+        output[start:start + count] = samples  # Trunca hacia cero, como audioop
+    return output.tobytes(), TARGET_FRAME_RATE, TARGET_SAMPLE_WIDTH
+
+
+@timed(AUDIO_NORMALIZE_SECONDS)
+def normalize_for_recognition(audio_segment):
+    """Convierte un AudioSegment de pydub a PCM mono 16 kHz 16 bits.
+
+    Devuelve (raw_audio_data, sample_rate, sample_width_bytes).
+    """
+    return normalize_pcm(audio_segment.raw_data, audio_segment.frame_rate, audio_segment.channels,
+                         audio_segment.sample_width)
+
+
+def recording_fingerprint(audio_segment):
+    """Huella barata de la grabación tal como llega del grabador (sin normalizar).
+
+    Sirve para detectar en los reruns de Streamlit que la grabación no ha cambiado
+    y evitar incluso la normalización.
+    """
+    digest = hashlib.sha1()
+    digest.update(f"{audio_segment.frame_rate}:{audio_segment.channels}:{audio_segment.sample_width}:".encode("utf-8"))
+    digest.update(audio_segment.raw_data)
+    return digest.hexdigest()
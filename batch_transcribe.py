@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Transcripción y reescritura por lotes de grabaciones archivadas, sin Streamlit.
+
+Recorre un directorio de audios y, para cada fichero:
+1. Decodifica y normaliza el audio (mono, 16 kHz, 16 bits) en un pool de procesos.
+2. Transcribe (por fragmentos, ver transcription_pipeline) y reescribe en el
+   estilo de la casa con Gemini, en un pool de hilos acotado (trabajo de E/S).
+
+Los resultados se escriben de forma incremental en JSONL o SQLite (según la
+extensión de --output). Si el proceso se interrumpe, al relanzarlo se saltan
+los ficheros ya procesados correctamente (y, si se pide reescritura, ya
+reescritos en el mismo estilo). Al final se informa del rendimiento
+en ficheros/minuto.
+
+Uso:
+    python batch_transcribe.py grabaciones/ --output resultados.jsonl --style ideal_versatile
+    python batch_transcribe.py grabaciones/ --output resultados.db --engine vosk --no-rewrite
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from audio_processing import normalize_for_recognition
+from gemini_models import build_gemini_models
+from recognizers import DEFAULT_ENGINE, DEFAULT_LANGUAGE, create_recognizer
+from resilience import get_client
+from rewriting import REWRITE_STYLES, generate_styled_rewrite
+from transcription_pipeline import transcribe_all
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".oga", ".m4a", ".flac", ".webm", ".aac")
+
+
+def find_audio_files(input_dir, extensions=AUDIO_EXTENSIONS):
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                yield os.path.join(root, name)
+
+
+def decode_and_normalize(path):
+    """Se ejecuta en el pool de procesos: decodifica el fichero y lo normaliza para STT."""
+    from pydub import AudioSegment
+
+    raw_audio_data, sample_rate, sample_width_bytes = normalize_for_recognition(AudioSegment.from_file(path))
+    return raw_audio_data, sample_rate, sample_width_bytes
+
+
+# --- Salida incremental y reanudable ---
+def is_completed(record, style_key=None):
+    """¿Se puede saltar el fichero? Sin error y, si se pide reescritura, reescrito en ese estilo."""
+    if record.get("error"):
+        return False
+    if style_key is None:
+        return True
+    # Una transcripción vacía no se reescribe: cuenta como hecha
+    return record.get("style") == style_key and (record.get("rewritten") is not None or not record.get("transcript"))
+
+
+class JsonlResultWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def completed_paths(self, style_key=None):
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Última línea a medio escribir si el proceso murió
+                if is_completed(record, style_key):
+                    completed.add(record["path"])
+        return completed
+
+    def __enter__(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class SqliteResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS batch_results (
+                path TEXT PRIMARY KEY,
+                audio_seconds REAL,
+                transcript TEXT,
+                rewritten TEXT,
+                style TEXT,
+                engine TEXT,
+                error TEXT,
+                elapsed_seconds REAL,
+                finished_at REAL
+            )
+        ''')
+        self._conn.commit()
+
+    def completed_paths(self, style_key=None):
+        rows = self._conn.execute("SELECT path, transcript, rewritten, style, error FROM batch_results")
+        return {row["path"] for row in rows if is_completed(dict(row), style_key)}
+
+    def __enter__(self):
+        return self
+
+    def write(self, record):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO batch_results "
+            "(path, audio_seconds, transcript, rewritten, style, engine, error, elapsed_seconds, finished_at) "
+            "VALUES (:path, :audio_seconds, :transcript, :rewritten, :style, :engine, :error, :elapsed_seconds, :finished_at)",
+            record,
+        )
+        self._conn.commit()
+
+    def __exit__(self, *exc_info):
+        self._conn.close()
+
+
+def open_result_writer(path):
+    if path.lower().endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteResultWriter(path)
+    return JsonlResultWriter(path)
+
+
+# --- Pipeline ---
+def process_decoded(path, decoded, recognize, model_rewrite, style_key, engine, chunk_executor, started_at):
+    """Se ejecuta en el pool de hilos: STT por fragmentos y reescritura."""
+    raw_audio_data, sample_rate, sample_width_bytes = decoded
+    record = {
+        "path": path,
+        "audio_seconds": len(raw_audio_data) / float(sample_rate * sample_width_bytes),
+        "transcript": None,
+        "rewritten": None,
+        "style": style_key if model_rewrite is not None else None,
+        "engine": engine,
+        "error": None,
+    }
+    try:
+        record["transcript"] = transcribe_all(raw_audio_data, sample_rate, sample_width_bytes, recognize, executor=chunk_executor)
+        if model_rewrite is not None and style_key and record["transcript"]:
+            record["rewritten"] = generate_styled_rewrite(model_rewrite, record["transcript"], style_key)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_seconds"] = time.perf_counter() - started_at
+    record["finished_at"] = time.time()
+    return record
+
+
+def run_batch(paths, writer, recognize, model_rewrite=None, style_key=None, engine=DEFAULT_ENGINE,
+              decode_workers=None, io_workers=8, progress=None):
+    """Procesa `paths` y escribe cada resultado en `writer` en cuanto termina.
+
+    Como máximo hay 2 * io_workers ficheros en vuelo (decodificados o
+    decodificándose), para acotar la memoria con directorios muy grandes.
+    Devuelve (procesados, errores, segundos).
+    """
+    max_in_flight = 2 * io_workers
+    path_iter = iter(paths)
+    decoding, processing = {}, {}
+    started = {}
+    done_count = error_count = 0
+    batch_start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=decode_workers) as decode_pool, \
+            ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="batch-io") as io_pool, \
+            ThreadPoolExecutor(max_workers=io_workers * 2, thread_name_prefix="batch-stt") as chunk_pool:
+        exhausted = False
+        while True:
+            while not exhausted and len(decoding) + len(processing) < max_in_flight:
+                path = next(path_iter, None)
+                if path is None:
+                    exhausted = True
+                    break
+                started[path] = time.perf_counter()
+                decoding[decode_pool.submit(decode_and_normalize, path)] = path
+            if not decoding and not processing:
+                break
+
+            finished, _ = wait(list(decoding) + list(processing), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in decoding:
+                    path = decoding.pop(future)
+                    try:
+                        decoded = future.result()
+                    except Exception as e:
+                        record = {"path": path, "audio_seconds": None, "transcript": None, "rewritten": None,
+                                  "style": style_key, "engine": engine, "error": f"Decodificación: {type(e).__name__}: {e}",
+                                  "elapsed_seconds": time.perf_counter() - started[path], "finished_at": time.time()}
+                    else:
+                        processing[io_pool.submit(process_decoded, path, decoded, recognize, model_rewrite,
+                                                  style_key, engine, chunk_pool, started[path])] = path
+                        continue
+                else:
+                    path = processing.pop(future)
+                    record = future.result()
+
+                started.pop(path, None)
+                writer.write(record)
+                done_count += 1
+                error_count += 1 if record["error"] else 0
+                if progress:
+                    progress(done_count, error_count, time.perf_counter() - batch_start, record)
+    return done_count, error_count, time.perf_counter() - batch_start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcripción y reescritura por lotes de grabaciones de llamadas.")
+    parser.add_argument("input_dir", help="directorio con las grabaciones (se recorre recursivamente)")
+    parser.add_argument("--output", default="resultados_batch.jsonl", help="fichero .jsonl o .db (SQLite) de resultados")
+    parser.add_argument("--style", default="ideal_versatile", choices=sorted(REWRITE_STYLES.values()), help="estilo de reescritura")
+    parser.add_argument("--no-rewrite", action="store_true", help="solo transcribir, sin reescribir con Gemini")
+    parser.add_argument("--engine", default=os.environ.get("STT_ENGINE", DEFAULT_ENGINE), help="motor STT: google, vosk o stub")
+    parser.add_argument("--language", default=DEFAULT_LANGUAGE)
+    parser.add_argument("--vosk-model", default=os.environ.get("VOSK_MODEL_PATH"), help="ruta del modelo Vosk")
+    parser.add_argument("--decode-workers", type=int, default=None, help="procesos de decodificación (por defecto, nº de CPUs)")
+    parser.add_argument("--io-workers", type=int, default=8, help="hilos concurrentes de STT y reescritura")
+    parser.add_argument("--gemini-rps", type=float, default=float(os.environ.get("GEMINI_REQUESTS_PER_SECOND", 5)),
+                        help="máximo de llamadas por segundo a Gemini")
+    args = parser.parse_args(argv)
+
+    # Reintentos, plazos, circuit breaker y limitación de tasa para no saturar los servicios remotos
+    recognize = create_recognizer(args.engine, language=args.language, model_path=args.vosk_model,
+                                  client=get_client("google_stt", rate_per_second=float(os.environ.get("STT_REQUESTS_PER_SECOND", 10)), burst=20))
+    model_rewrite = None
+    if not args.no_rewrite:
+        gemini_models = build_gemini_models(os.environ.get("GOOGLE_API_KEY"), client=get_client("gemini", rate_per_second=args.gemini_rps))
+        model_rewrite = gemini_models.rewrite
+        if gemini_models.error or model_rewrite is None:
+            # Sin modelo se guardarían filas sin reescribir que luego se darían por hechas
+            print(f"{gemini_models.error or 'Modelo de reescritura no disponible.'} Define GOOGLE_API_KEY "
+                  "o usa --no-rewrite para solo transcribir.", file=sys.stderr)
+            return 2
+    style_key = None if args.no_rewrite else args.style
+
+    writer = open_result_writer(args.output)
+    completed = writer.completed_paths(style_key)
+    paths = [path for path in find_audio_files(args.input_dir) if path not in completed]
+    print(f"{len(paths)} ficheros pendientes ({len(completed)} ya procesados en {args.output}).")
+
+    def progress(done, errors, elapsed, record):
+        status = "ERROR " + record["error"] if record["error"] else "ok"
+        print(f"[{done}/{len(paths)}] {record['path']}: {status} | {done / elapsed * 60:.1f} ficheros/min")
+
+    with writer:
+        done, errors, elapsed = run_batch(
+            paths, writer, recognize, model_rewrite=model_rewrite, style_key=style_key,
+            engine=args.engine, decode_workers=args.decode_workers, io_workers=args.io_workers, progress=progress,
+        )
+    rate = done / elapsed * 60 if elapsed else 0.0
+    print(f"Terminado: {done} ficheros ({errors} con error) en {elapsed:.1f} s = {rate:.1f} ficheros/min.")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la normalización de audio: cadena de pydub frente a la pasada única con NumPy.
+
+Compara, sobre WAV sintéticos de varias duraciones y formatos, la
+normalización anterior (set_channels + set_frame_rate + set_sample_width de
+pydub) con audio_processing.normalize_for_recognition: tiempo de CPU y pico
+de memoria (tracemalloc) por minuto de audio. Comprueba además que ambas
+salidas son equivalentes (misma duración y señal prácticamente idéntica).
+
+Si hay ffmpeg, mide también el coste por re-run de reproducir la grabación:
+codificarla en cada re-run (antes) frente a reutilizar los bytes en caché.
+
+Uso:
+    python benchmarks/audio_normalization.py --lengths 10,60,300 --repeat 5
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+from pydub import AudioSegment  # noqa: E402
+from pydub.utils import which  # noqa: E402
+
+from audio_processing import TARGET_CHANNELS, TARGET_FRAME_RATE, TARGET_SAMPLE_WIDTH, normalize_for_recognition  # noqa: E402
+from pipeline import synthetic_wav  # noqa: E402
+
+INPUT_FORMATS = (
+    # (nombre, tasa de muestreo, canales, bytes por muestra)
+    ("estéreo 44,1 kHz 16 bits", 44100, 2, 2),
+    ("estéreo 48 kHz 32 bits", 48000, 2, 4),
+    ("mono 8 kHz 16 bits", 8000, 1, 2),
+)
+
+
+def normalize_with_pydub_chain(audio_segment):
+    """La normalización anterior: tres conversiones encadenadas, cada una con su copia del audio."""
+    audio_segment = audio_segment.set_channels(TARGET_CHANNELS)
+    audio_segment = audio_segment.set_frame_rate(TARGET_FRAME_RATE)
+    audio_segment = audio_segment.set_sample_width(TARGET_SAMPLE_WIDTH)
+    return audio_segment.raw_data, audio_segment.frame_rate, audio_segment.sample_width
+
+
+def measure(normalize, segment, repeat):
+    """Devuelve (segundos de CPU por llamada, pico de memoria en bytes) de normalize(segment)."""
+    normalize(segment)  # Calentamiento
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        normalize(segment)
+    cpu_seconds = (time.process_time() - cpu_start) / repeat
+    # Pico de memoria en una pasada aparte: tracemalloc ralentiza cada asignación
+    tracemalloc.start()
+    normalize(segment)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_seconds, peak_bytes
+
+
+def equivalent(segment):
+    before = np.frombuffer(normalize_with_pydub_chain(segment)[0], dtype=np.int16).astype(np.float64)
+    after = np.frombuffer(normalize_for_recognition(segment)[0], dtype=np.int16).astype(np.float64)
+    length = min(len(before), len(after))
+    correlation = np.corrcoef(before[:length], after[:length])[0, 1] if length > 1 else 1.0
+    return abs(len(before) - len(after)) <= 1 and correlation > 0.99, correlation
+
+
+def bench_playback(segment, reruns):
+    """Segundos para servir la grabación en `reruns` re-runs: codificando siempre o solo la primera vez."""
+    start = time.perf_counter()
+    for _ in range(reruns):
+        segment.export().read()
+    every_rerun = time.perf_counter() - start
+    start = time.perf_counter()
+    cache = {}
+    for _ in range(reruns):
+        if "playback" not in cache:
+            cache["playback"] = segment.export().read()
+    cached = time.perf_counter() - start
+    return every_rerun, cached
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", default="10,60,300", help="duraciones de los WAV sintéticos en segundos")
+    parser.add_argument("--repeat", type=int, default=5, help="repeticiones para medir el tiempo de CPU")
+    parser.add_argument("--reruns", type=int, default=20, help="re-runs simulados para la reproducción")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f"{'formato':<26} {'dur. s':>7} {'CPU s/min antes':>16} {'después':>9} {'pico MiB/min antes':>19} "
+          f"{'después':>9} {'corr.':>7}")
+    mismatches = 0
+    for name, sample_rate, channels, sample_width in INPUT_FORMATS:
+        for seconds in (float(value) for value in args.lengths.split(",") if value.strip()):
+            wav = synthetic_wav(seconds, sample_rate=sample_rate, channels=channels, seed=args.seed)
+            segment = AudioSegment.from_wav(io.BytesIO(wav)).set_sample_width(sample_width)
+            del wav
+            ok, correlation = equivalent(segment)
+            mismatches += not ok
+            per_minute = 60.0 / seconds
+            cpu_before, peak_before = measure(normalize_with_pydub_chain, segment, args.repeat)
+            cpu_after, peak_after = measure(normalize_for_recognition, segment, args.repeat)
+            print(f"{name:<26} {seconds:>7g} {cpu_before * per_minute:>16.3f} {cpu_after * per_minute:>9.3f} "
+                  f"{peak_before * per_minute / 2 ** 20:>19.1f} {peak_after * per_minute / 2 ** 20:>9.1f} "
+                  f"{correlation:>7.4f}" + ("" if ok else "  ← salida distinta"))
+
+    if which("ffmpeg") or which("avconv"):
+        segment = AudioSegment.from_wav(io.BytesIO(synthetic_wav(60, seed=args.seed)))
+        every_rerun, cached = bench_playback(segment, args.reruns)
+        print(f"\nReproducción de 60 s en {args.reruns} re-runs: {every_rerun:.2f} s codificando en cada re-run, "
+              f"{cached:.2f} s con los bytes en caché")
+    else:
+        print("\nSin ffmpeg: se omite la medición de la reproducción.")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de estrés de concurrencia de la capa de datos (database.py).
+
+Simula muchas sesiones de Streamlit que leen, insertan y eliminan scripts a la
+vez sobre una base de datos temporal, y falla si alguna operación termina en
+error (por ejemplo, "database is locked").
+
+Uso:
+    python benchmarks/db_stress.py --sessions 32 --ops 200
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import ScriptsRepository, get_pool  # noqa: E402
+
+
+def simulate_session(repository, ops, seed, errors, counts):
+    rng = random.Random(seed)
+    own_ids = []
+    done = 0
+    for i in range(ops):
+        try:
+            action = rng.random()
+            if action < 0.6:
+                repository.list_frequent(limit=15)
+            elif action < 0.85 or not own_ids:
+                own_ids.append(repository.add(f"Script {seed}-{i}", f"Hola [Nombre Cliente], mensaje {i}"))
+            else:
+                repository.delete(own_ids.pop(rng.randrange(len(own_ids))))
+            done += 1
+        except sqlite3.Error as e:
+            errors.append(f"sesión {seed}: {type(e).__name__}: {e}")
+    counts.append(done)
+
+
+def run(sessions, ops, db_path):
+    repository = ScriptsRepository(get_pool(db_path))
+    errors, counts = [], []
+    threads = [
+        threading.Thread(target=simulate_session, args=(repository, ops, seed, errors, counts))
+        for seed in range(sessions)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return sum(counts), elapsed, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=32, help="sesiones simultáneas (hilos)")
+    parser.add_argument("--ops", type=int, default=200, help="operaciones por sesión")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        total, elapsed, errors = run(args.sessions, args.ops, os.path.join(tmp_dir, "stress.db"))
+
+    print(f"{args.sessions} sesiones, {total} operaciones correctas en {elapsed:.2f} s "
+          f"({total / elapsed:.0f} ops/s), {len(errors)} errores")
+    for error in errors[:10]:
+        print(f"  {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
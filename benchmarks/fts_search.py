@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la búsqueda de scripts (FTS5 + BM25 + usage_count).
+
+Genera un corpus sintético de scripts en español (vocabulario con distribución
+de Zipf, palabras con y sin tildes) en una base de datos temporal y mide la latencia de ScriptsRepository.search para
+consultas típicas de "buscar mientras se escribe".
+
+Uso:
+    python benchmarks/fts_search.py --scripts 50000 --repeat 200
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import ScriptsRepository, build_fts_query, get_pool  # noqa: E402
+
+DOMAIN_WORDS = (
+    "línea factura plan portabilidad cliente técnico visita router fibra móvil datos saldo recarga "
+    "promoción descuento encuesta satisfacción despedida saludo confirmación resolución reclamo "
+    "cobro pago fecha ticket instalación cambio equipo señal cobertura llamada consulta garantía "
+    "renovación contrato baja alta roaming internacional mensaje información adicional gracias"
+).split()
+SYLLABLES = "ba be bi bo ca ce ci co da de di do fa fe la le li lo ma me mi mo na ne no pa pe pi po ra re ri ro sa se si so ta te ti to".split()
+QUERIES = ["li", "lin", "linea", "factura", "portabilidad plan", "encuesta satisf", "confirmacion", "roaming inter", "zzz"]
+
+
+def build_vocabulary(rng, size):
+    # Vocabulario con distribución de Zipf: unas pocas palabras muy frecuentes y una cola larga,
+    # con las palabras del dominio repartidas entre los rangos medios
+    vocabulary = {"".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size * 2)}
+    vocabulary = sorted(vocabulary)[:size]
+    rng.shuffle(vocabulary)
+    for i, word in enumerate(DOMAIN_WORDS):
+        vocabulary.insert(20 + i * 25, word)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    return vocabulary, weights
+
+
+def build_corpus(repository, count, seed=42, vocabulary_size=5000):
+    rng = random.Random(seed)
+    vocabulary, weights = build_vocabulary(rng, vocabulary_size)
+    rows = []
+    for i in range(count):
+        name = " ".join(rng.choices(vocabulary, weights, k=3)).capitalize() + f" {i}"
+        template = "Hola [Nombre Cliente], " + " ".join(rng.choices(vocabulary, weights, k=rng.randint(15, 40))) + "."
+        rows.append((name, template, rng.randint(0, 500)))
+    with repository.pool.transaction() as conn:
+        conn.executemany("INSERT INTO frequent_scripts (name, template, usage_count) VALUES (?, ?, ?)", rows)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scripts", type=int, default=50000, help="tamaño del corpus sintético")
+    parser.add_argument("--repeat", type=int, default=200, help="repeticiones por consulta")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repository = ScriptsRepository(get_pool(os.path.join(tmp_dir, "fts.db")))
+        start = time.perf_counter()
+        build_corpus(repository, args.scripts)
+        print(f"Corpus: {args.scripts} scripts indexados en {time.perf_counter() - start:.2f} s")
+
+        print(f"{'consulta':<20} {'coincidencias':>13} {'resultados':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for query in QUERIES:
+            matches = repository.pool.fetch_one(
+                "SELECT count(*) FROM frequent_scripts_fts WHERE frequent_scripts_fts MATCH ?", (build_fts_query(query) or '""',)
+            )[0]
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results = repository.search(query, limit=15)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{query:<20} {matches:>13} {len(results):>10} {statistics.median(timings):>8.2f} {percentile(timings, 0.95):>8.2f}")
+        repository.pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de resiliencia del cliente de Gemini contra un modelo local con fallos inyectados.
+
+Simula varios agentes reescribiendo textos a la vez a través de
+ResilientClient + FakeGenerativeModel en tres fases: servicio normal, caída
+del proveedor (todas las llamadas fallan con 429) y recuperación. Para cada
+fase muestra cuántas reescrituras se sirvieron con normalidad (modelo o
+caché) y cuántas con el respaldo (caché o texto sin reescribir), la latencia
+y el estado del circuit breaker, y comprueba que ningún texto devuelto
+contiene un mensaje de error.
+
+Uso:
+    python benchmarks/gemini_resilience.py --agents 8 --requests 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gemini_models import FakeGenerativeModel, ResilientModel  # noqa: E402
+from resilience import ResilientClient  # noqa: E402
+from rewrite_cache import RewriteCache  # noqa: E402
+from rewriting import generate_styled_rewrite_or_fallback  # noqa: E402
+
+PHASES = (
+    # (nombre, probabilidad de fallo)
+    ("normal", 0.05),
+    ("caída", 1.0),
+    ("recuperación", 0.0),
+)
+
+
+def run_phase(model, rewrite_cache, agents, requests, seed):
+    results, latencies, leaks = [], [], []
+    lock = threading.Lock()
+
+    def agent(agent_id):
+        for i in range(requests):
+            # Algunos textos se repiten entre fases para que el respaldo pueda servir la caché
+            text = f"hola, quiero revisar mi factura número {(agent_id * requests + i) % 50}"
+            start = time.perf_counter()
+            rewritten, notice = generate_styled_rewrite_or_fallback(model, text, "concise_clear", rewrite_cache,
+                                                                    regenerate=(seed > 0 and i % 3 == 0))
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                results.append("respaldo" if notice else "ok")
+                if "error" in rewritten.lower():
+                    leaks.append(rewritten)
+
+    threads = [threading.Thread(target=agent, args=(agent_id,)) for agent_id in range(agents)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, latencies, leaks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--agents", type=int, default=8, help="agentes simultáneos (hilos)")
+    parser.add_argument("--requests", type=int, default=20, help="reescrituras por agente y fase")
+    parser.add_argument("--latency", type=float, default=0.02, help="latencia simulada del modelo en segundos")
+    args = parser.parse_args(argv)
+
+    client = ResilientClient("gemini-fake", rate_per_second=200, burst=20, max_retries=2, base_delay_seconds=0.02,
+                             max_delay_seconds=0.2, deadline_seconds=2.0, failure_threshold=5,
+                             reset_timeout_seconds=0.5, seed=1)
+    fake = FakeGenerativeModel(latency_seconds=args.latency, seed=1)
+    model = ResilientModel(fake, client)
+    rewrite_cache = RewriteCache(max_entries=1000)
+
+    print(f"{'fase':<14} {'ok':>7} {'respaldo':>9} {'p50 ms':>8} {'p95 ms':>8} {'llamadas':>9} "
+          f"{'reintentos':>10} {'rechazadas':>10} {'estado':>10}")
+    total_leaks = 0
+    for seed, (phase, failure_rate) in enumerate(PHASES):
+        fake.failure_rate = failure_rate
+        calls_before = fake.calls
+        stats_before = client.stats()
+        if phase == "recuperación":
+            time.sleep(client.breaker.reset_timeout_seconds)  # Deja pasar el tiempo de espera del circuito
+        results, latencies, leaks = run_phase(model, rewrite_cache, args.agents, args.requests, seed)
+        stats = client.stats()
+        ordered = sorted(latencies)
+        print(f"{phase:<14} {results.count('ok'):>7} {results.count('respaldo'):>9} "
+              f"{statistics.median(ordered) * 1000:>8.1f} {ordered[int(0.95 * (len(ordered) - 1))] * 1000:>8.1f} "
+              f"{fake.calls - calls_before:>9} {stats['retries'] - stats_before['retries']:>10} "
+              f"{stats['rejected'] - stats_before['rejected']:>10} {stats['state']:>10}")
+        total_leaks += len(leaks)
+
+    print(f"Circuito abierto {client.stats()['times_opened']} veces; textos con mensajes de error: {total_leaks}")
+    return 1 if total_leaks else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
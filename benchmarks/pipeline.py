@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark reproducible del pipeline audio → texto → reescritura → scripts.
+
+Mide las funciones de la app contra sustitutos locales y deterministas, sin
+servicios remotos ni sesión de Streamlit:
+
+- normalización del audio (pydub) sobre WAV sintéticos de varias duraciones
+  (ráfagas de tono separadas por silencios, estéreo a 44,1 kHz como el grabador);
+- reconocimiento por fragmentos (VAD + StubRecognizer con latencia configurable);
+- get_prompt_for_style y la reescritura con FakeGenerativeModel;
+- búsqueda de scripts (FTS5), ranking en memoria y personalización de plantillas
+  sobre una base de datos temporal.
+
+Para cada etapa muestra el rendimiento (operaciones por segundo), la latencia
+p50/p95/p99 y el pico de memoria (tracemalloc, en una pasada aparte para no
+alterar los tiempos). La prueba de carga simula N agentes a la vez que
+comparten, como en la app, la cola de trabajos, los motores y las cachés.
+
+Los resultados se comparan con una línea base y se marca como regresión lo
+que empeore más de --tolerance (el proceso termina con código 1). La línea
+base de referencia (pipeline_baseline.json) está versionada junto con la
+máquina en la que se midió. Con --save-baseline se guarda una línea base
+local (pipeline_baseline.local.json, ignorada por git), que tiene prioridad
+sobre la de referencia en las siguientes ejecuciones.
+
+Uso:
+    python benchmarks/pipeline.py
+    python benchmarks/pipeline.py --save-baseline
+    python benchmarks/pipeline.py --save-baseline --baseline benchmarks/pipeline_baseline.json  # nueva referencia
+    python benchmarks/pipeline.py --agents 16 --calls 10
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pydub import AudioSegment  # noqa: E402
+
+from audio_processing import normalize_for_recognition  # noqa: E402
+from database import ScriptsRepository, get_pool  # noqa: E402
+from gemini_models import FakeGenerativeModel, ResilientModel  # noqa: E402
+from job_queue import DONE, JobQueue  # noqa: E402
+from recognizers import StubRecognizer  # noqa: E402
+from resilience import ResilientClient  # noqa: E402
+from rewrite_cache import RewriteCache  # noqa: E402
+from rewriting import REWRITE_STYLES, generate_styled_rewrite, get_prompt_for_style  # noqa: E402
+from script_ranking import RankedScripts  # noqa: E402
+from script_templates import get_compiled_template  # noqa: E402
+from transcription_pipeline import transcribe_all  # noqa: E402
+
+REFERENCE_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_baseline.json")
+LOCAL_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline_baseline.local.json")
+
+SCRIPT_WORDS = (
+    "línea factura plan portabilidad técnico visita router fibra móvil datos saldo recarga promoción "
+    "descuento encuesta despedida saludo confirmación resolución reclamo cobro pago ticket instalación"
+).split()
+SEARCH_QUERIES = ("factura", "plan móvil", "despedida", "router fibra", "encuesta satisf", "recarga saldo")
+CUSTOMER_PHRASES = (
+    "hola quiero saber por qué mi factura de este mes es más alta",
+    "no tengo señal en casa desde ayer y necesito que venga un técnico",
+    "me gustaría cambiarme a un plan con más datos móviles",
+    "quiero dar de baja la línea adicional que contraté",
+)
+FIELD_VALUES = {"Nombre Cliente": "Ana Pérez", "Numero Linea": "600123456", "Plan": "Fibra 600", "Ticket": "T-1234"}
+
+
+# --- Entradas sintéticas ---
+def synthetic_wav(seconds, sample_rate=44100, channels=2, seed=0):
+    """WAV PCM de 16 bits con ráfagas de "voz" (tonos) de 0,8-2 s separadas por silencios de 0,5-1 s."""
+    rng = random.Random(seed)
+    frame_bytes = 2 * channels
+    frames = bytearray()
+    total_frames = int(seconds * sample_rate)
+    while len(frames) < total_frames * frame_bytes:
+        # Un periodo del tono y se repite: generar muestra a muestra en Python sería lento
+        period = rng.randint(40, 200)
+        amplitude = rng.randint(3000, 12000)
+        cycle = b"".join(struct.pack("<h", int(amplitude * math.sin(2 * math.pi * i / period))) * channels
+                         for i in range(period))
+        burst_frames = int(rng.uniform(0.8, 2.0) * sample_rate)
+        frames += (cycle * (burst_frames // period + 1))[:burst_frames * frame_bytes]
+        frames += bytes(int(rng.uniform(0.5, 1.0) * sample_rate) * frame_bytes)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames[:total_frames * frame_bytes]))
+    return buffer.getvalue()
+
+
+def build_scripts_repository(db_path, count, seed):
+    repository = ScriptsRepository(get_pool(db_path))
+    rng = random.Random(seed)
+    for i in range(count):
+        words = " ".join(rng.choice(SCRIPT_WORDS) for _ in range(rng.randint(8, 30)))
+        repository.add(f"Script {i} {rng.choice(SCRIPT_WORDS)}",
+                       f"Hola [Nombre Cliente], sobre su línea [Numero Linea]: {words}. Plan [Plan|actual], ticket [Ticket].")
+    return repository
+
+
+# --- Medición ---
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies, wall_seconds, peak_bytes, **extra):
+    ordered = sorted(latencies)
+    return dict(
+        ops=len(ordered),
+        throughput_per_s=len(ordered) / wall_seconds if wall_seconds else 0.0,
+        p50_ms=percentile(ordered, 0.50) * 1000,
+        p95_ms=percentile(ordered, 0.95) * 1000,
+        p99_ms=percentile(ordered, 0.99) * 1000,
+        peak_kib=peak_bytes / 1024 if peak_bytes is not None else None,
+        **extra,
+    )
+
+
+def bench(operation, inputs, repeat):
+    """Ejecuta operation(x) para cada entrada `repeat` veces y resume tiempos y pico de memoria."""
+    operation(inputs[0])  # Calentamiento (cachés de pydub, compilación de regex, páginas de SQLite...)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for value in inputs:
+            op_start = time.perf_counter()
+            operation(value)
+            latencies.append(time.perf_counter() - op_start)
+    wall_seconds = time.perf_counter() - start
+    # El pico de memoria se mide aparte: tracemalloc ralentiza cada asignación
+    tracemalloc.start()
+    for value in inputs:
+        operation(value)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(latencies, wall_seconds, peak_bytes)
+
+
+def run_stages(args, segments, recognizer, model, repository, ranked_scripts):
+    results = {}
+    stt_executor = ThreadPoolExecutor(max_workers=args.stt_workers, thread_name_prefix="bench-stt")
+    for seconds, segment in segments.items():
+        results[f"normalizacion_{seconds:g}s"] = bench(normalize_for_recognition, [segment], args.repeat)
+        raw_audio_data, sample_rate, sample_width_bytes = normalize_for_recognition(segment)
+        results[f"reconocimiento_{seconds:g}s"] = bench(
+            lambda raw: transcribe_all(raw, sample_rate, sample_width_bytes, recognizer, executor=stt_executor),
+            [raw_audio_data], args.repeat)
+    stt_executor.shutdown()
+
+    style_keys = list(REWRITE_STYLES.values())
+    prompts_in = [(phrase, style_key) for phrase in CUSTOMER_PHRASES for style_key in style_keys]
+    results["prompt_estilo"] = bench(lambda value: get_prompt_for_style(*value), prompts_in, args.repeat * 50)
+    results["reescritura"] = bench(lambda value: generate_styled_rewrite(model, *value), prompts_in, args.repeat)
+    results["reescritura_streaming"] = bench(
+        lambda value: generate_styled_rewrite(model, *value, on_partial=lambda partial: None), prompts_in, args.repeat)
+
+    results["busqueda_scripts"] = bench(lambda query: repository.search(query, limit=15), list(SEARCH_QUERIES), args.repeat * 10)
+    results["ranking_top"] = bench(lambda _: ranked_scripts.top(), [None], args.repeat * 100)
+    top_scripts = ranked_scripts.top()
+    results["personalizacion"] = bench(
+        lambda script: get_compiled_template(script['template'], script['compiled_template']).render(FIELD_VALUES),
+        top_scripts, args.repeat * 50)
+    return results
+
+
+# --- Prueba de carga: N agentes a la vez ---
+def wait_for_job(job_queue, job_id, poll_seconds):
+    # Como el fragmento de sondeo de la app: se consulta el estado cada poll_seconds
+    while True:
+        job = job_queue.get(job_id)
+        if job is None or job.done:
+            return job
+        time.sleep(poll_seconds)
+
+
+def run_load_test(args, segments, recognizer, model, repository, ranked_scripts):
+    job_queue = JobQueue(max_workers=16)
+    stt_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bench-load-stt")
+    rewrite_cache = RewriteCache(max_entries=256)
+    style_keys = list(REWRITE_STYLES.values())
+    recordings = list(segments.values())
+    lock = threading.Lock()
+    call_latencies, stage_latencies, failures = [], {"stt": [], "reescritura": [], "scripts": []}, []
+
+    def agent(agent_id):
+        rng = random.Random(args.seed * 1000 + agent_id)
+        for call in range(args.calls):
+            call_start = time.perf_counter()
+            try:
+                segment = recordings[rng.randrange(len(recordings))]
+
+                def transcribe(job, segment=segment):
+                    raw_audio_data, sample_rate, sample_width_bytes = normalize_for_recognition(segment)
+                    return transcribe_all(raw_audio_data, sample_rate, sample_width_bytes, recognizer, executor=stt_executor)
+                job = wait_for_job(job_queue, job_queue.submit(("stt", agent_id, call), transcribe, kind="stt"), args.poll)
+                stt_done = time.perf_counter()
+                if job.status != DONE:
+                    raise RuntimeError(f"STT: {job.status} ({job.error})")
+
+                # Frases repetidas entre agentes: parte de las reescrituras salen de la caché compartida
+                text, style_key = rng.choice(CUSTOMER_PHRASES), rng.choice(style_keys)
+                job = wait_for_job(job_queue, job_queue.submit(
+                    ("rewrite", text, style_key),
+                    lambda job, text=text, style_key=style_key: generate_styled_rewrite(model, text, style_key, rewrite_cache),
+                    kind="rewrite"), args.poll)
+                rewrite_done = time.perf_counter()
+                if job.status != DONE:
+                    raise RuntimeError(f"Reescritura: {job.status} ({job.error})")
+
+                scripts = repository.search(rng.choice(SEARCH_QUERIES), limit=15) or ranked_scripts.top()
+                script = scripts[0]
+                get_compiled_template(script['template'], script['compiled_template']).render(FIELD_VALUES)
+                ranked_scripts.record_use(script['id'])
+                done = time.perf_counter()
+            except Exception as e:
+                with lock:
+                    failures.append(e)
+                continue
+            with lock:
+                call_latencies.append(done - call_start)
+                stage_latencies["stt"].append(stt_done - call_start)
+                stage_latencies["reescritura"].append(rewrite_done - stt_done)
+                stage_latencies["scripts"].append(done - rewrite_done)
+
+    threads = [threading.Thread(target=agent, args=(agent_id,)) for agent_id in range(args.agents)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    queue_stats = job_queue.stats()
+    job_queue.shutdown()
+    stt_executor.shutdown()
+
+    results = {f"carga_{args.agents}_agentes": summarize(
+        call_latencies, wall_seconds, peak_bytes, failures=len(failures),
+        queue_wait_p95_ms=queue_stats['wait_p95_seconds'] * 1000, rewrite_cache_hit_rate=rewrite_cache.stats()['hit_rate'])}
+    for stage, latencies in stage_latencies.items():
+        # Tiempo de cada etapa dentro de la llamada; la memoria es la del total
+        results[f"carga_{stage}"] = summarize(latencies, wall_seconds, None)
+    return results, failures
+
+
+# --- Informe y línea base ---
+def machine_info():
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def format_machine(machine):
+    return f"{machine['processor']}, {machine['cpus']} CPUs, {machine['platform']}, Python {machine['python']}"
+
+
+def print_results(results):
+    print(f"{'etapa':<26} {'ops':>6} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'pico KiB':>10}")
+    for name, result in results.items():
+        peak = f"{result['peak_kib']:.0f}" if result['peak_kib'] is not None else "-"
+        print(f"{name:<26} {result['ops']:>6} {result['throughput_per_s']:>9.1f} {result['p50_ms']:>9.3f} "
+              f"{result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f} {peak:>10}")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Imprime la variación respecto a la línea base y devuelve las regresiones."""
+    regressions = []
+    print(f"\nComparación con la línea base (tolerancia {tolerance:.0%}):")
+    print(f"{'etapa':<26} {'Δ ops/s':>9} {'Δ p95':>9} {'Δ pico':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        changes = {
+            "ops/s": (result['throughput_per_s'] - base['throughput_per_s']) / base['throughput_per_s']
+            if base['throughput_per_s'] else 0.0,
+            "p95": (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] if base['p95_ms'] else 0.0,
+            "pico": (result['peak_kib'] - base['peak_kib']) / base['peak_kib'] if result['peak_kib'] and base['peak_kib'] else 0.0,
+        }
+        worse = [metric for metric, change in changes.items() if (-change if metric == "ops/s" else change) > tolerance]
+        regressions.extend(f"{name} ({metric})" for metric in worse)
+        print(f"{name:<26} {changes['ops/s']:>+9.0%} {changes['p95']:>+9.0%} {changes['pico']:>+9.0%}"
+              + ("  ← regresión" if worse else ""))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", default="5,30,120", help="duraciones de los WAV sintéticos en segundos, separadas por comas")
+    parser.add_argument("--repeat", type=int, default=5, help="repeticiones por entrada en cada etapa")
+    parser.add_argument("--stt-latency", type=float, default=0.02, help="latencia simulada del STT por fragmento (s)")
+    parser.add_argument("--stt-workers", type=int, default=4, help="fragmentos transcritos en paralelo por grabación")
+    parser.add_argument("--gemini-latency", type=float, default=0.02, help="latencia simulada de Gemini por llamada (s)")
+    parser.add_argument("--scripts", type=int, default=2000, help="scripts en la base de datos temporal")
+    parser.add_argument("--agents", type=int, default=8, help="agentes simultáneos en la prueba de carga (0 la omite)")
+    parser.add_argument("--calls", type=int, default=5, help="llamadas atendidas por cada agente en la prueba de carga")
+    parser.add_argument("--poll", type=float, default=0.05, help="intervalo de sondeo de los trabajos (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=None,
+                        help="fichero JSON de la línea base (por defecto, la local si existe; si no, la de referencia)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="guarda estos resultados como línea base (por defecto, la local)")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="empeoramiento admitido respecto a la línea base")
+    args = parser.parse_args(argv)
+
+    lengths = [float(value) for value in args.lengths.split(",") if value.strip()]
+    segments = {seconds: AudioSegment.from_wav(io.BytesIO(synthetic_wav(seconds, seed=args.seed + i)))
+                for i, seconds in enumerate(lengths)}
+    recognizer = StubRecognizer(latency_seconds=args.stt_latency, seed=args.seed)
+    client = ResilientClient("gemini-bench", rate_per_second=None, max_retries=0, seed=args.seed)
+    model = ResilientModel(FakeGenerativeModel(latency_seconds=args.gemini_latency, seed=args.seed), client)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repository = build_scripts_repository(os.path.join(tmp_dir, "bench.db"), args.scripts, args.seed)
+        ranked_scripts = RankedScripts(repository, background_flush=False)
+        results = run_stages(args, segments, recognizer, model, repository, ranked_scripts)
+        failures = []
+        if args.agents > 0:
+            load_results, failures = run_load_test(args, segments, recognizer, model, repository, ranked_scripts)
+            results.update(load_results)
+        get_pool(os.path.join(tmp_dir, "bench.db")).close()
+
+    print_results(results)
+    if failures:
+        print(f"\n{len(failures)} llamadas fallaron en la prueba de carga; primer error: {failures[0]}")
+    config = {name: getattr(args, name) for name in ("lengths", "repeat", "stt_latency", "stt_workers", "gemini_latency",
+                                                    "scripts", "agents", "calls", "poll", "seed")}
+
+    status = 1 if failures else 0
+    machine = machine_info()
+    if args.save_baseline:
+        baseline_path = args.baseline or LOCAL_BASELINE_PATH
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine, "config": config, "results": results}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\nLínea base guardada en {baseline_path}")
+        return status
+    baseline_path = args.baseline or (LOCAL_BASELINE_PATH if os.path.exists(LOCAL_BASELINE_PATH) else REFERENCE_BASELINE_PATH)
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        baseline_machine = baseline.get("machine")
+        print(f"\nLínea base: {os.path.relpath(baseline_path)}"
+              + (f" (medida en {format_machine(baseline_machine)})" if baseline_machine else ""))
+        if baseline.get("config") != config:
+            print("Aviso: la línea base se generó con otros parámetros; la comparación es orientativa.")
+        elif baseline_machine != machine:
+            print("Aviso: la línea base se midió en otra máquina; la comparación es orientativa "
+                  "(--save-baseline guarda una local).")
+        regressions = compare_with_baseline(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"Regresiones: {', '.join(regressions)}")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Capa de datos SQLite compartida.
+
+- Un pool de conexiones por fichero de base de datos, compartido por todo el
+  proceso (y por tanto por todas las sesiones de Streamlit).
+- Modo WAL y busy_timeout, para que lecturas y escrituras concurrentes no
+  terminen en "database is locked".
+- El esquema se inicializa una sola vez por proceso mediante migraciones
+  numeradas registradas en la tabla schema_migrations.
+- Consultas parametrizadas reutilizando la caché de sentencias preparadas de
+  sqlite3.
+- Las operaciones del repositorio se miden en sqlite_query_seconds (metrics.py).
+"""
+
+import math
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import SQLITE_QUERY_SECONDS, timed
+from script_templates import compile_template
+
+DEFAULT_DB_PATH = 'app_data.db'
+DEFAULT_POOL_SIZE = 8
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+
+
+def _cache_table_ddl(table):
+    # Esquema común de los niveles SQLite de tiered_cache.TieredCache
+    return f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            cache_key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            cost_seconds REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+        '''
+
+
+# (versión, descripción, sentencias). Nunca se modifica una migración ya publicada: se añade una nueva.
+MIGRATIONS = [
+    (1, "Tabla de scripts frecuentes", [
+        '''
+        CREATE TABLE IF NOT EXISTS frequent_scripts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            template TEXT NOT NULL,
+            usage_count INTEGER DEFAULT 0
+        )
+        ''',
+    ]),
+    (2, "Tablas de las cachés de transcripción y de reescritura", [
+        _cache_table_ddl("transcription_cache"),
+        _cache_table_ddl("rewrite_cache"),
+    ]),
+    (3, "Búsqueda de texto completo (FTS5) sobre los scripts", [
+        # unicode61 con remove_diacritics 2: "línea" y "linea" coinciden. Índices de prefijo para buscar mientras se escribe.
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS frequent_scripts_fts USING fts5(
+            name, template,
+            content='frequent_scripts', content_rowid='id',
+            tokenize="unicode61 remove_diacritics 2",
+            prefix='3 4'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS frequent_scripts_fts_ai AFTER INSERT ON frequent_scripts BEGIN
+            INSERT INTO frequent_scripts_fts(rowid, name, template) VALUES (new.id, new.name, new.template);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS frequent_scripts_fts_ad AFTER DELETE ON frequent_scripts BEGIN
+            INSERT INTO frequent_scripts_fts(frequent_scripts_fts, rowid, name, template) VALUES ('delete', old.id, old.name, old.template);
+        END
+        ''',
+        # Solo al cambiar nombre o plantilla: los incrementos de usage_count no tocan el índice
+        '''
+        CREATE TRIGGER IF NOT EXISTS frequent_scripts_fts_au AFTER UPDATE OF name, template ON frequent_scripts BEGIN
+            INSERT INTO frequent_scripts_fts(frequent_scripts_fts, rowid, name, template) VALUES ('delete', old.id, old.name, old.template);
+            INSERT INTO frequent_scripts_fts(rowid, name, template) VALUES (new.id, new.name, new.template);
+        END
+        ''',
+        "INSERT INTO frequent_scripts_fts(frequent_scripts_fts) VALUES ('rebuild')",
+    ]),
+    (4, "Plantilla compilada junto a cada script", [
+        # JSON de segmentos de script_templates.CompiledTemplate; NULL = se compila al leer
+        "ALTER TABLE frequent_scripts ADD COLUMN compiled_template TEXT",
+    ]),
+    (5, "Tabla de la caché de sugerencias", [
+        _cache_table_ddl("suggestion_cache"),
+    ]),
+]
+
+# Pesos BM25 por columna (name, template): una coincidencia en el nombre pesa más
+SEARCH_BM25_WEIGHTS = (10.0, 1.0)
+# Peso del uso en el orden final: score = relevancia BM25 + SEARCH_USAGE_WEIGHT * log(1 + usage_count)
+SEARCH_USAGE_WEIGHT = 0.5
+SEARCH_CANDIDATES = 50
+SEARCH_MIN_PREFIX_LENGTH = 3
+
+_SEARCH_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_fts_query(text):
+    """Convierte lo que escribe el agente en una consulta FTS5 segura.
+
+    Las palabras de 3 o más letras se buscan como prefijo ("lin" encuentra
+    "línea"); las de 2 letras, como palabra exacta (un prefijo tan corto coincide
+    con casi todo el índice) y las de una letra se descartan. Todas deben
+    aparecer. Se eliminan los operadores y caracteres especiales de FTS5.
+    """
+    terms = []
+    for token in _SEARCH_TOKEN_RE.findall(text or ""):
+        if len(token) >= SEARCH_MIN_PREFIX_LENGTH:
+            terms.append(f'"{token}"*')
+        elif len(token) > 1:
+            terms.append(f'"{token}"')
+    return " ".join(terms)
+
+
+class ConnectionPool:
+    def __init__(self, db_path=DEFAULT_DB_PATH, size=DEFAULT_POOL_SIZE, busy_timeout_ms=DEFAULT_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_connection(self):
+        # isolation_level=None: modo autocommit; las transacciones se abren explícitamente en transaction()
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    def _acquire(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._create_connection()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"No hay conexiones libres en el pool tras {timeout} s")
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self, timeout=10):
+        """Presta una conexión del pool en modo autocommit (lecturas y escrituras sueltas)."""
+        conn = self._acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self, timeout=10):
+        """Presta una conexión dentro de una transacción BEGIN IMMEDIATE.
+
+        Se toma el bloqueo de escritura desde el principio para evitar los
+        interbloqueos de las transacciones diferidas que pasan de lectura a escritura.
+        """
+        with self.connection(timeout) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+
+    # --- Atajos para consultas parametrizadas ---
+    def fetch_all(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def fetch_one(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def execute(self, sql, params=()):
+        """Ejecuta una escritura en su propia transacción y devuelve el cursor."""
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def apply_migrations(pool, migrations=MIGRATIONS):
+    """Aplica las migraciones pendientes y devuelve la versión final del esquema."""
+    with pool.transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at REAL NOT NULL
+            )
+        ''')
+        current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+        for version, description, statements in migrations:
+            if version <= current:
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, time.time()),
+            )
+            current = version
+    return current
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=DEFAULT_DB_PATH):
+    """Devuelve el pool del proceso para `db_path`, migrando el esquema la primera vez."""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            apply_migrations(pool)
+            _pools[db_path] = pool
+        return pool
+
+
+class ScriptsRepository:
+    """Acceso a la tabla frequent_scripts."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @timed(SQLITE_QUERY_SECONDS, operation="scripts.list_frequent")
+    def list_frequent(self, limit=15):
+        return self.pool.fetch_all(
+            "SELECT id, name, template, compiled_template, usage_count FROM frequent_scripts "
+            "ORDER BY usage_count DESC, name LIMIT ?", (limit,)
+        )
+
+    @timed(SQLITE_QUERY_SECONDS, operation="scripts.get")
+    def get(self, script_id):
+        return self.pool.fetch_one(
+            "SELECT id, name, template, compiled_template, usage_count FROM frequent_scripts WHERE id = ?", (script_id,)
+        )
+
+    @timed(SQLITE_QUERY_SECONDS, operation="scripts.add")
+    def add(self, name, template, compiled_template=None):
+        # La plantilla se compila una sola vez, al guardarla
+        if compiled_template is None:
+            compiled_template = compile_template(template)
+        return self.pool.execute(
+            "INSERT INTO frequent_scripts (name, template, compiled_template) VALUES (?, ?, ?)",
+            (name, template, compiled_template.to_json()),
+        ).lastrowid
+
+    @timed(SQLITE_QUERY_SECONDS, operation="scripts.delete")
+    def delete(self, script_id):
+        self.pool.execute("DELETE FROM frequent_scripts WHERE id = ?", (script_id,))
+
+    def _ranked_matches(self, fts_query, candidates, exclude_ids=()):
+        rows = self.pool.fetch_all(
+            "SELECT s.id, s.name, s.template, s.compiled_template, s.usage_count, bm25(frequent_scripts_fts, ?, ?) AS bm25_rank "
+            "FROM frequent_scripts_fts JOIN frequent_scripts s ON s.id = frequent_scripts_fts.rowid "
+            "WHERE frequent_scripts_fts MATCH ? ORDER BY bm25_rank LIMIT ?",
+            (*SEARCH_BM25_WEIGHTS, fts_query, candidates + len(exclude_ids)),
+        )
+        results = []
+        for row in rows:
+            if row['id'] in exclude_ids:
+                continue
+            script = dict(row)
+            # bm25() devuelve valores negativos: cuanto menor, más relevante
+            script['score'] = -script.pop('bm25_rank') + SEARCH_USAGE_WEIGHT * math.log1p(script['usage_count'] or 0)
+            results.append(script)
+        results.sort(key=lambda script: -script['score'])
+        return results
+
+    @timed(SQLITE_QUERY_SECONDS, operation="scripts.search")
+    def search(self, text, limit=15):
+        """Busca scripts por nombre y plantilla.
+
+        Primero se buscan coincidencias en el nombre y, solo si no llenan el
+        límite, se completa con las que aparecen únicamente en la plantilla.
+        Así una palabra muy común en las plantillas no obliga a puntuar con
+        BM25 miles de filas. En cada grupo los candidatos se ordenan por BM25
+        y se mezclan con usage_count, para que entre resultados igual de
+        relevantes suban los más usados. Devuelve dicts con id, name, template,
+        compiled_template, usage_count y score.
+        """
+        fts_query = build_fts_query(text)
+        if not fts_query:
+            return []
+        candidates = max(limit, SEARCH_CANDIDATES)
+        results = self._ranked_matches(f"{{name}} : ({fts_query})", candidates)[:limit]
+        if len(results) < limit:
+            name_ids = {script['id'] for script in results}
+            results += self._ranked_matches(fts_query, candidates, exclude_ids=name_ids)[:limit - len(results)]
+        return results
+
+    @timed(SQLITE_QUERY_SECONDS, operation="scripts.increment_usage")
+    def increment_usage(self, counts):
+        """Suma en una sola transacción los usos acumulados {script_id: incremento}."""
+        if not counts:
+            return
+        with self.pool.transaction() as conn:
+            conn.executemany(
+                "UPDATE frequent_scripts SET usage_count = COALESCE(usage_count, 0) + ? WHERE id = ?",
+                [(increment, script_id) for script_id, increment in counts.items()],
+            )
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de modelos Gemini.
+
+Se construye una sola vez por proceso (la app lo envuelve en st.cache_resource)
+y lo comparten todas las sesiones: un modelo para reescritura y otro para las
+sugerencias post-resolución, cada uno con su configuración de generación.
+
+Con un ResilientClient (ver resilience.py) los modelos se envuelven en
+ResilientModel, que aplica limitación de tasa, reintentos, plazos y circuit
+breaker a generate_content. FakeGenerativeModel es un modelo local con la
+misma interfaz que inyecta latencia y fallos, para pruebas sin red.
+"""
+
+import itertools
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+
+import google.generativeai as genai
+
+MODEL_NAME = 'gemini-1.5-flash' # o 'gemini-1.5-pro' para mayor calidad (puede ser más lento/costoso)
+PLACEHOLDER_API_KEY = "TU_GOOGLE_API_KEY_AQUI"
+
+# Un valor entre 0.0 y 1.0. Más alto = más creativo/diverso.
+REWRITE_GENERATION_CONFIG = {"temperature": 0.7}
+# Las sugerencias son scripts cortos: algo más de creatividad y una longitud acotada
+SUGGESTION_GENERATION_CONFIG = {"temperature": 0.8, "max_output_tokens": 256}
+# Sugerencias post-resolución en una sola llamada: respuesta JSON con varios scripts
+STRUCTURED_SUGGESTION_GENERATION_CONFIG = {"response_mime_type": "application/json", "max_output_tokens": 512}
+
+GeminiModels = namedtuple("GeminiModels", ["rewrite", "suggestion", "error"])
+
+
+def is_api_key_configured(api_key):
+    return bool(api_key) and api_key != PLACEHOLDER_API_KEY
+
+
+class ResilientModel:
+    """Envuelve un modelo para que generate_content pase por un ResilientClient.
+
+    En streaming se reintenta hasta recibir el primer fragmento; un fallo a
+    mitad de la respuesta se propaga (y cuenta para el circuit breaker).
+    """
+
+    def __init__(self, model, client):
+        self.model = model
+        self.client = client
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        request_options = kwargs.pop("request_options", None) or {}
+
+        def attempt(timeout_seconds):
+            response = self.model.generate_content(prompt, stream=stream, request_options=dict(request_options, timeout=timeout_seconds), **kwargs)
+            if not stream:
+                response.text  # Los errores de la respuesta también se reintentan
+                return response
+            chunks = iter(response)
+            return next(chunks, None), chunks
+
+        if not stream:
+            return self.client.call(attempt)
+        first_chunk, chunks = self.client.call(attempt)
+        return self._stream(first_chunk, chunks)
+
+    def _stream(self, first_chunk, chunks):
+        try:
+            for chunk in itertools.chain([first_chunk] if first_chunk is not None else [], chunks):
+                yield chunk
+        except Exception as e:
+            self.client.record_failure(e)
+            raise
+
+
+FakeUsageMetadata = namedtuple("FakeUsageMetadata", ["prompt_token_count", "candidates_token_count", "total_token_count"])
+
+
+class _FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+def _fake_usage(prompt, text):
+    # Aproximación de ~4 caracteres por token, suficiente para probar la contabilidad de tokens
+    prompt_tokens, output_tokens = len(prompt) // 4 + 1, len(text) // 4 + 1
+    return FakeUsageMetadata(prompt_tokens, output_tokens, prompt_tokens + output_tokens)
+
+
+class FakeGenerativeModel:
+    """Modelo local y determinista (con `seed`) con la interfaz de generate_content.
+
+    Inyecta `latency_seconds` por llamada y falla con probabilidad
+    `failure_rate` lanzando error_factory() (por defecto, un 429
+    ResourceExhausted). Respeta request_options["timeout"] y, con
+    response_mime_type JSON, responde con las sugerencias estructuradas. Las
+    respuestas incluyen un usage_metadata aproximado.
+    """
+
+    def __init__(self, text="Frase reescrita: Texto reescrito por el modelo de prueba.", latency_seconds=0.0,
+                 failure_rate=0.0, error_factory=None, seed=0, chunk_size=12, chunk_delay_seconds=0.0):
+        self.text = text
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.error_factory = error_factory or _default_fake_error
+        self.chunk_size = chunk_size
+        self.chunk_delay_seconds = chunk_delay_seconds
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False, generation_config=None, request_options=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            fails = self._random.random() < self.failure_rate
+        timeout_seconds = (request_options or {}).get("timeout")
+        if timeout_seconds is not None and self.latency_seconds > timeout_seconds:
+            time.sleep(timeout_seconds)
+            raise TimeoutError(f"La llamada superó el timeout de {timeout_seconds:.1f} s.")
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if fails:
+            raise self.error_factory()
+
+        text = self.text
+        if isinstance(generation_config, dict) and generation_config.get("response_mime_type") == "application/json":
+            text = json.dumps({
+                "sales_bridge": "Aprovechando su llamada, ¿le gustaría conocer nuestro plan con más datos?",
+                "survey_invitation": "¿Nos ayudaría respondiendo una breve encuesta sobre la atención recibida?",
+                "closing_line": "Gracias por su tiempo, que tenga un excelente día.",
+            }, ensure_ascii=False)
+        if not stream:
+            return _FakeResponse(text, _fake_usage(prompt, text))
+        return self._chunks(prompt, text)
+
+    def _chunks(self, prompt, text):
+        for start in range(0, len(text), self.chunk_size):
+            if self.chunk_delay_seconds:
+                time.sleep(self.chunk_delay_seconds)
+            last = start + self.chunk_size >= len(text)
+            yield _FakeResponse(text[start:start + self.chunk_size], _fake_usage(prompt, text) if last else None)
+
+
+def _default_fake_error():
+    from google.api_core import exceptions as google_exceptions
+
+    return google_exceptions.ResourceExhausted("429 Cuota agotada (fallo inyectado por FakeGenerativeModel).")
+
+
+def build_gemini_models(api_key, model_name=MODEL_NAME, client=None):
+    """Configura la API y crea los modelos de reescritura y sugerencias.
+
+    Con `client` (un ResilientClient), los modelos se envuelven en
+    ResilientModel. Nunca lanza excepciones: si falta la API Key o falla la
+    inicialización, los modelos son None y `error` describe el motivo.
+    """
+    if not is_api_key_configured(api_key):
+        return GeminiModels(None, None, "API Key de Google Gemini no configurada.")
+    try:
+        genai.configure(api_key=api_key)
+        model_rewrite = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=genai.GenerationConfig(**REWRITE_GENERATION_CONFIG)
+        )
+        model_suggestion = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=genai.GenerationConfig(**SUGGESTION_GENERATION_CONFIG)
+        )
+        if client is not None:
+            model_rewrite = ResilientModel(model_rewrite, client)
+            model_suggestion = ResilientModel(model_suggestion, client)
+        return GeminiModels(model_rewrite, model_suggestion, None)
+    except Exception as e:
+        return GeminiModels(None, None, f"Error inicializando modelo Gemini: {e}")
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Generación con Gemini en modo streaming (stream=True).
+
+StreamedGeneration itera sobre el texto acumulado a medida que llegan los
+fragmentos de la respuesta, aplicando de forma incremental la limpieza del
+prefijo (p. ej. "Frase reescrita:") y midiendo el tiempo hasta el primer token
+y la latencia total. Funciona con cualquier objeto con generate_content(prompt,
+stream=True) que devuelva un iterable de fragmentos con atributo .text, por lo
+que se puede probar con un modelo local falso.
+
+generate_text registra además latencias, errores y tokens (usage_metadata) en
+metrics.py, etiquetados con la operación y el estilo.
+"""
+
+import time
+
+from metrics import GEMINI_ERRORS, record_gemini_call
+
+REWRITE_PREFIX = "frase reescrita:"
+
+
+def strip_prefix(text, prefix):
+    """Quita `prefix` (sin distinguir mayúsculas) del inicio de `text`."""
+    text = text.strip()
+    if prefix and text.lower().startswith(prefix):
+        text = text[len(prefix):].strip()
+    return text
+
+
+class StreamedGeneration:
+    def __init__(self, model, prompt, prefix=None):
+        self.model = model
+        self.prompt = prompt
+        self.prefix = prefix
+        self.text = ""
+        self.first_token_seconds = None
+        self.total_seconds = None
+        self.usage_metadata = None
+
+    def _visible_text(self, raw_text):
+        # Devuelve None mientras el texto recibido aún podría ser el comienzo del prefijo
+        candidate = raw_text.lstrip()
+        if self.prefix and len(candidate) < len(self.prefix) and self.prefix.startswith(candidate.lower()):
+            return None
+        return strip_prefix(raw_text, self.prefix)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        raw_text = ""
+        try:
+            for chunk in self.model.generate_content(self.prompt, stream=True):
+                # El recuento de tokens llega en los fragmentos (completo en el último)
+                self.usage_metadata = getattr(chunk, "usage_metadata", None) or self.usage_metadata
+                piece = chunk.text
+                if not piece:
+                    continue
+                if self.first_token_seconds is None:
+                    self.first_token_seconds = time.perf_counter() - start
+                raw_text += piece
+                visible_text = self._visible_text(raw_text)
+                if visible_text:
+                    self.text = visible_text
+                    yield visible_text
+        finally:
+            self.total_seconds = time.perf_counter() - start
+        self.text = strip_prefix(raw_text, self.prefix)
+
+
+def generate_text(model, prompt, prefix=None, on_partial=None, operation="generate", style=""):
+    """Genera el texto completo quitando `prefix`; si se pasa `on_partial`, usa
+    streaming y lo llama con el texto acumulado en cada fragmento.
+
+    Devuelve (texto, first_token_seconds, total_seconds). Sin streaming, el
+    primer token coincide con la latencia total.
+    """
+    if on_partial is None:
+        start = time.perf_counter()
+        try:
+            response = model.generate_content(prompt)
+            text = strip_prefix(response.text, prefix)
+        except Exception:
+            GEMINI_ERRORS.inc(operation=operation)
+            raise
+        total_seconds = time.perf_counter() - start
+        record_gemini_call(operation, total_seconds, usage_metadata=getattr(response, "usage_metadata", None), style=style)
+        return text, total_seconds, total_seconds
+
+    generation = StreamedGeneration(model, prompt, prefix=prefix)
+    try:
+        for partial_text in generation:
+            on_partial(partial_text)
+    except Exception:
+        GEMINI_ERRORS.inc(operation=operation)
+        raise
+    record_gemini_call(operation, generation.total_seconds, generation.first_token_seconds,
+                       generation.usage_metadata, style=style)
+    return generation.text, generation.first_token_seconds, generation.total_seconds
+
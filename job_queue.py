@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de trabajos en segundo plano, compartida por todo el proceso.
+
+Las operaciones lentas (STT, reescritura y sugerencias con Gemini) no se
+ejecutan dentro del re-run de Streamlit: la interfaz envía un trabajo, recibe
+su id y consulta su estado en re-runs posteriores (ver el fragmento de
+sondeo en app.py), de modo que la latencia remota no bloquea la sesión.
+
+- Peticiones idénticas en vuelo (misma clave) se agrupan en un único trabajo.
+- Cada trabajo tiene un plazo: al vencer se marca como TIMEOUT y se le pide
+  que se cancele; también se puede cancelar a mano. Un trabajo aún en cola se
+  cancela sin llegar a ejecutarse; uno en ejecución se detiene en su siguiente
+  report_partial (cancelación cooperativa), y si no llega a hacerlo su
+  resultado tardío se descarta.
+- stats() expone la profundidad de la cola y los tiempos de espera.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import JOB_WAIT_SECONDS
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED, TIMEOUT)
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_TIMEOUT_SECONDS = 120
+DEFAULT_RETENTION_SECONDS = 300
+WATCHDOG_INTERVAL_SECONDS = 0.2
+WAIT_SAMPLES = 500
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro del trabajo (desde report_partial) cuando se ha cancelado o ha vencido su plazo."""
+
+
+class Job:
+    def __init__(self, job_id, key, kind, timeout_seconds):
+        self.id = job_id
+        self.key = key
+        self.kind = kind
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.partial = None
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.first_partial_at = None
+        self.finished_at = None
+        self.timeout_seconds = timeout_seconds
+        self.deadline = self.submitted_at + timeout_seconds if timeout_seconds else None
+        self.subscribers = 1  # Peticiones agrupadas en este trabajo
+        self._cancel_event = threading.Event()
+        self._future = None
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def report_partial(self, partial):
+        """Publica un resultado parcial (texto en streaming, transcripción parcial...).
+
+        Es también el punto de cancelación cooperativa: lanza JobCancelled si
+        el trabajo se ha cancelado o ha vencido su plazo.
+        """
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+        if self.first_partial_at is None:
+            self.first_partial_at = time.perf_counter()
+        self.partial = partial
+
+    def wait_seconds(self):
+        """Tiempo en cola hasta empezar (o hasta ahora, si aún no ha empezado)."""
+        return (self.started_at or time.perf_counter()) - self.submitted_at
+
+    def elapsed_seconds(self):
+        return (self.finished_at or time.perf_counter()) - self.submitted_at
+
+
+class JobQueue:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, default_timeout_seconds=DEFAULT_TIMEOUT_SECONDS,
+                 retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self.default_timeout_seconds = default_timeout_seconds
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}  # id -> Job (incluye los terminados durante retention_seconds)
+        self._in_flight = {}  # clave -> Job pendiente o en ejecución
+        self._wait_samples = deque(maxlen=WAIT_SAMPLES)
+        self._run_samples = deque(maxlen=WAIT_SAMPLES)
+        self._counters = dict.fromkeys(("submitted", "coalesced") + FINISHED_STATUSES, 0)
+        self._stop = threading.Event()
+        threading.Thread(target=self._watchdog_loop, name="job-watchdog", daemon=True).start()
+
+    def submit(self, key, fn, kind=None, timeout_seconds=None):
+        """Encola fn(job) y devuelve el id del trabajo.
+
+        Si ya hay un trabajo en vuelo con la misma `key`, no se encola nada y
+        se devuelve el id de ese trabajo. fn recibe el Job para poder publicar
+        resultados parciales con job.report_partial.
+        """
+        timeout_seconds = self.default_timeout_seconds if timeout_seconds is None else timeout_seconds
+        with self._lock:
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.subscribers += 1
+                self._counters["coalesced"] += 1
+                return job.id
+            job = Job(next(self._ids), key, kind, timeout_seconds)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            self._counters["submitted"] += 1
+            job._future = self._executor.submit(self._run, job, fn)
+        return job.id
+
+    def get(self, job_id):
+        """Devuelve el Job (o None si no existe o ya se ha purgado)."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return True  # Otras sesiones siguen esperando el mismo resultado
+            self._finish(job, CANCELLED, error=JobCancelled())
+        return True
+
+    def stats(self):
+        with self._lock:
+            in_flight = list(self._in_flight.values())
+            waits = sorted(self._wait_samples)
+            runs = sorted(self._run_samples)
+            counters = dict(self._counters)
+        queued = [job for job in in_flight if job.status == PENDING]
+        return dict(
+            counters,
+            queued=len(queued),
+            running=len(in_flight) - len(queued),
+            oldest_wait_seconds=max((job.wait_seconds() for job in queued), default=0.0),
+            wait_p50_seconds=_percentile(waits, 0.50),
+            wait_p95_seconds=_percentile(waits, 0.95),
+            run_p50_seconds=_percentile(runs, 0.50),
+            run_p95_seconds=_percentile(runs, 0.95),
+        )
+
+    def shutdown(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # --- Internos ---
+    def _run(self, job, fn):
+        with self._lock:
+            if job.done:
+                return  # Cancelado o vencido mientras esperaba en la cola
+            job.status = RUNNING
+            job.started_at = time.perf_counter()
+            self._wait_samples.append(job.started_at - job.submitted_at)
+        JOB_WAIT_SECONDS.observe(job.started_at - job.submitted_at, kind=job.kind or "")
+        try:
+            result = fn(job)
+        except Exception as e:
+            with self._lock:
+                if not job.done:
+                    self._finish(job, CANCELLED if isinstance(e, JobCancelled) else FAILED, error=e)
+            return
+        with self._lock:
+            if not job.done:  # Si venció el plazo, el resultado tardío se descarta
+                self._finish(job, DONE, result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        # Se llama con self._lock adquirido
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.perf_counter()
+        job._cancel_event.set()
+        if job._future is not None:
+            job._future.cancel()  # Sin efecto si ya se está ejecutando
+        if self._in_flight.get(job.key) is job:
+            del self._in_flight[job.key]
+        if job.started_at is not None:
+            self._run_samples.append(job.finished_at - job.started_at)
+        self._counters[status] += 1
+
+    def _watchdog_loop(self):
+        while not self._stop.wait(WATCHDOG_INTERVAL_SECONDS):
+            now = time.perf_counter()
+            with self._lock:
+                for job in list(self._in_flight.values()):
+                    if job.deadline is not None and now >= job.deadline:
+                        self._finish(job, TIMEOUT, error=TimeoutError(
+                            f"El trabajo superó el plazo de {job.timeout_seconds:g} s."))
+                expired = [job_id for job_id, job in self._jobs.items()
+                           if job.done and now - job.finished_at > self.retention_seconds]
+                for job_id in expired:
+                    del self._jobs[job_id]
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas de latencia y coste en formato de texto de Prometheus.
+
+Contadores e histogramas con etiquetas, sin dependencias externas, que los
+módulos actualizan al convertir audio, llamar a los motores de STT y a Gemini
+(incluidos los tokens de usage_metadata) y consultar SQLite. Los "colectores"
+se evalúan solo al exportar, para publicar estado que ya existe (cachés, cola
+de trabajos, circuit breakers) sin coste en el camino caliente.
+
+Desactivadas por defecto (METRICS_ENABLED): entonces observe/inc vuelven de
+inmediato y time() devuelve un context manager vacío compartido, así que el
+coste es una comprobación de un booleano. start_http_server sirve /metrics
+en un puerto local para que lo recoja Prometheus.
+"""
+
+import bisect
+import contextvars
+import functools
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_enabled = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes", "si", "sí")
+
+# Agente al que se atribuyen los tokens de Gemini (lo fija la app en cada trabajo)
+DEFAULT_AGENT = "anonimo"
+OTHER_AGENTS = "otros"
+MAX_AGENT_LABELS = int(os.environ.get("METRICS_MAX_AGENTS", "200"))
+current_agent = contextvars.ContextVar("metrics_agent", default=DEFAULT_AGENT)
+
+_AGENT_RE = re.compile(r"[a-z0-9][a-z0-9._-]{0,31}")
+_known_agents = set()
+_known_agents_lock = threading.Lock()
+
+
+def agent_label(value):
+    """Normaliza el agente de la URL (?agente=), que nadie autentica, para usarlo como etiqueta.
+
+    Solo admite identificadores cortos (minúsculas, dígitos, ".", "_", "-");
+    el resto cuenta como DEFAULT_AGENT. Pasados MAX_AGENT_LABELS agentes
+    distintos, los nuevos se agrupan en OTHER_AGENTS para acotar las series.
+    """
+    value = str(value or "").strip().lower()
+    if not _AGENT_RE.fullmatch(value):
+        return DEFAULT_AGENT
+    with _known_agents_lock:
+        if value not in _known_agents:
+            if len(_known_agents) >= MAX_AGENT_LABELS:
+                return OTHER_AGENTS
+            _known_agents.add(value)
+    return value
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _format_labels(label_names, key, extra=()):
+    pairs = list(zip(label_names, key)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def values(self):
+        """{tupla de etiquetas: valor}"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.label_names, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # etiquetas -> [cuentas por cubo..., cuenta, suma]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """Context manager que observa la duración del bloque."""
+        if not _enabled:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(self.label_names, labels))
+            return series[-2] if series else 0
+
+    def sum(self, **labels):
+        with self._lock:
+            series = self._series.get(_label_key(self.label_names, labels))
+            return series[-1] if series else 0.0
+
+    def label_sets(self):
+        with self._lock:
+            return [dict(zip(self.label_names, key)) for key in self._series]
+
+    def quantile(self, fraction, **labels):
+        """Cuantil aproximado por interpolación lineal dentro del cubo (como histogram_quantile)."""
+        with self._lock:
+            series = self._series.get(_label_key(self.label_names, labels))
+            series = list(series) if series else None
+        if not series or not series[-2]:
+            return None
+        rank = fraction * series[-2]
+        cumulative = 0
+        for index, upper in enumerate(self.buckets):
+            previous = cumulative
+            cumulative += series[index]
+            if cumulative >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (upper - lower) * ((rank - previous) / series[index] if series[index] else 0)
+        return self.buckets[-1]  # Por encima del último cubo
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", _format_labels(self.label_names, key, [("le", _format_value(upper))]), cumulative))
+            samples.append((f"{self.name}_bucket", _format_labels(self.label_names, key, [("le", "+Inf")]), series[-2]))
+            samples.append((f"{self.name}_count", _format_labels(self.label_names, key), series[-2]))
+            samples.append((f"{self.name}_sum", _format_labels(self.label_names, key), series[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def register_collector(self, name, collect):
+        """collect() devuelve [(nombre, tipo, ayuda, [(dict de etiquetas, valor), ...]), ...].
+
+        Se llama solo al exportar. Registrar de nuevo el mismo nombre lo
+        sustituye (la app se re-ejecuta en cada interacción).
+        """
+        with self._lock:
+            self._collectors[name] = collect
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        for collect in collectors:
+            try:
+                families = collect()
+            except Exception:
+                continue  # Un colector roto no debe tumbar la exportación
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(str(labels[n]) for n in names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- Métricas de la aplicación ---
+AUDIO_NORMALIZE_SECONDS = REGISTRY.histogram(
+    "audio_normalize_seconds", "Tiempo de conversión del audio a mono/16 kHz/16 bits.")
+STT_REQUEST_SECONDS = REGISTRY.histogram(
+    "stt_request_seconds", "Duración de cada llamada al motor de STT (por fragmento).", ("engine",))
+STT_AUDIO_SECONDS = REGISTRY.counter(
+    "stt_audio_seconds_total", "Segundos de audio enviados al motor de STT.", ("engine",))
+STT_ERRORS = REGISTRY.counter(
+    "stt_errors_total", "Llamadas al motor de STT que terminaron en error.", ("engine",))
+GEMINI_REQUEST_SECONDS = REGISTRY.histogram(
+    "gemini_request_seconds", "Latencia total de las llamadas a Gemini.", ("operation", "style"))
+GEMINI_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "gemini_first_token_seconds", "Tiempo hasta el primer fragmento en streaming.", ("operation", "style"))
+GEMINI_ERRORS = REGISTRY.counter(
+    "gemini_errors_total", "Llamadas a Gemini que terminaron en error.", ("operation",))
+GEMINI_TOKENS = REGISTRY.counter(
+    "gemini_tokens_total", "Tokens consumidos según usage_metadata.", ("operation", "type", "agent"))
+SQLITE_QUERY_SECONDS = REGISTRY.histogram(
+    "sqlite_query_seconds", "Duración de las operaciones sobre SQLite.", ("operation",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0))
+JOB_WAIT_SECONDS = REGISTRY.histogram(
+    "job_queue_wait_seconds", "Tiempo en cola de los trabajos en segundo plano.", ("kind",))
+RERUN_SECONDS = REGISTRY.histogram(
+    "streamlit_rerun_seconds", "Tiempo de ejecución de cada re-run del script de Streamlit.")
+
+
+def timed(histogram, **labels):
+    """Decorador: observa en `histogram` la duración de cada llamada."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def record_gemini_call(operation, total_seconds, first_token_seconds=None, usage_metadata=None, style=""):
+    """Latencias y tokens (de response.usage_metadata) de una llamada a Gemini."""
+    if not _enabled:
+        return
+    GEMINI_REQUEST_SECONDS.observe(total_seconds, operation=operation, style=style)
+    if first_token_seconds is not None:
+        GEMINI_FIRST_TOKEN_SECONDS.observe(first_token_seconds, operation=operation, style=style)
+    if usage_metadata is not None:
+        agent = current_agent.get()
+        for token_type, attribute in (("prompt", "prompt_token_count"), ("output", "candidates_token_count")):
+            tokens = getattr(usage_metadata, attribute, None)
+            if tokens:
+                GEMINI_TOKENS.inc(tokens, operation=operation, type=token_type, agent=agent)
+
+
+def run_as_agent(agent, fn, *args, **kwargs):
+    """Ejecuta fn atribuyendo a `agent` los tokens que consuma (en el hilo actual)."""
+    token = current_agent.set(agent)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        current_agent.reset(token)
+
+
+def render_prometheus():
+    return REGISTRY.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sin una línea de log por cada recogida de Prometheus
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """Sirve /metrics en un hilo en segundo plano y devuelve el servidor."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Motores de reconocimiento de voz intercambiables.
+
+Todos los motores implementan la misma interfaz: se llaman con
+(raw_audio_data, sample_rate, sample_width_bytes) sobre PCM mono y devuelven el
+texto reconocido ("" si no se entendió nada), por lo que se pueden pasar
+directamente al pipeline de transcription_pipeline.
+
+- "google": el reconocedor web de Google de SpeechRecognition (comportamiento original).
+- "vosk": modelo local en CPU; el modelo se carga una sola vez por proceso.
+- "stub": motor determinista sin red, para pruebas y pruebas de carga (puede
+  inyectar latencia y fallos).
+
+El motor "google" puede recibir un ResilientClient (ver resilience.py) que
+aplica limitación de tasa, reintentos, plazos y circuit breaker a cada llamada.
+
+Cada llamada registra su duración y la duración del audio, para comparar el
+factor de tiempo real (RTF) entre motores.
+"""
+
+import json
+import random
+import threading
+import time
+
+import speech_recognition as sr
+
+from metrics import STT_AUDIO_SECONDS, STT_ERRORS, STT_REQUEST_SECONDS
+
+DEFAULT_ENGINE = "google"
+DEFAULT_LANGUAGE = "es-ES"
+
+
+class EngineTimings:
+    def __init__(self):
+        self.calls = 0
+        self.processing_seconds = 0.0
+        self.audio_seconds = 0.0
+
+    @property
+    def real_time_factor(self):
+        # RTF < 1 significa que el motor transcribe más rápido que el tiempo real
+        if not self.audio_seconds:
+            return 0.0
+        return self.processing_seconds / self.audio_seconds
+
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def record_timing(engine_name, processing_seconds, audio_seconds):
+    with _timings_lock:
+        timings = _timings.setdefault(engine_name, EngineTimings())
+        timings.calls += 1
+        timings.processing_seconds += processing_seconds
+        timings.audio_seconds += audio_seconds
+
+
+def get_engine_timings():
+    """Devuelve una copia de los tiempos acumulados por motor."""
+    with _timings_lock:
+        return {
+            name: {
+                "calls": t.calls,
+                "processing_seconds": t.processing_seconds,
+                "audio_seconds": t.audio_seconds,
+                "real_time_factor": t.real_time_factor,
+            }
+            for name, t in _timings.items()
+        }
+
+
+class SpeechRecognizer:
+    """Interfaz común de los motores de reconocimiento de voz."""
+
+    name = "base"
+
+    def transcribe(self, raw_audio_data, sample_rate, sample_width_bytes):
+        raise NotImplementedError
+
+    def __call__(self, raw_audio_data, sample_rate, sample_width_bytes):
+        start = time.perf_counter()
+        try:
+            return self.transcribe(raw_audio_data, sample_rate, sample_width_bytes)
+        except Exception:
+            STT_ERRORS.inc(engine=self.name)
+            raise
+        finally:
+            processing_seconds = time.perf_counter() - start
+            audio_seconds = len(raw_audio_data) / float(sample_rate * sample_width_bytes)
+            record_timing(self.name, processing_seconds, audio_seconds)
+            STT_REQUEST_SECONDS.observe(processing_seconds, engine=self.name)
+            STT_AUDIO_SECONDS.inc(audio_seconds, engine=self.name)
+
+
+class GoogleRecognizer(SpeechRecognizer):
+    name = "google"
+
+    def __init__(self, language=DEFAULT_LANGUAGE, client=None):
+        self.language = language
+        self.client = client
+
+    def transcribe(self, raw_audio_data, sample_rate, sample_width_bytes):
+        # Crear un objeto AudioData para SpeechRecognition
+        audio_data_for_sr = sr.AudioData(raw_audio_data, sample_rate, sample_width_bytes)
+
+        def recognize(timeout_seconds=None):
+            recognizer = sr.Recognizer()
+            recognizer.operation_timeout = timeout_seconds
+            return recognizer.recognize_google(audio_data_for_sr, language=self.language)
+
+        try:
+            if self.client is None:
+                return recognize()
+            return self.client.call(recognize)
+        except sr.UnknownValueError:
+            return ""  # Un fragmento ininteligible no debe invalidar el resto de la grabación
+
+
+_vosk_models = {}
+_vosk_models_lock = threading.Lock()
+
+
+def load_vosk_model(model_path):
+    """Carga (una sola vez por proceso) el modelo Vosk de la ruta indicada."""
+    with _vosk_models_lock:
+        if model_path not in _vosk_models:
+            try:
+                import vosk
+            except ImportError as e:
+                raise RuntimeError("El motor 'vosk' requiere el paquete 'vosk' (pip install vosk).") from e
+            vosk.SetLogLevel(-1)
+            _vosk_models[model_path] = vosk.Model(model_path)
+        return _vosk_models[model_path]
+
+
+class VoskRecognizer(SpeechRecognizer):
+    name = "vosk"
+
+    def __init__(self, model_path):
+        if not model_path:
+            raise ValueError("El motor 'vosk' necesita la ruta del modelo (VOSK_MODEL_PATH).")
+        self.model = load_vosk_model(model_path)
+
+    def transcribe(self, raw_audio_data, sample_rate, sample_width_bytes):
+        import vosk
+
+        if sample_width_bytes != 2:
+            raise ValueError("Vosk requiere audio PCM de 16 bits.")
+        # El modelo es compartido; el KaldiRecognizer no es seguro entre hilos, así que se crea por llamada
+        recognizer = vosk.KaldiRecognizer(self.model, sample_rate)
+        recognizer.AcceptWaveform(bytes(raw_audio_data))
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class StubRecognizer(SpeechRecognizer):
+    """Motor determinista: el mismo audio produce siempre el mismo texto.
+
+    Con failure_rate > 0 falla (sr.RequestError) de forma reproducible según `seed`.
+    """
+
+    name = "stub"
+
+    def __init__(self, text=None, latency_seconds=0.0, failure_rate=0.0, seed=0):
+        self.text = text
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def transcribe(self, raw_audio_data, sample_rate, sample_width_bytes):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if self.failure_rate:
+            with self._lock:
+                fails = self._random.random() < self.failure_rate
+            if fails:
+                # Simula un fallo de red, el que el cliente resiliente reintenta
+                raise sr.RequestError("Fallo inyectado por el motor 'stub'.") from ConnectionError("stub")
+        if self.text is not None:
+            return self.text
+        seconds = len(raw_audio_data) / float(sample_rate * sample_width_bytes)
+        return f"fragmento de {seconds:.1f} segundos"
+
+
+ENGINES = {
+    GoogleRecognizer.name: GoogleRecognizer,
+    VoskRecognizer.name: VoskRecognizer,
+    StubRecognizer.name: StubRecognizer,
+}
+
+
+def create_recognizer(engine=DEFAULT_ENGINE, language=DEFAULT_LANGUAGE, model_path=None, client=None, **options):
+    """Crea el motor indicado por configuración; `client` solo lo usan los motores remotos."""
+    if engine == GoogleRecognizer.name:
+        return GoogleRecognizer(language=language, client=client)
+    if engine == VoskRecognizer.name:
+        return VoskRecognizer(model_path=model_path)
+    if engine == StubRecognizer.name:
+        return StubRecognizer(**options)
+    raise ValueError(f"Motor de reconocimiento desconocido: '{engine}'. Opciones: {', '.join(ENGINES)}")
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente resiliente para los servicios remotos (Gemini y Google STT).
+
+Todas las llamadas de un mismo servicio pasan por un ResilientClient
+compartido por el proceso (ver get_client):
+
+- Limitador de tasa por token bucket: cuando el proveedor limita, los agentes
+  no lo saturan todos a la vez.
+- Reintentos con backoff exponencial y jitter completo, solo para errores
+  reintentables (cuota agotada, 5xx, red, timeouts); un sr.RequestError solo
+  si viene de un fallo de conexión o de una respuesta 429/5xx.
+- Plazo por llamada: cada intento recibe el tiempo que le queda para que lo
+  use como timeout, y no se reintenta si ya no hay tiempo.
+- Circuit breaker: tras varios fallos seguidos se deja de llamar durante un
+  tiempo (CircuitOpenError inmediato) y luego se prueba con una sola llamada.
+
+stats() y get_clients_stats() exponen el estado para operaciones.
+"""
+
+import random
+import re
+import threading
+import time
+from urllib.error import HTTPError, URLError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_RATE_PER_SECOND = 5.0
+DEFAULT_BURST = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BASE_DELAY_SECONDS = 0.5
+DEFAULT_MAX_DELAY_SECONDS = 8.0
+DEFAULT_DEADLINE_SECONDS = 30.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT_SECONDS = 30.0
+
+# Por nombre de clase (en toda la jerarquía) para no depender de google.api_core ni de speech_recognition
+RETRYABLE_ERROR_NAMES = frozenset((
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "GatewayTimeout", "DeadlineExceeded", "BadGateway",
+))
+RETRYABLE_HTTP_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# speech_recognition envuelve el HTTPError/URLError en un RequestError con el motivo en el mensaje
+_TRANSIENT_REQUEST_ERROR_RE = re.compile(
+    r"connection failed|timed out|too many requests|internal server error|bad gateway|service unavailable|"
+    r"gateway timeout|\b(?:429|50[0234])\b", re.IGNORECASE)
+
+
+class CircuitOpenError(RuntimeError):
+    """El servicio está marcado como caído: se falla de inmediato sin llamarlo."""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Se agotó el plazo de la llamada (incluidas las esperas y los reintentos)."""
+
+
+def _is_transient_request_error(error):
+    """sr.RequestError: solo es reintentable si la causa es la red o un 429/5xx (no una clave inválida o un 400)."""
+    cause = error.__cause__ or error.__context__
+    if isinstance(cause, HTTPError):
+        return cause.code in RETRYABLE_HTTP_STATUSES
+    if isinstance(cause, (URLError, ConnectionError, TimeoutError)):
+        return True
+    return bool(_TRANSIENT_REQUEST_ERROR_RE.search(str(error)))
+
+
+def is_retryable(error):
+    if isinstance(error, (CircuitOpenError, DeadlineExceededError)):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if "RequestError" in names:
+        return _is_transient_request_error(error)
+    return not names.isdisjoint(RETRYABLE_ERROR_NAMES)
+
+
+def is_unavailable_error(error):
+    """Errores que indican que el servicio no está disponible (y no que la petición sea incorrecta)."""
+    return isinstance(error, (CircuitOpenError, DeadlineExceededError)) or is_retryable(error)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+        self._updated_at = now
+
+    def try_acquire(self):
+        """Toma un token si hay; si no, devuelve los segundos que faltan para el siguiente."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate_per_second
+
+    def acquire(self, timeout=None):
+        """Espera a tener un token; devuelve False si no lo consigue antes de `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_seconds = self.try_acquire()
+            if not wait_seconds:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < wait_seconds:
+                    return False
+            time.sleep(wait_seconds)
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout_seconds=DEFAULT_RESET_TIMEOUT_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """¿Se puede llamar al servicio? En HALF_OPEN solo se deja pasar una llamada de prueba."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_seconds:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+                return True
+            return self.state == CLOSED
+
+    def is_open(self):
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout_seconds
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Libera la llamada de prueba que no llegó a hacerse, sin cambiar el estado ni los fallos."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def seconds_until_retry(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout_seconds - (time.monotonic() - self.opened_at))
+
+
+class ResilientClient:
+    def __init__(self, name, rate_per_second=DEFAULT_RATE_PER_SECOND, burst=DEFAULT_BURST,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay_seconds=DEFAULT_BASE_DELAY_SECONDS,
+                 max_delay_seconds=DEFAULT_MAX_DELAY_SECONDS, deadline_seconds=DEFAULT_DEADLINE_SECONDS,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout_seconds=DEFAULT_RESET_TIMEOUT_SECONDS,
+                 retryable=is_retryable, seed=None):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_second, burst) if rate_per_second else None
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout_seconds)
+        self.max_retries = max_retries
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.deadline_seconds = deadline_seconds
+        self.is_retryable = retryable
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ("calls", "successes", "failures", "retries", "rejected", "deadline_exceeded", "throttled_seconds"), 0)
+        self.last_error = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def backoff_seconds(self, attempt):
+        # Jitter completo: uniforme entre 0 y el tope exponencial del intento
+        return self._random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1)))
+
+    def call(self, fn, deadline_seconds=None):
+        """Llama a fn(timeout_seconds) con limitación de tasa, reintentos y circuit breaker.
+
+        `timeout_seconds` es el tiempo que queda hasta el plazo de la llamada,
+        para que fn lo pase como timeout al cliente HTTP. Lanza CircuitOpenError
+        si el servicio está marcado como caído, DeadlineExceededError si se
+        agota el plazo, o el último error de fn si se agotan los reintentos.
+        """
+        self._count("calls")
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        attempt = 0
+        while True:
+            if self.breaker.is_open():
+                self._count("rejected")
+                raise CircuitOpenError(
+                    f"Servicio '{self.name}' no disponible temporalmente "
+                    f"(reintento en {self.breaker.seconds_until_retry():.0f} s; último error: {self.last_error}).")
+            if self.bucket is not None:
+                throttle_start = time.monotonic()
+                acquired = self.bucket.acquire(timeout=deadline - throttle_start)
+                self._count("throttled_seconds", time.monotonic() - throttle_start)
+                if not acquired:
+                    self._count("deadline_exceeded")
+                    raise DeadlineExceededError(f"Plazo agotado esperando turno para llamar a '{self.name}'.")
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError(f"Servicio '{self.name}' no disponible temporalmente (comprobando si se ha recuperado).")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.breaker.release_probe()  # No se llegó a llamar: ni éxito ni fallo del servicio
+                self._count("deadline_exceeded")
+                raise DeadlineExceededError(f"Plazo agotado para la llamada a '{self.name}'.")
+            try:
+                result = fn(remaining)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    # El servicio respondió (petición inválida, audio ininteligible, cancelación...)
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                self.last_error = f"{type(e).__name__}: {e}"
+                attempt += 1
+                delay = self.backoff_seconds(attempt)
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self._count("successes")
+            return result
+
+    def record_failure(self, error):
+        """Registra un fallo ocurrido fuera de call() (p. ej. a mitad de una respuesta en streaming)."""
+        if self.is_retryable(error):
+            self.breaker.record_failure()
+            self._count("failures")
+            self.last_error = f"{type(error).__name__}: {error}"
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return dict(
+            counters,
+            name=self.name,
+            state=self.breaker.state,
+            consecutive_failures=self.breaker.consecutive_failures,
+            times_opened=self.breaker.times_opened,
+            seconds_until_retry=self.breaker.seconds_until_retry(),
+            tokens_available=self.bucket.available if self.bucket is not None else None,
+            last_error=self.last_error,
+        )
+
+
+# --- Registro por proceso ---
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name, **options):
+    """Devuelve el cliente compartido del servicio `name`; las opciones solo se usan al crearlo."""
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = ResilientClient(name, **options)
+        return _clients[name]
+
+
+def get_clients_stats():
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {client.name: client.stats() for client in clients}
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de resultados de reescritura con Gemini.
+
+La clave combina el texto normalizado, el estilo, el modelo y la temperatura,
+así que cambiar de estilo y volver, o pulsar "Reescribir" varias veces sobre la
+misma transcripción, no vuelve a llamar al modelo. Las entradas caducan tras
+un TTL y se guardan también en SQLite para sobrevivir a reinicios.
+"""
+
+import hashlib
+import re
+import unicodedata
+
+from tiered_cache import TieredCache
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Normaliza espacios y la forma Unicode (NFC) sin alterar mayúsculas ni acentos."""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def rewrite_cache_key(text, style_key, model_name, temperature):
+    digest = hashlib.sha256()
+    digest.update(f"{style_key}\x00{model_name}\x00{temperature}\x00".encode("utf-8"))
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RewriteCache(TieredCache):
+    def __init__(self, max_entries=256, db_path=None, db_max_entries=5000, ttl_seconds=7 * 24 * 3600):
+        super().__init__("rewrite_cache", max_entries=max_entries, db_path=db_path,
+                         db_max_entries=db_max_entries, ttl_seconds=ttl_seconds)
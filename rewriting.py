@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Reescritura de textos con Gemini, sin dependencias de Streamlit.
+
+Contiene los estilos de reescritura, sus prompts y la llamada al modelo (con
+caché opcional y streaming opcional), para que la usen tanto la app como el
+procesamiento por lotes (batch_transcribe.py).
+"""
+
+from gemini_models import MODEL_NAME, REWRITE_GENERATION_CONFIG
+from gemini_streaming import REWRITE_PREFIX, generate_text
+from resilience import is_unavailable_error
+from rewrite_cache import rewrite_cache_key
+
+# Diccionario de estilos disponibles (etiqueta visible -> clave del estilo)
+REWRITE_STYLES = {
+    "Conciso y Claro": "concise_clear",
+    "Vendedor Persuasivo": "sales_persuasive",
+    "Creativo y Resolutivo (Satisfacción)": "creative_resolution",
+    "Combinación Ideal (Versátil)": "ideal_versatile"
+}
+
+
+def get_prompt_for_style(text_to_rewrite, style_key):
+    base_instructions = """
+    Eres un asistente experto en comunicación y redacción en español.
+    Tu tarea es tomar la 'Frase original' y transformarla en una 'Frase reescrita'.
+    Asegúrate de que la 'Frase reescrita' utilice impecablemente los signos de puntuación (comas, puntos, interrogaciones, exclamaciones, etc.),
+    las mayúsculas y minúsculas según las normas del español, y todos los acentos (tildes) necesarios.
+    Entrega únicamente la frase reescrita, sin introducciones, comentarios sobre tu proceso, ni despedidas.
+    """
+
+    style_specific_instructions = ""
+    if style_key == "concise_clear":
+        style_specific_instructions = """
+        El estilo debe ser **Conciso y Claro**:
+        - Ve directo al punto, eliminando cualquier redundancia o palabra innecesaria.
+        - El mensaje debe ser breve, fácil de entender y profesional.
+        """
+    elif style_key == "sales_persuasive":
+        style_specific_instructions = """
+        El estilo debe ser **Vendedor Persuasivo**:
+        - Utiliza un lenguaje que incite a la acción o genere fuerte interés en un producto/servicio.
+        - Destaca beneficios clave y el valor de lo que se ofrece.
+        - Puede ser un poco más entusiasta y directo en su persuasión.
+        """
+    elif style_key == "creative_resolution":
+        style_specific_instructions = """
+        El estilo debe ser **Creativo y Resolutivo, enfocado en la Satisfacción**:
+        - Adopta un tono empático, cálido y tranquilizador.
+        - Sé creativo en la forma de expresar la solución o el mensaje.
+        - El enfoque principal es la satisfacción del cliente y la resolución efectiva y positiva de su consulta o necesidad.
+        - El lenguaje debe ser fluido y natural, buscando una conexión genuina.
+        """
+    elif style_key == "ideal_versatile":
+        style_specific_instructions = """
+        El estilo debe ser una **Combinación Ideal y Versátil**:
+        - **Claridad Fundamental:** El mensaje siempre debe ser claro y fácil de entender. Usa la concisión cuando sea apropiado, pero no a expensas de la amabilidad o la completitud.
+        - **Toque Persuasivo (Contextual):** Si la frase original lo amerita o sugiere una oportunidad, incorpora sutilmente elementos persuasivos, enfocados en el valor o los beneficios, sin ser agresivo.
+        - **Enfoque en el Cliente y Creatividad:** Prioriza la empatía, la satisfacción y la resolución. Usa un lenguaje creativo y natural para conectar y transmitir confianza. Adapta la calidez y el detalle según el contexto implícito.
+        - El objetivo es una comunicación profesional, efectiva y adaptativa.
+        """
+
+    return f"{base_instructions}\n{style_specific_instructions}\nFrase original: \"{text_to_rewrite}\"\nFrase reescrita:"
+
+
+def generate_styled_rewrite(model, text_to_rewrite, style_key, rewrite_cache=None, regenerate=False, on_partial=None):
+    """Reescribe el texto en el estilo indicado. Los errores del modelo se propagan.
+
+    Con `rewrite_cache`, mismo texto, estilo, modelo y temperatura => mismo
+    resultado, salvo que se pida regenerar.
+    """
+    cache_key = None
+    if rewrite_cache is not None:
+        cache_key = rewrite_cache_key(text_to_rewrite, style_key, MODEL_NAME, REWRITE_GENERATION_CONFIG["temperature"])
+        if not regenerate:
+            cached_text = rewrite_cache.get(cache_key)
+            if cached_text is not None:
+                return cached_text
+
+    prompt = get_prompt_for_style(text_to_rewrite, style_key)
+    # Limpieza del prefijo "Frase reescrita:" que el modelo a veces incluye (también en streaming)
+    rewritten_text, _, total_seconds = generate_text(model, prompt, prefix=REWRITE_PREFIX, on_partial=on_partial,
+                                                     operation="rewrite", style=style_key)
+    if rewrite_cache is not None:
+        rewrite_cache.put(cache_key, rewritten_text, cost_seconds=total_seconds)
+    return rewritten_text
+
+
+def generate_styled_rewrite_or_fallback(model, text_to_rewrite, style_key, rewrite_cache=None, regenerate=False, on_partial=None):
+    """Como generate_styled_rewrite, pero si Gemini no está disponible (circuito
+    abierto, plazo o reintentos agotados) devuelve la reescritura guardada en
+    caché o, si no la hay, el texto sin reescribir.
+
+    Devuelve (texto, aviso); aviso es None salvo que se haya usado el respaldo.
+    Los errores que no son de disponibilidad se propagan.
+    """
+    try:
+        return generate_styled_rewrite(model, text_to_rewrite, style_key, rewrite_cache,
+                                       regenerate=regenerate, on_partial=on_partial), None
+    except Exception as e:
+        if not is_unavailable_error(e):
+            raise
+        error = e
+    if rewrite_cache is not None:
+        cached_text = rewrite_cache.get(
+            rewrite_cache_key(text_to_rewrite, style_key, MODEL_NAME, REWRITE_GENERATION_CONFIG["temperature"]))
+        if cached_text is not None:
+            return cached_text, f"Gemini no disponible ({error}). Se muestra la última reescritura guardada."
+    return text_to_rewrite, f"Gemini no disponible ({error}). Se muestra el texto sin reescribir."
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Ranking de scripts frecuentes por uso.
+
+Los usos (copiar un script o enviarlo al área principal) se acumulan en memoria
+y se escriben en SQLite por lotes, periódicamente, para que cada clic no pague
+una escritura en disco. El top-N se sirve desde una estructura en memoria
+compartida por todas las sesiones, que se invalida al insertar, eliminar o
+volcar los usos pendientes. Se cargan más candidatos que el top-N para que los
+usos pendientes puedan subir scripts de fuera; si aun así uno de fuera de los
+candidatos podría entrar, se vuelcan los usos antes de responder.
+"""
+
+import atexit
+import threading
+from collections import Counter
+
+DEFAULT_TOP_N = 15
+DEFAULT_CANDIDATE_MARGIN = 35  # Se cargan top_n + margen scripts (50 por defecto)
+DEFAULT_FLUSH_INTERVAL_SECONDS = 30
+DEFAULT_MAX_PENDING = 100
+
+
+class RankedScripts:
+    def __init__(self, repository, top_n=DEFAULT_TOP_N, flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 max_pending=DEFAULT_MAX_PENDING, background_flush=True, candidate_margin=DEFAULT_CANDIDATE_MARGIN):
+        self.repository = repository
+        self.top_n = top_n
+        self.candidate_margin = candidate_margin
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self._lock = threading.RLock()
+        self._pending = Counter()  # script_id -> usos aún no escritos en SQLite
+        self._top = None  # lista de dicts ordenada, o None si hay que recargarla
+        self._stop = threading.Event()
+        if background_flush:
+            threading.Thread(target=self._flush_loop, name="script-usage-flush", daemon=True).start()
+            atexit.register(self.close)
+
+    # --- Lecturas ---
+    def top(self):
+        """Devuelve los top_n scripts más usados (dicts con id, name, template, compiled_template y usage_count)."""
+        limit = self.top_n + self.candidate_margin
+        with self._lock:
+            if self._top is None:
+                self._top = [dict(row) for row in self.repository.list_frequent(limit=limit)]
+            candidates = self._top
+            # Los usos pendientes de volcar también cuentan para el orden
+            ranked = [dict(script, usage_count=(script['usage_count'] or 0) + self._pending[script['id']])
+                      for script in candidates]
+            candidate_ids = {script['id'] for script in candidates}
+            outside = [count for script_id, count in self._pending.items() if script_id not in candidate_ids]
+        ranked.sort(key=lambda script: (-script['usage_count'], script['name']))
+        top = ranked[:self.top_n]
+        if outside and len(candidates) == limit and len(top) == self.top_n:
+            # Un script sin cargar tiene como mucho los usos guardados del último candidato
+            ceiling = candidates[-1]['usage_count'] or 0
+            if ceiling + max(outside) >= top[-1]['usage_count']:
+                try:
+                    self.flush()
+                except Exception:
+                    return top  # Sin volcado se sirve el ranking aproximado
+                return self.top()
+        return top
+
+    def invalidate(self):
+        with self._lock:
+            self._top = None
+
+    # --- Escrituras ---
+    def record_use(self, script_id):
+        with self._lock:
+            self._pending[script_id] += 1
+            pending_total = sum(self._pending.values())
+        if pending_total >= self.max_pending:
+            self.flush()
+
+    def add(self, name, template, compiled_template=None):
+        script_id = self.repository.add(name, template, compiled_template)
+        self.invalidate()
+        return script_id
+
+    def delete(self, script_id):
+        with self._lock:
+            self._pending.pop(script_id, None)
+        self.repository.delete(script_id)
+        self.invalidate()
+
+    def flush(self):
+        """Escribe en SQLite los usos pendientes e invalida el ranking en memoria."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+        try:
+            self.repository.increment_usage(pending)
+        except Exception:
+            # Si falla la escritura se conservan los usos para el siguiente volcado
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        self.invalidate()
+        return sum(pending.values())
+
+    def pending_count(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval_seconds):
+            try:
+                self.flush()
+            except Exception:
+                pass  # Se reintenta en el siguiente ciclo
+
+    def close(self):
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception:
+            pass
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Motor de plantillas para personalizar scripts.
+
+Una plantilla como "Hola [Nombre Cliente], tu plan [Plan] vence el [Fecha|pronto]"
+se compila una sola vez (al guardarla) en una lista de segmentos de texto y
+variables, que se guarda junto a la fila en SQLite y se cachea en memoria.
+Renderizar es una única pasada sobre los segmentos, con cualquier número de
+variables con nombre y valores por defecto.
+
+- [Campo]: variable; si no se da valor se usa el valor por defecto del campo.
+- [Campo|texto]: variable con valor por defecto propio de la plantilla.
+"""
+
+import json
+import re
+import unicodedata
+from functools import lru_cache
+
+# Campos conocidos (los del CRM) y su valor por defecto cuando el agente no los rellena
+KNOWN_FIELDS = {
+    "Nombre Cliente": "cliente",
+    "Numero Linea": "su servicio",
+    "Info Adicional": "",
+    "Plan": "su plan",
+    "Fecha": "",
+    "Ticket": "",
+}
+
+PLACEHOLDER_RE = re.compile(r"\[([^\[\]|]+)(?:\|([^\[\]]*))?\]")
+
+TEXT = "text"
+VAR = "var"
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _field_key(label):
+    # "Número Línea", "numero linea" y "Numero Linea" son el mismo campo
+    stripped = "".join(c for c in unicodedata.normalize("NFD", label) if unicodedata.category(c) != "Mn")
+    return " ".join(stripped.split()).casefold()
+
+
+_KNOWN_BY_KEY = {_field_key(name): name for name in KNOWN_FIELDS}
+
+
+class CompiledTemplate:
+    def __init__(self, segments):
+        # Segmentos: (TEXT, texto) o (VAR, nombre_de_campo, valor_por_defecto)
+        self.segments = tuple(tuple(segment) for segment in segments)
+
+    @property
+    def fields(self):
+        """Nombres de los campos que usa la plantilla, en orden de aparición y sin repetir."""
+        return list(dict.fromkeys(segment[1] for segment in self.segments if segment[0] == VAR))
+
+    def render(self, values=None):
+        values = values or {}
+        parts = []
+        for segment in self.segments:
+            if segment[0] == TEXT:
+                parts.append(segment[1])
+            else:
+                parts.append(values.get(segment[1]) or segment[2])
+        return "".join(parts)
+
+    def render_many(self, values_list):
+        """Renderiza la plantilla para una lista de clientes (campañas salientes)."""
+        return [self.render(values) for values in values_list]
+
+    def to_json(self):
+        return json.dumps(self.segments, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(json.loads(data))
+
+
+def compile_template(template, strict=False):
+    """Compila la plantilla en segmentos.
+
+    Con strict=True se lanza TemplateError si hay campos desconocidos sin valor
+    por defecto propio; si no, se conservan tal cual en el texto (como hacía el
+    reemplazo original con str.replace).
+    """
+    segments = []
+    unknown = []
+    position = 0
+    for match in PLACEHOLDER_RE.finditer(template):
+        if match.start() > position:
+            segments.append((TEXT, template[position:match.start()]))
+        label, inline_default = match.group(1).strip(), match.group(2)
+        field = _KNOWN_BY_KEY.get(_field_key(label))
+        if field is not None:
+            default = inline_default if inline_default is not None else KNOWN_FIELDS[field]
+            segments.append((VAR, field, default))
+        elif inline_default is not None:
+            segments.append((VAR, label, inline_default))
+        else:
+            unknown.append(label)
+            segments.append((TEXT, match.group(0)))
+        position = match.end()
+    if position < len(template):
+        segments.append((TEXT, template[position:]))
+
+    if strict and unknown:
+        raise TemplateError(
+            f"Campos desconocidos: {', '.join(f'[{label}]' for label in dict.fromkeys(unknown))}. "
+            f"Usa {', '.join(f'[{name}]' for name in KNOWN_FIELDS)} o indica un valor por defecto, ej: [Campo|texto]."
+        )
+    # Se fusionan los textos contiguos para que el render recorra el mínimo de segmentos
+    merged = []
+    for segment in segments:
+        if merged and segment[0] == TEXT and merged[-1][0] == TEXT:
+            merged[-1] = (TEXT, merged[-1][1] + segment[1])
+        else:
+            merged.append(segment)
+    return CompiledTemplate(merged)
+
+
+@lru_cache(maxsize=1024)
+def get_compiled_template(template, compiled_json=None):
+    """Plantilla compilada cacheada en memoria; usa la versión guardada en la fila si existe."""
+    if compiled_json:
+        return CompiledTemplate.from_json(compiled_json)
+    return compile_template(template)
+
+
+def render_bulk(template, values_list, compiled_json=None):
+    """Rellena una plantilla para toda una lista de clientes en una sola llamada."""
+    return get_compiled_template(template, compiled_json).render_many(values_list)
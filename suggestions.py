@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Sugerencias post-resolución con Gemini, sin dependencia de Streamlit.
+
+Modo estructurado: una sola llamada pide al modelo, como JSON, el puente a la
+venta, la invitación a la encuesta y (opcionalmente) una frase de cierre, en
+lugar de una llamada por script con su propio prompt. Si la respuesta falla o
+no es un JSON válido, se recurre a las llamadas individuales de siempre,
+lanzadas a la vez.
+
+El resultado completo se guarda en caché por resolution_context (con la frase
+de cierre, o su ausencia, explícita) y cada script también por tipo, así que
+volver a pedir las sugerencias del mismo caso no vuelve a llamar al modelo,
+salvo que se pida regenerar. Un resultado sin frase de cierre (respaldo o
+scripts sueltos) no sirve para una petición que la incluye. Sin contexto los
+scripts son genéricos y comunes a todos los agentes: se guardan con una vida
+más corta (blank_context_ttl_seconds).
+"""
+
+import contextvars
+import hashlib
+import json
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from gemini_models import MODEL_NAME, STRUCTURED_SUGGESTION_GENERATION_CONFIG, SUGGESTION_GENERATION_CONFIG
+from gemini_streaming import generate_text
+from metrics import GEMINI_ERRORS, record_gemini_call
+from rewrite_cache import normalize_text
+from tiered_cache import TieredCache
+
+SALES_BRIDGE = "sales_bridge"
+SURVEY_INVITATION = "survey_invitation"
+CLOSING_LINE = "closing_line"
+POST_RESOLUTION = "post_resolution"
+
+# Origen del resultado de generate_post_resolution
+SOURCE_CACHE = "cache"
+SOURCE_STRUCTURED = "structured"
+SOURCE_FALLBACK = "fallback"
+
+PostResolutionSuggestions = namedtuple(
+    "PostResolutionSuggestions", [SALES_BRIDGE, SURVEY_INVITATION, CLOSING_LINE, "source", "errors"]
+)
+
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def sales_bridge_prompt(context=""):
+    return f"""
+        El caso de un cliente ha sido resuelto.
+        Contexto adicional (opcional): {context}
+        Sugiere un script corto y amigable para hacer un puente hacia una venta, ofreciendo un producto o servicio relevante de forma natural.
+        No añadas introducciones ni despedidas, solo entrega el script sugerido.
+        Script sugerido:
+        """
+
+
+def survey_invitation_prompt(context=""):
+    return f"""
+        El caso de un cliente ha sido resuelto.
+        Contexto adicional (opcional): {context}
+        Sugiere un script corto, agradable y efectivo para invitar al cliente a completar una encuesta de satisfacción.
+        No añadas introducciones ni despedidas, solo entrega el script sugerido.
+        Script sugerido:
+        """
+
+
+SINGLE_PROMPTS = {
+    SALES_BRIDGE: sales_bridge_prompt,
+    SURVEY_INVITATION: survey_invitation_prompt,
+}
+
+
+def structured_suggestions_prompt(context="", include_closing=True):
+    closing_field = ',\n          "closing_line": "frase breve y cordial para despedir la llamada"' if include_closing else ""
+    return f"""
+        El caso de un cliente ha sido resuelto.
+        Contexto adicional (opcional): {context}
+        Genera los scripts que el agente dirá a continuación, cortos, amigables y en español:
+        - "sales_bridge": un puente hacia una venta, ofreciendo un producto o servicio relevante de forma natural.
+        - "survey_invitation": una invitación agradable y efectiva a completar una encuesta de satisfacción.
+        {'- "closing_line": una frase de cierre para despedir la llamada.' if include_closing else ''}
+        Responde únicamente con un objeto JSON con esta forma, sin texto adicional:
+        {{
+          "sales_bridge": "script de venta",
+          "survey_invitation": "script de encuesta"{closing_field}
+        }}
+        """
+
+
+def parse_structured_suggestions(text, include_closing=True):
+    """Extrae los scripts de la respuesta JSON del modelo; lanza ValueError si no es válida."""
+    data = json.loads(_JSON_FENCE_RE.sub("", text.strip()))
+    if not isinstance(data, dict):
+        raise ValueError("La respuesta JSON no es un objeto.")
+    suggestions = {}
+    for kind in (SALES_BRIDGE, SURVEY_INVITATION):
+        value = data.get(kind)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"Falta '{kind}' en la respuesta JSON.")
+        suggestions[kind] = value.strip()
+    closing_line = data.get(CLOSING_LINE) if include_closing else None
+    suggestions[CLOSING_LINE] = closing_line.strip() if isinstance(closing_line, str) and closing_line.strip() else None
+    return suggestions
+
+
+# --- Caché por tipo de script y resolution_context ---
+def suggestion_cache_key(kind, context, model_name=MODEL_NAME, temperature=SUGGESTION_GENERATION_CONFIG["temperature"]):
+    digest = hashlib.sha256()
+    digest.update(f"{kind}\x00{model_name}\x00{temperature}\x00".encode("utf-8"))
+    digest.update(normalize_text(context).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SuggestionCache(TieredCache):
+    def __init__(self, max_entries=256, db_path=None, db_max_entries=2000, ttl_seconds=7 * 24 * 3600,
+                 blank_context_ttl_seconds=3600):
+        self.blank_context_ttl_seconds = blank_context_ttl_seconds
+        self._blank_context_keys = frozenset(
+            [suggestion_cache_key(kind, "") for kind in SINGLE_PROMPTS]
+            + [_post_resolution_key("", include_closing) for include_closing in (True, False)])
+        super().__init__("suggestion_cache", max_entries=max_entries, db_path=db_path,
+                         db_max_entries=db_max_entries, ttl_seconds=ttl_seconds)
+
+    def ttl_for(self, cache_key):
+        if cache_key in self._blank_context_keys:
+            return self.blank_context_ttl_seconds
+        return self.ttl_seconds
+
+
+# --- Generación ---
+def generate_suggestion(model, kind, context="", suggestion_cache=None, on_partial=None, regenerate=False):
+    """Un script (SALES_BRIDGE o SURVEY_INVITATION) con su propio prompt. Los errores del modelo se propagan.
+
+    Con regenerate se ignora la caché (y se guarda el nuevo resultado).
+    """
+    cache_key = suggestion_cache_key(kind, context)
+    if suggestion_cache is not None and not regenerate:
+        cached_text = suggestion_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+    suggestion, _, total_seconds = generate_text(model, SINGLE_PROMPTS[kind](context), on_partial=on_partial, operation=kind)
+    if suggestion_cache is not None:
+        suggestion_cache.put(cache_key, suggestion, cost_seconds=total_seconds)
+    return suggestion
+
+
+def _post_resolution_key(context, include_closing):
+    return suggestion_cache_key(POST_RESOLUTION if include_closing else f"{POST_RESOLUTION}_sin_cierre", context)
+
+
+def _cached_suggestions(suggestion_cache, context, include_closing):
+    cached = suggestion_cache.get(_post_resolution_key(context, include_closing))
+    if cached is not None:
+        return json.loads(cached)
+    if include_closing:
+        return None  # Los scripts sueltos no traen frase de cierre
+    # Sin frase de cierre sirven también los scripts guardados por separado (respaldo o llamadas individuales)
+    single = {kind: suggestion_cache.get(suggestion_cache_key(kind, context)) for kind in SINGLE_PROMPTS}
+    if any(value is None for value in single.values()):
+        return None
+    single[CLOSING_LINE] = None
+    return single
+
+
+def _store_suggestions(suggestion_cache, context, include_closing, suggestions, cost_seconds):
+    suggestion_cache.put(_post_resolution_key(context, include_closing), json.dumps(suggestions, ensure_ascii=False),
+                         cost_seconds=cost_seconds)
+
+
+def generate_post_resolution(model, context="", suggestion_cache=None, include_closing=True, executor=None,
+                             regenerate=False):
+    """Genera las sugerencias post-resolución en una sola llamada estructurada.
+
+    Si la llamada falla o su JSON no es válido, lanza las llamadas
+    individuales de venta y encuesta a la vez (sin frase de cierre). Solo
+    lanza excepción si no se obtiene ningún script; si falla uno de los dos,
+    queda en None y su error en `errors`. Con regenerate se ignora la caché.
+    """
+    if suggestion_cache is not None and not regenerate:
+        cached = _cached_suggestions(suggestion_cache, context, include_closing)
+        if cached is not None:
+            return PostResolutionSuggestions(source=SOURCE_CACHE, errors={}, **cached)
+
+    start = time.perf_counter()
+    try:
+        response = model.generate_content(structured_suggestions_prompt(context, include_closing),
+                                          generation_config=STRUCTURED_SUGGESTION_GENERATION_CONFIG)
+        suggestions = parse_structured_suggestions(response.text, include_closing)
+    except Exception as e:
+        GEMINI_ERRORS.inc(operation="post_resolution")
+        structured_error = e
+    else:
+        record_gemini_call("post_resolution", time.perf_counter() - start,
+                           usage_metadata=getattr(response, "usage_metadata", None))
+        if suggestion_cache is not None:
+            cost_seconds = time.perf_counter() - start
+            _store_suggestions(suggestion_cache, context, include_closing, suggestions, cost_seconds)
+            for kind in SINGLE_PROMPTS:
+                suggestion_cache.put(suggestion_cache_key(kind, context), suggestions[kind],
+                                     cost_seconds=cost_seconds / len(SINGLE_PROMPTS))
+        return PostResolutionSuggestions(source=SOURCE_STRUCTURED, errors={}, **suggestions)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(SINGLE_PROMPTS), thread_name_prefix="suggestion")
+    try:
+        # copy_context: los hilos del executor no heredan el agente (metrics.current_agent) al que se cargan los tokens
+        futures = {kind: executor.submit(contextvars.copy_context().run, generate_suggestion, model, kind, context,
+                                         suggestion_cache, regenerate=regenerate)
+                   for kind in SINGLE_PROMPTS}
+        suggestions, errors = {CLOSING_LINE: None}, {}
+        for kind, future in futures.items():
+            try:
+                suggestions[kind] = future.result()
+            except Exception as e:
+                suggestions[kind] = None
+                errors[kind] = e
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+    if len(errors) == len(futures):
+        raise RuntimeError(f"Falló la llamada estructurada ({structured_error}) y también las individuales "
+                           f"({errors[SALES_BRIDGE]})") from errors[SALES_BRIDGE]
+    if suggestion_cache is not None and not errors and not include_closing:
+        # Con include_closing el respaldo no trae frase de cierre: se reintenta la llamada estructurada la próxima vez
+        _store_suggestions(suggestion_cache, context, include_closing, suggestions, time.perf_counter() - start)
+    return PostResolutionSuggestions(source=SOURCE_FALLBACK, errors=errors, **suggestions)
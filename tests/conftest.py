@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# Los módulos de la app están en la raíz del repositorio (igual que en benchmarks/)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Concurrencia de la capa de datos: muchas sesiones leyendo y escribiendo a la vez sin "database is locked"."""
+
+import random
+import sqlite3
+import threading
+
+import pytest
+
+from database import MIGRATIONS, ScriptsRepository, apply_migrations, get_pool
+
+
+@pytest.fixture
+def repository(tmp_path):
+    db_path = str(tmp_path / "scripts.db")
+    repository = ScriptsRepository(get_pool(db_path))
+    yield repository
+    get_pool(db_path).close()
+
+
+def run_sessions(target, sessions):
+    errors = []
+
+    def session(seed):
+        try:
+            target(seed)
+        except sqlite3.Error as e:
+            errors.append(f"sesión {seed}: {type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=session, args=(seed,)) for seed in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_migrations_are_applied_once(repository):
+    versions = [row['version'] for row in repository.pool.fetch_all("SELECT version FROM schema_migrations ORDER BY version")]
+    assert versions == [version for version, _, _ in MIGRATIONS]
+    assert apply_migrations(repository.pool) == MIGRATIONS[-1][0]
+
+
+def test_concurrent_sessions_read_insert_and_delete(repository):
+    added, deleted = [], []
+    lock = threading.Lock()
+
+    def session(seed):
+        rng = random.Random(seed)
+        own_ids = []
+        for i in range(40):
+            action = rng.random()
+            if action < 0.5:
+                repository.list_frequent(limit=15)
+            elif action < 0.8 or not own_ids:
+                own_ids.append(repository.add(f"Script {seed}-{i}", f"Hola [Nombre Cliente], mensaje {i}"))
+                with lock:
+                    added.append(own_ids[-1])
+            else:
+                script_id = own_ids.pop(rng.randrange(len(own_ids)))
+                repository.delete(script_id)
+                with lock:
+                    deleted.append(script_id)
+
+    assert run_sessions(session, sessions=16) == []
+    remaining = {row['id'] for row in repository.pool.fetch_all("SELECT id FROM frequent_scripts")}
+    assert remaining == set(added) - set(deleted)
+
+
+def test_concurrent_usage_increments_are_not_lost(repository):
+    script_ids = [repository.add(f"Script {i}", "Gracias por llamar, [Nombre Cliente].") for i in range(3)]
+
+    def session(seed):
+        for _ in range(25):
+            repository.increment_usage({script_id: 1 for script_id in script_ids})
+            repository.list_frequent(limit=15)
+
+    assert run_sessions(session, sessions=12) == []
+    assert [repository.get(script_id)['usage_count'] for script_id in script_ids] == [12 * 25] * 3
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Limpieza incremental del prefijo "Frase reescrita:" en streaming, con FakeGenerativeModel troceando la respuesta."""
+
+import pytest
+
+from gemini_models import FakeGenerativeModel, ResilientModel
+from gemini_streaming import REWRITE_PREFIX, StreamedGeneration, generate_text, strip_prefix
+from resilience import ResilientClient
+
+REWRITTEN = "Texto reescrito por el modelo de prueba."
+
+
+def stream_partials(model, prefix=REWRITE_PREFIX):
+    partials = []
+    text, first_token_seconds, total_seconds = generate_text(model, "Reescribe: hola", prefix=prefix,
+                                                             on_partial=partials.append, operation="test_rewrite")
+    assert first_token_seconds is not None and first_token_seconds <= total_seconds
+    return text, partials
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 7, 12, 16, 17, 100])
+def test_prefix_split_across_chunks_never_reaches_partials(chunk_size):
+    text, partials = stream_partials(FakeGenerativeModel(chunk_size=chunk_size))
+
+    assert text == REWRITTEN
+    assert partials and partials[-1] == REWRITTEN
+    for partial in partials:
+        assert not REWRITE_PREFIX.startswith(partial.lower())
+        assert not partial.lower().startswith("frase")
+        assert REWRITTEN.startswith(partial)
+    assert partials == sorted(partials, key=len)
+
+
+@pytest.mark.parametrize("raw", [
+    "FRASE REESCRITA:   Texto reescrito por el modelo de prueba.",
+    "\n  frase reescrita:Texto reescrito por el modelo de prueba.",
+])
+def test_prefix_is_case_and_whitespace_insensitive(raw):
+    text, partials = stream_partials(FakeGenerativeModel(text=raw, chunk_size=3))
+
+    assert text == REWRITTEN
+    assert all(REWRITTEN.startswith(partial) for partial in partials)
+
+
+def test_text_that_only_starts_like_the_prefix_is_kept():
+    raw = "Frase corta sin prefijo."
+    text, partials = stream_partials(FakeGenerativeModel(text=raw, chunk_size=2))
+
+    assert text == raw
+    assert partials[-1] == raw
+    # Mientras podía ser el prefijo no se mostró nada; "Frase c" ya no lo es
+    assert len(partials[0]) >= len("Frase c")
+
+
+def test_without_prefix_partials_are_the_raw_text():
+    model = FakeGenerativeModel(chunk_size=12)
+    text, partials = stream_partials(model, prefix=None)
+
+    assert text == model.text
+    assert partials[0] == model.text[:12]
+
+
+def test_streaming_matches_the_non_streaming_result():
+    model = FakeGenerativeModel(chunk_size=4)
+    text, _, _ = generate_text(model, "Reescribe: hola", prefix=REWRITE_PREFIX, operation="test_rewrite")
+
+    assert text == strip_prefix(model.text, REWRITE_PREFIX) == stream_partials(model)[0]
+
+
+def test_usage_metadata_comes_from_the_last_chunk():
+    generation = StreamedGeneration(FakeGenerativeModel(chunk_size=5), "Reescribe: hola", prefix=REWRITE_PREFIX)
+    list(generation)
+
+    assert generation.text == REWRITTEN
+    assert generation.usage_metadata is not None and generation.usage_metadata.total_token_count > 0
+
+
+def test_resilient_model_keeps_stripping_the_prefix():
+    client = ResilientClient("prueba_streaming", rate_per_second=None, max_retries=10, base_delay_seconds=0.001,
+                             max_delay_seconds=0.005, failure_threshold=100, seed=0)
+    model = ResilientModel(FakeGenerativeModel(chunk_size=3, failure_rate=0.5, seed=2), client)
+
+    text, partials = stream_partials(model)
+
+    assert text == REWRITTEN
+    assert all(REWRITTEN.startswith(partial) for partial in partials)
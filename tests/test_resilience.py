@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""ResilientClient con fallos inyectados: reintentos, clasificación de errores, circuit breaker y plazos."""
+
+import time
+from urllib.error import HTTPError
+
+import pytest
+import speech_recognition as sr
+
+from gemini_models import FakeGenerativeModel, ResilientModel
+from resilience import (CLOSED, HALF_OPEN, OPEN, CircuitOpenError, DeadlineExceededError, ResilientClient,
+                        TokenBucket, is_retryable)
+
+
+def make_client(**options):
+    options = dict(dict(rate_per_second=None, max_retries=3, base_delay_seconds=0.001, max_delay_seconds=0.005,
+                        deadline_seconds=5.0, failure_threshold=3, reset_timeout_seconds=0.05, seed=0), **options)
+    return ResilientClient("prueba", **options)
+
+
+class FlakyCall:
+    """fn para ResilientClient.call que lanza los errores indicados y después devuelve "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+        self.timeouts = []
+
+    def __call__(self, timeout_seconds):
+        self.calls += 1
+        self.timeouts.append(timeout_seconds)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def request_error(cause):
+    try:
+        raise cause
+    except Exception as e:
+        try:
+            raise sr.RequestError(f"recognition request failed: {e}") from e
+        except sr.RequestError as request_error:
+            return request_error
+
+
+def test_transient_errors_are_retried_until_success():
+    client = make_client()
+    fn = FlakyCall(ConnectionError("reset"), TimeoutError("lento"))
+
+    assert client.call(fn) == "ok"
+    assert fn.calls == 3
+    assert all(0 < timeout <= 5.0 for timeout in fn.timeouts)
+    stats = client.stats()
+    assert (stats["calls"], stats["successes"], stats["failures"], stats["retries"]) == (1, 1, 2, 2)
+    assert stats["state"] == CLOSED and stats["consecutive_failures"] == 0
+
+
+def test_non_retryable_error_is_raised_at_once():
+    client = make_client()
+    fn = FlakyCall(ValueError("petición inválida"))
+
+    with pytest.raises(ValueError):
+        client.call(fn)
+    assert fn.calls == 1
+    stats = client.stats()
+    assert (stats["failures"], stats["retries"], stats["state"]) == (0, 0, CLOSED)
+
+
+def test_retries_are_bounded():
+    client = make_client(max_retries=2, failure_threshold=10)
+    fn = FlakyCall(*[ConnectionError("caído")] * 5)
+
+    with pytest.raises(ConnectionError):
+        client.call(fn)
+    assert fn.calls == 3
+    assert client.stats()["retries"] == 2
+
+
+def test_request_error_is_retryable_only_for_transient_causes():
+    assert is_retryable(request_error(HTTPError("https://stt", 503, "Service Unavailable", None, None)))
+    assert is_retryable(request_error(HTTPError("https://stt", 429, "Too Many Requests", None, None)))
+    assert is_retryable(request_error(ConnectionError("connection failed")))
+    assert not is_retryable(request_error(HTTPError("https://stt", 400, "Bad Request", None, None)))
+    assert not is_retryable(sr.RequestError("missing flac converter"))
+    assert not is_retryable(CircuitOpenError("abierto"))
+
+
+def test_circuit_opens_and_recovers_after_probe():
+    client = make_client(max_retries=0)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            client.call(FlakyCall(ConnectionError("caído")))
+    assert client.stats()["state"] == OPEN
+
+    fn = FlakyCall()
+    with pytest.raises(CircuitOpenError):
+        client.call(fn)
+    assert fn.calls == 0
+    assert client.stats()["rejected"] == 1
+
+    time.sleep(0.06)
+    assert client.call(fn) == "ok"
+    stats = client.stats()
+    assert (stats["state"], stats["consecutive_failures"], stats["times_opened"]) == (CLOSED, 0, 1)
+
+
+def test_failed_probe_reopens_the_circuit():
+    client = make_client(max_retries=0, failure_threshold=1)
+    with pytest.raises(ConnectionError):
+        client.call(FlakyCall(ConnectionError("caído")))
+
+    time.sleep(0.06)
+    with pytest.raises(ConnectionError):
+        client.call(FlakyCall(ConnectionError("sigue caído")))
+    stats = client.stats()
+    assert (stats["state"], stats["times_opened"]) == (OPEN, 2)
+
+
+def test_deadline_before_the_probe_releases_it():
+    client = make_client(max_retries=0, failure_threshold=1)
+    with pytest.raises(ConnectionError):
+        client.call(FlakyCall(ConnectionError("caído")))
+
+    time.sleep(0.06)
+    fn = FlakyCall()
+    with pytest.raises(DeadlineExceededError):
+        client.call(fn, deadline_seconds=1e-9)
+    assert fn.calls == 0
+    assert (client.breaker.state, client.breaker.consecutive_failures) == (HALF_OPEN, 1)
+
+    # La prueba no se consumió: la siguiente llamada puede hacerla
+    assert client.call(fn) == "ok"
+    assert client.breaker.state == CLOSED
+
+
+def test_token_bucket_gives_up_after_timeout():
+    bucket = TokenBucket(rate_per_second=1.0, capacity=1)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.01)
+
+
+def test_throttled_call_fails_when_the_deadline_is_shorter_than_the_wait():
+    client = make_client(rate_per_second=1.0, burst=1)
+    assert client.call(FlakyCall()) == "ok"
+    with pytest.raises(DeadlineExceededError):
+        client.call(FlakyCall(), deadline_seconds=0.05)
+    assert client.stats()["deadline_exceeded"] == 1
+
+
+def test_resilient_model_retries_injected_quota_errors():
+    model = FakeGenerativeModel(failure_rate=0.5, seed=1)
+    client = make_client(max_retries=10, failure_threshold=100)
+    resilient_model = ResilientModel(model, client)
+
+    for _ in range(10):
+        assert resilient_model.generate_content("Reescribe: hola").text.startswith("Frase reescrita:")
+    stats = client.stats()
+    assert stats["successes"] == 10
+    assert stats["failures"] == stats["retries"] > 0
+    assert model.calls == 10 + stats["failures"]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Transcripción por fragmentos (VAD + pool de hilos) contra un reconocedor local falso."""
+
+import random
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from recognizers import StubRecognizer
+from transcription_pipeline import frame_rms, iter_speech_chunks, transcribe_all, transcribe_chunks
+
+SAMPLE_RATE = 16000
+
+
+def pcm(*segments):
+    """PCM de 16 bits a partir de (segundos, amplitud): amplitud 0 es silencio, el resto un tono de 440 Hz."""
+    parts = []
+    for seconds, amplitude in segments:
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        parts.append((amplitude * np.sin(2 * np.pi * 440 * t)).astype("<i2"))
+    return np.concatenate(parts).tobytes()
+
+
+class FakeRecognizer:
+    """Devuelve el texto del propio fragmento tras una latencia aleatoria y cuenta los fragmentos en vuelo."""
+
+    def __init__(self, seed=0, empty=(), fail_on=None):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.empty = set(empty)
+        self.fail_on = fail_on
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, chunk, sample_rate, sample_width_bytes):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self._random.uniform(0, 0.02)
+        try:
+            time.sleep(delay)
+            text = chunk.decode()
+            if text == self.fail_on:
+                raise RuntimeError(f"fallo en {text}")
+            return "" if text in self.empty else text
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def test_chunks_are_joined_in_order_with_growing_partials():
+    chunks = [f"f{i}".encode() for i in range(20)]
+    partials = list(transcribe_chunks(chunks, FakeRecognizer(seed=1), SAMPLE_RATE, 2, max_workers=4))
+
+    assert partials[-1].text == " ".join(f"f{i}" for i in range(20))
+    assert partials[-1].chunks_done == partials[-1].chunks_submitted == 20
+    done = [partial.chunks_done for partial in partials]
+    assert done == sorted(done)
+    assert all(partials[-1].text.startswith(partial.text) for partial in partials)
+
+
+def test_empty_results_are_skipped():
+    chunks = [b"hola", b"ruido", b"adios"]
+    partials = list(transcribe_chunks(chunks, FakeRecognizer(empty={"ruido"}), SAMPLE_RATE, 2, max_workers=2))
+    assert partials[-1].text == "hola adios"
+
+
+def test_chunks_are_consumed_lazily_with_bounded_concurrency():
+    pulled = []
+
+    def chunks():
+        for i in range(30):
+            pulled.append(i)
+            yield f"f{i}".encode()
+
+    recognizer = FakeRecognizer(seed=2)
+    stream = transcribe_chunks(chunks(), recognizer, SAMPLE_RATE, 2, max_workers=3)
+    first = next(stream)
+    # Como máximo 2 * max_workers fragmentos en vuelo: el iterable no se consume de golpe
+    assert len(pulled) <= first.chunks_done + 2 * 3
+    assert list(stream)[-1].chunks_done == 30
+    assert recognizer.max_in_flight <= 3
+
+
+def test_recognizer_errors_propagate():
+    chunks = [f"f{i}".encode() for i in range(5)]
+    with pytest.raises(RuntimeError, match="fallo en f2"):
+        list(transcribe_chunks(chunks, FakeRecognizer(fail_on="f2"), SAMPLE_RATE, 2, max_workers=2))
+
+
+def test_vad_cuts_at_silences_and_drops_silent_audio():
+    audio = pcm((0.2, 0), (1.0, 8000), (0.6, 0), (1.0, 8000), (0.6, 0), (0.8, 8000), (0.3, 0))
+    chunks = list(iter_speech_chunks(audio, SAMPLE_RATE, 2))
+    assert len(chunks) == 3
+    assert all(np.abs(np.frombuffer(chunk, dtype="<i2")).max() > 1000 for chunk in chunks)
+    assert list(iter_speech_chunks(pcm((2.0, 0)), SAMPLE_RATE, 2)) == []
+    assert list(iter_speech_chunks(b"", SAMPLE_RATE, 2)) == []
+
+
+def test_vad_never_exceeds_max_chunk_length():
+    audio = pcm((5.0, 8000))
+    chunks = list(iter_speech_chunks(audio, SAMPLE_RATE, 2, max_chunk_seconds=2))
+    assert len(chunks) == 3
+    assert max(len(chunk) for chunk in chunks) <= 2 * SAMPLE_RATE * 2
+    assert b"".join(chunks) == audio
+
+
+def test_frame_rms_matches_a_constant_signal():
+    samples = np.full(1000, -300, dtype="<i2")
+    rms = frame_rms(samples.tobytes(), 2, 480 * 2)
+    assert len(rms) == 3  # 480 + 480 + 40 muestras
+    assert np.allclose(rms, 300)
+
+
+def test_transcribe_all_with_stub_recognizer():
+    audio = pcm((1.0, 8000), (0.6, 0), (1.5, 8000))
+    text = transcribe_all(audio, SAMPLE_RATE, 2, StubRecognizer().transcribe, max_workers=2)
+    assert text.count("fragmento de") == 2
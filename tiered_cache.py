@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de dos niveles: LRU en memoria y, opcionalmente, una tabla SQLite.
+
+Base común de las cachés de transcripción, reescritura y sugerencias; sus
+tablas SQLite se crean con las migraciones de database.py. Las entradas
+expiran por antigüedad (ttl_seconds) y el nivel SQLite se recorta por tamaño
+expulsando las menos usadas recientemente. Cada entrada guarda además su
+"coste" (los segundos que llevó generarla) para contabilizar el tiempo ahorrado
+por los aciertos.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from database import get_pool
+from metrics import SQLITE_QUERY_SECONDS
+
+
+class TieredCache:
+    def __init__(self, table, max_entries=128, db_path=None, db_max_entries=5000, ttl_seconds=None):
+        self.table = table
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.db_max_entries = db_max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # cache_key -> (value, cost_seconds, created_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        self.saved_seconds = 0.0
+        if self.db_path:
+            self._init_db()
+
+    def ttl_for(self, cache_key):
+        # Las subclases pueden acortar la vida de algunas entradas (el barrido de _db_put usa ttl_seconds)
+        return self.ttl_seconds
+
+    def _expired(self, cache_key, created_at, now):
+        ttl_seconds = self.ttl_for(cache_key)
+        return ttl_seconds is not None and now - created_at > ttl_seconds
+
+    # --- Nivel SQLite (a través del pool compartido de database.py) ---
+    def _init_db(self):
+        # La tabla la crean las migraciones numeradas de database.py (MIGRATIONS)
+        self._pool = get_pool(self.db_path)
+
+    def _db_get(self, cache_key, now):
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT value, cost_seconds, created_at FROM {self.table} WHERE cache_key = ?", (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._expired(cache_key, row['created_at'], now):
+                conn.execute(f"DELETE FROM {self.table} WHERE cache_key = ?", (cache_key,))
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_used_at = ? WHERE cache_key = ?", (now, cache_key))
+            return row['value'], row['cost_seconds'], row['created_at']
+
+    def _db_put(self, cache_key, value, cost_seconds, now):
+        with self._pool.transaction() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (cache_key, value, cost_seconds, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cache_key, value, cost_seconds, now, now),
+            )
+            # Expulsión por antigüedad y luego por tamaño (las menos usadas recientemente)
+            if self.ttl_seconds is not None:
+                conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE cache_key IN ("
+                f" SELECT cache_key FROM {self.table} ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.db_max_entries,),
+            )
+
+    # --- API pública ---
+    def get(self, cache_key):
+        """Devuelve el valor cacheado o None. Actualiza los contadores de aciertos/fallos."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry is not None:
+                if not self._expired(cache_key, entry[2], now):
+                    self._memory.move_to_end(cache_key)
+                    self.hits += 1
+                    self.saved_seconds += entry[1]
+                    return entry[0]
+                del self._memory[cache_key]
+        entry = None
+        if self.db_path:
+            try:
+                with SQLITE_QUERY_SECONDS.time(operation=f"{self.table}.get"):
+                    entry = self._db_get(cache_key, now)
+            except sqlite3.Error:
+                entry = None  # El nivel persistente es opcional: un fallo equivale a un fallo de caché
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db_hits += 1
+            self.saved_seconds += entry[1]
+            self._remember(cache_key, entry)
+            return entry[0]
+
+    def put(self, cache_key, value, cost_seconds=0.0):
+        now = time.time()
+        with self._lock:
+            self._remember(cache_key, (value, cost_seconds, now))
+        if self.db_path:
+            try:
+                with SQLITE_QUERY_SECONDS.time(operation=f"{self.table}.put"):
+                    self._db_put(cache_key, value, cost_seconds, now)
+            except sqlite3.Error:
+                pass
+
+    def _remember(self, cache_key, entry):
+        self._memory[cache_key] = entry
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "db_hits": self.db_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "memory_entries": len(self._memory),
+            }
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Caché de transcripciones de voz.
+
+La clave es un hash del audio PCM ya normalizado (mono, 16 kHz, 16 bits) más
+el idioma, de modo que solo una grabación nueva provoca una llamada al
+servicio de reconocimiento de voz. Tiene un nivel LRU en memoria y un nivel
+opcional en SQLite (app_data.db) con expulsión por tamaño y antigüedad.
+"""
+
+import hashlib
+
+from tiered_cache import TieredCache
+
+
+def audio_cache_key(raw_audio_data, sample_rate, sample_width, language, engine=""):
+    """Devuelve la clave de caché para un audio PCM normalizado, un idioma y un motor."""
+    digest = hashlib.sha256()
+    digest.update(f"{sample_rate}:{sample_width}:{language}:{engine}:".encode("utf-8"))
+    digest.update(raw_audio_data)
+    return digest.hexdigest()
+
+
+class TranscriptionCache(TieredCache):
+    def __init__(self, max_entries=128, db_path=None, db_max_entries=5000, db_max_age_seconds=30 * 24 * 3600):
+        super().__init__("transcription_cache", max_entries=max_entries, db_path=db_path,
+                         db_max_entries=db_max_entries, ttl_seconds=db_max_age_seconds)
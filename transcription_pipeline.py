@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Transcripción por fragmentos para grabaciones largas.
+
+El audio PCM normalizado se divide en fragmentos acotados usando un detector de
+actividad de voz (VAD) basado en energía; los fragmentos se transcriben en
+paralelo en un pool de hilos y el texto se une de nuevo en orden, emitiendo
+resultados parciales a medida que llegan.
+
+La función de reconocimiento se inyecta: recibe (raw_audio_data, sample_rate,
+sample_width_bytes) y devuelve el texto ("" si no se entendió nada), lo que
+permite probar el pipeline contra un backend local falso.
+"""
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+PartialTranscript = namedtuple("PartialTranscript", ["chunks_done", "chunks_submitted", "text"])
+
+DEFAULT_FRAME_MS = 30
+DEFAULT_MIN_SILENCE_MS = 400
+DEFAULT_MAX_CHUNK_SECONDS = 20
+# Umbral mínimo de energía (RMS en 16 bits) por debajo del cual un frame es silencio
+DEFAULT_MIN_SILENCE_RMS = 250
+
+# PCM con signo, como lo entrega audio_processing.normalize_for_recognition
+_SAMPLE_DTYPES = {1: np.int8, 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+
+def frame_rms(raw_audio_data, sample_width_bytes, frame_bytes):
+    """RMS de cada frame de `frame_bytes` bytes (el último puede ser más corto), en una pasada con NumPy."""
+    if sample_width_bytes not in _SAMPLE_DTYPES:
+        raise ValueError(f"Ancho de muestra no soportado por el VAD: {sample_width_bytes} bytes.")
+    samples = np.frombuffer(raw_audio_data, dtype=_SAMPLE_DTYPES[sample_width_bytes],
+                            count=len(raw_audio_data) // sample_width_bytes)
+    frame_samples = frame_bytes // sample_width_bytes
+    full_frames = len(samples) // frame_samples
+    frames = samples[:full_frames * frame_samples].reshape(full_frames, frame_samples).astype(np.float32)
+    rms = np.sqrt(np.einsum("ij,ij->i", frames, frames) / frame_samples)
+    tail = samples[full_frames * frame_samples:].astype(np.float32)
+    if len(tail):
+        rms = np.append(rms, np.sqrt(np.dot(tail, tail) / len(tail)))
+    return rms
+
+
+def iter_speech_chunks(raw_audio_data, sample_rate, sample_width_bytes,
+                       frame_ms=DEFAULT_FRAME_MS,
+                       min_silence_ms=DEFAULT_MIN_SILENCE_MS,
+                       max_chunk_seconds=DEFAULT_MAX_CHUNK_SECONDS,
+                       silence_threshold=None):
+    """Genera fragmentos (bytes) de audio con voz, cortando en los silencios.
+
+    Un frame se considera silencio si su RMS está por debajo de
+    `silence_threshold` (por defecto, un umbral adaptativo a partir de la energía
+    media del audio). Se corta en mitad de cada silencio de al menos
+    `min_silence_ms`, y nunca se supera `max_chunk_seconds` por fragmento.
+    Los fragmentos que solo contienen silencio se descartan.
+    """
+    frame_bytes = max(1, int(sample_rate * frame_ms / 1000)) * sample_width_bytes
+    rms = frame_rms(raw_audio_data, sample_width_bytes, frame_bytes)
+    total_frames = len(rms)
+    if total_frames == 0:
+        return
+
+    view = memoryview(raw_audio_data)
+    if silence_threshold is None:
+        silence_threshold = max(DEFAULT_MIN_SILENCE_RMS, 0.25 * float(rms.mean()))
+    rms = rms.tolist()  # El recorrido de abajo es frame a frame: más rápido sobre floats de Python
+
+    min_silence_frames = max(1, min_silence_ms // frame_ms)
+    max_chunk_frames = max(1, int(max_chunk_seconds * 1000 // frame_ms))
+
+    chunk_start = 0
+    has_voice = False
+    silence_run = 0
+    for i in range(total_frames):
+        if rms[i] < silence_threshold:
+            silence_run += 1
+        else:
+            has_voice = True
+            silence_run = 0
+
+        cut_at = None
+        if has_voice and silence_run >= min_silence_frames:
+            cut_at = i + 1 - silence_run // 2
+        elif i + 1 - chunk_start >= max_chunk_frames:
+            cut_at = i + 1
+
+        if cut_at is not None:
+            if has_voice:
+                yield bytes(view[chunk_start * frame_bytes:cut_at * frame_bytes])
+            # Los frames que quedan tras el corte (mitad final del silencio) son silencio
+            chunk_start = cut_at
+            has_voice = False
+            silence_run = i + 1 - cut_at
+
+    if has_voice and chunk_start < total_frames:
+        yield bytes(view[chunk_start * frame_bytes:])
+
+
+def transcribe_chunks(chunks, recognize, sample_rate, sample_width_bytes, max_workers=4, executor=None):
+    """Transcribe los fragmentos en paralelo y genera PartialTranscript en orden.
+
+    `chunks` puede ser cualquier iterable (por ejemplo, iter_speech_chunks); se
+    consume de forma perezosa manteniendo como máximo 2 * max_workers
+    fragmentos en vuelo. Cada PartialTranscript contiene el texto unido de
+    todos los fragmentos consecutivos ya transcritos.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt-chunk")
+    max_in_flight = 2 * max_workers
+
+    chunk_iter = iter(chunks)
+    pending = {}
+    results = {}
+    texts = []
+    submitted = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    chunk = next(chunk_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(recognize, chunk, sample_rate, sample_width_bytes)
+                pending[future] = submitted
+                submitted += 1
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+
+            advanced = False
+            while len(texts) in results:
+                text = results.pop(len(texts))
+                texts.append(text.strip() if text else "")
+                advanced = True
+            if advanced:
+                yield PartialTranscript(len(texts), submitted, " ".join(t for t in texts if t))
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def transcribe_stream(raw_audio_data, sample_rate, sample_width_bytes, recognize, max_workers=4, executor=None, **vad_options):
+    """Atajo: segmenta con VAD y transcribe, generando resultados parciales."""
+    chunks = iter_speech_chunks(raw_audio_data, sample_rate, sample_width_bytes, **vad_options)
+    return transcribe_chunks(chunks, recognize, sample_rate, sample_width_bytes, max_workers=max_workers, executor=executor)
+
+
+def transcribe_all(raw_audio_data, sample_rate, sample_width_bytes, recognize, **options):
+    """Transcribe el audio completo y devuelve solo el texto final."""
+    text = ""
+    for partial in transcribe_stream(raw_audio_data, sample_rate, sample_width_bytes, recognize, **options):
+        text = partial.text
+    return text